@@ -1,26 +1,209 @@
 import os
-from flask import Flask, render_template, request, redirect, url_for, flash, session
-from cine_traker import TraktAuth, User
-from dotenv import load_dotenv
-from errors.error import *
-
-app = Flask(__name__)
-app.secret_key = os.getenv('FLASH_SECRET')
-
-load_dotenv()
-# Para crear instancia de TraktAuth
-CLIENT_ID = os.getenv('CLIENT_ID')
-CLIENT_SECRET = os.getenv('SECRET_ID')
-REDIRECT_URI = os.getenv('REDIRECT_URI')
-trakt_auth = TraktAuth(CLIENT_ID, CLIENT_SECRET, REDIRECT_URI)
-
-@app.route('/')
+import threading
+import time
+from dataclasses import asdict
+from datetime import datetime, timezone
+from functools import partial
+from typing import TYPE_CHECKING, Callable
+from flask import (Flask, Response, abort, current_app, g, jsonify, render_template, stream_template, request,
+                   redirect, send_file, url_for, flash, session)
+from movie_lists import get_list_spec, related_spec
+from movie_index import SORTS
+from cache import get_response_cache
+from session_store import UserSession, get_session_store
+from http_cache import CachedPage, list_etag, response_cache_key
+from metrics import (http_request_seconds, registry, render_seconds, response_cache_requests,
+                     server_timing_header, start_request_timing, timed)
+from errors.error import (ApiRequestError, ApiRequestProfileError, ErrorFetchImage, ImageNotFoundError,
+                          ListNotFoundError, RateLimitError, TokenRequestError)
+from view_helpers import (IMAGE_MAX_AGE, MAX_PER_PAGE, RATE_LIMIT_RETRY_AFTER, card_image, get_list_query,
+                          get_page_args)
+
+if TYPE_CHECKING:
+    from cine_traker import TraktAuth, User
+
+# Arranque rápido (serverless, autoescalado): aquí solo se importa lo liviano. Los clientes de
+# Trakt y TMDB (requests), el proxy de imágenes (Pillow) y el precargador se importan y crean
+# con la primera solicitud que los usa, así que `/` se sirve sin cargarlos.
+
+# Rutas de la aplicación; create_app las registra en cada instancia
+ROUTES: list[tuple[str, Callable, dict]] = []
+
+
+def route(rule: str, **options):
+    """Como app.route, pero guarda la vista para registrarla en create_app."""
+    def decorator(view: Callable) -> Callable:
+        ROUTES.append((rule, view, options))
+        return view
+    return decorator
+
+
+def create_app(config: dict | None = None) -> Flask:
+    """Crea la aplicación con la configuración del entorno (y del .env); `config` la
+    sobrescribe, p. ej. en los benchmarks."""
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    app = Flask(__name__)
+    app.secret_key = os.getenv('FLASH_SECRET')
+    app.config.update(
+        # Para crear instancia de TraktAuth
+        CLIENT_ID=os.getenv('CLIENT_ID'),
+        CLIENT_SECRET=os.getenv('SECRET_ID'),
+        REDIRECT_URI=os.getenv('REDIRECT_URI'),
+        # Paginación de las listas del usuario
+        LIST_PER_PAGE=int(os.getenv('LIST_PER_PAGE', 50)),
+        # Listas que se muestran en el panel principal y cuántas películas de cada una
+        DASHBOARD_LISTS=os.getenv('DASHBOARD_LISTS', 'watchlist,trend,cinema,recommended').split(','),
+        DASHBOARD_PER_LIST=int(os.getenv('DASHBOARD_PER_LIST', 10)),
+        # Segundos que se guarda el HTML ya renderizado de una página de lista
+        RESPONSE_CACHE_TTL=float(os.getenv('RESPONSE_CACHE_TTL', 600)),
+        # Las listas globales (tendencia, favoritas, cartelera, próximas) se precargan al arrancar y se
+        # actualizan en segundo plano; CACHE_WARMER=0 si se usa warm_cache.py en un proceso aparte
+        CACHE_WARMER=os.getenv('CACHE_WARMER', '1') != '0',
+    )
+    app.config.update(config or {})
+
+    app.before_request(start_timing)
+    app.after_request(add_server_timing)
+    app.add_template_filter(partial(card_image, url_for=url_for), 'card_image')
+    for rule, view, options in ROUTES:
+        app.add_url_rule(rule, view_func=view, **options)
+    if app.config['CACHE_WARMER']:
+        # En otro hilo: importar los clientes no retrasa la primera respuesta
+        threading.Thread(target=start_cache_warmer, name='cache-warmer-start', daemon=True).start()
+    return app
+
+
+def start_cache_warmer():
+    from cache_warmer import get_cache_warmer
+
+    get_cache_warmer().start()
+
+
+_app: Flask | None = None
+
+
+def __getattr__(name: str):
+    """`app:app` (flask run, gunicorn, los benchmarks) sigue funcionando: la aplicación se
+    crea la primera vez que se pide."""
+    global _app
+    if name != 'app':
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    if _app is None:
+        _app = create_app()
+    return _app
+
+
+def get_trakt_auth() -> 'TraktAuth':
+    """Cliente de autenticación de la aplicación, creado con el primer uso."""
+    trakt_auth = current_app.extensions.get('trakt_auth')
+    if trakt_auth is None:
+        from cine_traker import TraktAuth
+
+        config = current_app.config
+        trakt_auth = TraktAuth(config['CLIENT_ID'], config['CLIENT_SECRET'], config['REDIRECT_URI'])
+        current_app.extensions['trakt_auth'] = trakt_auth
+    return trakt_auth
+
+
+def start_timing():
+    g.request_start = time.perf_counter()
+    g.timings = start_request_timing()
+
+def add_server_timing(response):
+    """Registra la duración de la solicitud y agrega el header Server-Timing con el tiempo
+    de cada etapa (Trakt, TMDB, posters...). En las páginas en streaming solo cuenta lo
+    ocurrido antes de enviar el primer byte."""
+    elapsed = time.perf_counter() - g.request_start
+    http_request_seconds.observe(elapsed, endpoint=request.endpoint or 'none', method=request.method,
+                                 status=response.status_code)
+    response.headers['Server-Timing'] = server_timing_header(g.timings, elapsed)
+    return response
+
+def rate_limited(err: RateLimitError):
+    """Página 503 con Retry-After cuando el planificador no consiguió cupo a tiempo: el
+    usuario ve el aviso en lugar de un error 500 y el navegador puede reintentar."""
+    flash(err.args[0], err.args[1])
+    response = Response(render_template("base_main.html"), status=503, mimetype='text/html')
+    response.retry_after = RATE_LIMIT_RETRY_AFTER
+    return response
+
+
+def get_user_session() -> UserSession | None:
+    """Sesión del usuario en el almacén del servidor (la cookie solo guarda su id). Renueva
+    el token si está por vencer; None si no ha iniciado sesión o la sesión ya no sirve."""
+    store = get_session_store()
+    if 'sid' not in session and 'access_token' in session:
+        # Cookie anterior al almacén de sesiones: se migra sin pedir que inicie sesión de nuevo
+        user_session = store.create({'access_token': session.pop('access_token')}, session.pop('profile', None))
+        session['sid'] = user_session.session_id
+    user_session = store.get(session.get('sid'))
+    if user_session is None:
+        session.pop('sid', None)
+        return None
+    if user_session.needs_refresh(store.refresh_margin):
+        try:
+            user_session = store.refresh(user_session, get_trakt_auth().refresh_access_token)
+        except TokenRequestError:
+            if user_session.is_expired():
+                store.delete(user_session.session_id)
+                session.pop('sid', None)
+                return None
+            # El token actual sigue sirviendo: se reintenta la renovación en la próxima solicitud
+    return user_session
+
+
+def get_user() -> 'User | None':
+    """Cliente del usuario de la sesión; se conserva entre solicitudes mientras el token no cambie."""
+    user_session = get_user_session()
+    if user_session is None:
+        return None
+    user = user_session.state.get('user')
+    if user is None:
+        from cine_traker import User
+
+        user = User(current_app.config['CLIENT_ID'], user_session.access_token, user_session.profile)
+        user_session.state['user'] = user
+    return user
+
+@route('/img/<path:tmdb_path>')
+def tmdb_image(tmdb_path):
+    """Sirve una imagen de TMDB desde la caché en disco, redimensionada (?w=) y en el
+    formato más liviano que acepte el navegador."""
+    from image_proxy import CARD_IMAGE_WIDTH, IMAGE_WIDTHS, choose_format, get_image_proxy
+
+    width = request.args.get('w', CARD_IMAGE_WIDTH, type=int)
+    if width not in IMAGE_WIDTHS:
+        abort(404)
+    fmt = choose_format(request.headers.get('Accept', ''))
+    try:
+        path, mimetype = get_image_proxy().get_variant(tmdb_path, width, fmt)
+    except ImageNotFoundError:
+        abort(404)
+    except ErrorFetchImage:
+        abort(502)
+    response = send_file(path, mimetype=mimetype, max_age=IMAGE_MAX_AGE, conditional=True)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    response.vary.add('Accept')
+    return response
+
+@route('/metrics')
+def metrics():
+    """Métricas del proceso en formato Prometheus; con METRICS_TOKEN se exige ese token."""
+    token = os.getenv('METRICS_TOKEN')
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        abort(401)
+    return Response(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@route('/')
 def url_auth():
     # Generar la URL de autorización
-    auth_url = trakt_auth.get_authorization_url()
+    auth_url = get_trakt_auth().get_authorization_url()
     return render_template('auth_template.html', auth_url=auth_url)
 
-@app.route('/get-token', methods=['POST'])
+@route('/get-token', methods=['POST'])
 def get_token():
     # Obtener el código ingresado por el usuario en el formulario
     auth_code = request.form.get('auth_code')
@@ -30,26 +213,42 @@ def get_token():
         return redirect(url_for('url_auth'))
 
     try:
-        # Obtener el token de acceso usando el código de autorización
-        access_token = trakt_auth.get_access_token(auth_code)
-        session['access_token'] = access_token
+        # Obtener los tokens (acceso y renovación) usando el código de autorización
+        from cine_traker import TraktApi
+        from cache_warmer import get_cache_warmer
+
+        token_data = get_trakt_auth().request_token(auth_code)
+        # Resolver el perfil una sola vez y reutilizarlo en todas las rutas
+        profile = TraktApi(current_app.config['CLIENT_ID'], token_data['access_token']).get_user_info()
+        store = get_session_store()
+        if 'sid' in session:
+            store.delete(session['sid'])
+        user_session = store.create(token_data, profile)
+        session.pop('access_token', None)
+        session.pop('profile', None)
+        session['sid'] = user_session.session_id
+        # Adelanta sus listas mientras ve el inicio
+        get_cache_warmer().prefetch_user(user_session.access_token, profile)
         flash("Bienvenido", "success")
         return redirect(url_for('home'))
-    except TokenRequestError as err:
+    except (TokenRequestError, ApiRequestProfileError) as err:
         flash(err.args[0], err.args[1])
         return redirect(url_for('url_auth'))
 
-@app.route("/home_page")
+@route("/home_page")
 def home():
-    if 'access_token' not in session:
+    user = get_user()
+    if user is None:
         flash("Debes iniciar sesión para acceder a esta página.", "error")
         return redirect(url_for('url_auth'))
 
     try:
-        user = User(CLIENT_ID, session['access_token'])
-        user.get_watch_list()  # Llama al método para obtener las listas del usuario (no lo retornamos)
-        #Llamar todo los metodos de lista del usuario, pero no los retornamos aun
-        return render_template("base_main.html")  # Renderiza una plantilla que sirva como menú principal
+        # Todas las listas del panel se cargan en paralelo y comparten la consulta de posters
+        names = current_app.config['DASHBOARD_LISTS']
+        dashboard, errors = user.get_dashboard(names, current_app.config['DASHBOARD_PER_LIST'])
+        with timed(render_seconds, 'render', template='dashboard.html'):
+            return render_template("dashboard.html", lists=[get_list_spec(name) for name in names],
+                                   dashboard=dashboard, errors=errors)
     except ErrorFetchImage as err:
         flash(err.args[0], err.args[1])
         return render_template("base_main.html")  # Renderiza la plantilla de inicio con un mensaje de error
@@ -57,86 +256,132 @@ def home():
         flash("Ha ocurrido un error inesperado. Por favor, inténtalo de nuevo.", "error")
         return render_template("base_main.html")  # Renderiza la plantilla de inicio
 
+@route("/api/dashboard")
+def dashboard_api():
+    """Devuelve en un solo JSON varias listas con sus posters (?lists=trend,watchlist)."""
+    user = get_user()
+    if user is None:
+        return jsonify({"error": "Debes iniciar sesión para acceder a esta página."}), 401
 
-@app.route('/watch-list')
-def watchlist():
-    if 'access_token' not in session:
-        flash("Debes iniciar sesión para acceder a esta página.", "error")
-        return redirect(url_for('url_auth'))
+    names = request.args.get('lists')
+    names = names.split(',') if names else current_app.config['DASHBOARD_LISTS']
+    per_list = request.args.get('per_list', current_app.config['DASHBOARD_PER_LIST'], type=int)
+    per_list = min(max(1, per_list), MAX_PER_PAGE)
+    try:
+        dashboard, errors = user.get_dashboard(names, per_list)
+    except ListNotFoundError as err:
+        return jsonify({"error": err.args[0]}), 404
+    except RateLimitError as err:
+        return jsonify({"error": err.args[0]}), 503, {'Retry-After': str(RATE_LIMIT_RETRY_AFTER)}
+    return jsonify({
+        "lists": {name: {"title": get_list_spec(name).title, "movies": [asdict(movie) for movie in movies]}
+                  for name, movies in dashboard.items()},
+        "errors": errors,
+    })
 
-    user = User(CLIENT_ID, session['access_token'])  # Usar el token de acceso de la sesión
-    movies_data = user.get_watch_list()  # Obtener la lista de películas por ver
-    return render_template('base_card_movie.html', list_title="Películas por ver", movies=movies_data)
 
-@app.route('/watched-list')
-def watchedlist():
-    if 'access_token' not in session:
+def render_movie_list(name: str, movie_id: int | None = None):
+    """Renderiza (en streaming) la página visible de cualquier lista del registro
+    (con `movie_id`, la de relacionadas con esa película).
+
+    La página se versiona con un ETag calculado antes de pedir posters: si el navegador
+    ya tiene esa versión se responde 304 y, si el servidor ya la renderizó, se reutiliza
+    el HTML guardado en la caché de respuestas."""
+    user = get_user()
+    if user is None:
         flash("Debes iniciar sesión para acceder a esta página.", "error")
         return redirect(url_for('url_auth'))
 
-    user = User(CLIENT_ID, session['access_token'])  # Usar el token de acceso de la sesión
-    movies_data = user.get_watched_list()  # Obtener la lista de películas por ver
-    return render_template('base_card_movie.html', list_title="Películas Vistas", movies=movies_data)
+    try:
+        spec = get_list_spec(name) if movie_id is None else related_spec(movie_id)
+    except ListNotFoundError:
+        abort(404)
+    page, per_page = get_page_args(request.args, current_app.config['LIST_PER_PAGE'])
+    query = get_list_query(request.args)
+    try:
+        movies, pagination = user.get_page_movies(spec, page, per_page, query)
+    except RateLimitError as err:
+        return rate_limited(err)
+    except ApiRequestError:
+        if movie_id is None:
+            raise
+        abort(404)  # Trakt no conoce la película (o el id no es válido)
+    etag = list_etag(spec, page, per_page, movies, query)
+    key = response_cache_key(spec, user.access_token, page, per_page, query)
+    cached = get_response_cache().get(key)
 
-@app.route('/trend-list')
-def trendlist():
-    if 'access_token' not in session:
-        flash("Debes iniciar sesión para acceder a esta página.", "error")
-        return redirect(url_for('url_auth'))
+    if request.if_none_match.contains(etag):
+        response_cache_requests.inc(result='not_modified')
+        response = Response(status=304)
+    elif cached is not None and cached.etag == etag:
+        response_cache_requests.inc(result='hit')
+        response = Response(cached.body, mimetype='text/html')
+        response.last_modified = cached.last_modified
+    else:
+        response_cache_requests.inc(result='miss')
+        last_modified = datetime.now(timezone.utc).replace(microsecond=0)
+        stream = stream_template('base_card_movie.html', list_title=spec.title,
+                                 movies=user.iter_enriched_movies(movies, spec.name), pagination=pagination,
+                                 query=query, sorts=SORTS)
+        ttl = current_app.config['RESPONSE_CACHE_TTL']
+        response = Response(cache_rendered_page(stream, key, etag, last_modified, ttl), mimetype='text/html')
+        response.last_modified = last_modified
 
-    user = User(CLIENT_ID, session['access_token'])  # Usar el token de acceso de la sesión
-    movies_data = user.get_trend_list()  # Obtener la lista de películas por ver
-    return render_template('base_card_movie.html', list_title="Películas en Tendencia", movies=movies_data)
+    response.set_etag(etag)
+    # Contenido por usuario: el navegador puede guardarlo pero debe revalidar cada vez
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    response.vary.add('Cookie')
+    return response.make_conditional(request)
 
-@app.route('/favorited-list')
-def favlist():
-    if 'access_token' not in session:
-        flash("Debes iniciar sesión para acceder a esta página.", "error")
-        return redirect(url_for('url_auth'))
+def cache_rendered_page(chunks, key: tuple, etag: str, last_modified: datetime, ttl: float):
+    """Reenvía los fragmentos del streaming y guarda el HTML completo al terminar."""
+    body = []
+    with timed(render_seconds, template='base_card_movie.html'):
+        for chunk in chunks:
+            body.append(chunk)
+            yield chunk
+    get_response_cache().set(key, CachedPage(etag, last_modified, ''.join(body)), ttl)
 
-    user = User(CLIENT_ID, session['access_token'])  # Usar el token de acceso de la sesión
-    movies_data = user.get_favorited_list()  # Obtener la lista de películas por ver
-    return render_template('base_card_movie.html', list_title="Películas Favoritas", movies=movies_data)
+@route('/list/<name>')
+def movie_list(name):
+    return render_movie_list(name)
 
-@app.route('/cinema-list')
-def cinelist():
-    if 'access_token' not in session:
-        flash("Debes iniciar sesión para acceder a esta página.", "error")
-        return redirect(url_for('url_auth'))
+@route('/watch-list')
+def watchlist():
+    return render_movie_list('watchlist')
 
-    user = User(CLIENT_ID, session['access_token'])  # Usar el token de acceso de la sesión
-    movies_data = user.get_cinema_list()  # Obtener la lista de películas por ver
-    return render_template('base_card_movie.html', list_title="Películas en Cine", movies=movies_data)
+@route('/watched-list')
+def watchedlist():
+    return render_movie_list('watched')
 
-@app.route('/coming-list')
-def cominglist():
-    if 'access_token' not in session:
-        flash("Debes iniciar sesión para acceder a esta página.", "error")
-        return redirect(url_for('url_auth'))
+@route('/trend-list')
+def trendlist():
+    return render_movie_list('trend')
 
-    user = User(CLIENT_ID, session['access_token'])  # Usar el token de acceso de la sesión
-    movies_data = user.get_anticipated_list()  # Obtener la lista de películas por ver
-    return render_template('base_card_movie.html', list_title="Películas próximas", movies=movies_data)
+@route('/favorited-list')
+def favlist():
+    return render_movie_list('favorited')
 
-@app.route('/recommended-list')
-def recommendedlist():
-    if 'access_token' not in session:
-        flash("Debes iniciar sesión para acceder a esta página.", "error")
-        return redirect(url_for('url_auth'))
+@route('/cinema-list')
+def cinelist():
+    return render_movie_list('cinema')
+
+@route('/coming-list')
+def cominglist():
+    return render_movie_list('anticipated')
 
-    user = User(CLIENT_ID, session['access_token'])  # Usar el token de acceso de la sesión
-    movies_data = user.get_recommended_list()  # Obtener la lista de películas por ver
-    return render_template('base_card_movie.html', list_title="Películas Recomendadas", movies=movies_data)
+@route('/recommended-list')
+def recommendedlist():
+    return render_movie_list('recommended')
 
-@app.route('/related-list')
+@route('/related-list')
 def relatedlist():
-    if 'access_token' not in session:
-        flash("Debes iniciar sesión para acceder a esta página.", "error")
-        return redirect(url_for('url_auth'))
+    return render_movie_list('related')
 
-    user = User(CLIENT_ID, session['access_token'])  # Usar el token de acceso de la sesión
-    movies_data = user.get_related_list()  # Obtener la lista de películas por ver
-    return render_template('base_card_movie.html', list_title="Relacionadas con volver al futuro", movies=movies_data)
+@route('/related-list/<int:trakt_id>')
+def movie_related_list(trakt_id):
+    return render_movie_list('related', trakt_id)
 
 if __name__ == '__main__':
-    app.run(debug=True)
\ No newline at end of file
+    create_app().run(debug=True)
\ No newline at end of file
@@ -0,0 +1,357 @@
+import asyncio
+import os
+import threading
+import time
+from dataclasses import asdict
+from datetime import datetime, timezone
+from functools import partial
+from typing import TYPE_CHECKING, Callable
+from quart import (Quart, Response, abort, current_app, g, jsonify, render_template, request, redirect, send_file,
+                   url_for, flash, session)
+from movie_lists import get_list_spec, related_spec
+from movie_index import SORTS
+from cache import get_response_cache
+from session_store import UserSession, get_session_store
+from http_cache import CachedPage, list_etag, response_cache_key
+from metrics import (http_request_seconds, registry, render_seconds, response_cache_requests,
+                     server_timing_header, start_request_timing, timed)
+from errors.error import (ApiRequestError, ApiRequestProfileError, ErrorFetchImage, ImageNotFoundError,
+                          ListNotFoundError, RateLimitError, TokenRequestError)
+from view_helpers import (IMAGE_MAX_AGE, MAX_PER_PAGE, RATE_LIMIT_RETRY_AFTER, card_image, get_list_query,
+                          get_page_args)
+
+if TYPE_CHECKING:
+    from async_cine_traker import AsyncTraktAuth, AsyncUser
+
+# Modo de servicio asíncrono (ASGI): mismas rutas y plantillas que app.py, pero las
+# llamadas a Trakt y TMDB no bloquean un worker. Ejecutar con: uvicorn asgi_app:app
+# (o uvicorn --factory asgi_app:create_app). Como en app.py, los clientes, httpx y el
+# proxy de imágenes se importan con la primera solicitud que los usa.
+
+ROUTES: list[tuple[str, Callable, dict]] = []
+
+
+def route(rule: str, **options):
+    """Como app.route, pero guarda la vista para registrarla en create_app."""
+    def decorator(view: Callable) -> Callable:
+        ROUTES.append((rule, view, options))
+        return view
+    return decorator
+
+
+def create_app(config: dict | None = None) -> Quart:
+    """Crea la aplicación ASGI (ver app.create_app)."""
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    app = Quart(__name__)
+    app.secret_key = os.getenv('FLASH_SECRET')
+    app.config.update(
+        CLIENT_ID=os.getenv('CLIENT_ID'),
+        CLIENT_SECRET=os.getenv('SECRET_ID'),
+        REDIRECT_URI=os.getenv('REDIRECT_URI'),
+        LIST_PER_PAGE=int(os.getenv('LIST_PER_PAGE', 50)),
+        DASHBOARD_LISTS=os.getenv('DASHBOARD_LISTS', 'watchlist,trend,cinema,recommended').split(','),
+        DASHBOARD_PER_LIST=int(os.getenv('DASHBOARD_PER_LIST', 10)),
+        RESPONSE_CACHE_TTL=float(os.getenv('RESPONSE_CACHE_TTL', 600)),
+        CACHE_WARMER=os.getenv('CACHE_WARMER', '1') != '0',
+    )
+    app.config.update(config or {})
+
+    app.before_request(start_timing)
+    app.after_request(add_server_timing)
+    app.add_template_filter(partial(card_image, url_for=url_for), 'card_image')
+    for rule, view, options in ROUTES:
+        app.add_url_rule(rule, view_func=view, **options)
+    if app.config['CACHE_WARMER']:
+        threading.Thread(target=start_cache_warmer, name='cache-warmer-start', daemon=True).start()
+    return app
+
+
+def start_cache_warmer():
+    from cache_warmer import get_cache_warmer
+
+    get_cache_warmer().start()
+
+
+_app: Quart | None = None
+
+
+def __getattr__(name: str):
+    """`asgi_app:app` sigue funcionando: la aplicación se crea la primera vez que se pide."""
+    global _app
+    if name != 'app':
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    if _app is None:
+        _app = create_app()
+    return _app
+
+
+def get_trakt_auth() -> 'AsyncTraktAuth':
+    """Cliente de autenticación de la aplicación, creado con el primer uso."""
+    trakt_auth = current_app.extensions.get('trakt_auth')
+    if trakt_auth is None:
+        from async_cine_traker import AsyncTraktAuth
+
+        config = current_app.config
+        trakt_auth = AsyncTraktAuth(config['CLIENT_ID'], config['CLIENT_SECRET'], config['REDIRECT_URI'])
+        current_app.extensions['trakt_auth'] = trakt_auth
+    return trakt_auth
+
+
+async def start_timing():
+    g.request_start = time.perf_counter()
+    g.timings = start_request_timing()
+
+async def add_server_timing(response):
+    """Registra la duración de la solicitud y agrega el header Server-Timing (ver app.py)."""
+    elapsed = time.perf_counter() - g.request_start
+    http_request_seconds.observe(elapsed, endpoint=request.endpoint or 'none', method=request.method,
+                                 status=response.status_code)
+    response.headers['Server-Timing'] = server_timing_header(g.timings, elapsed)
+    return response
+
+async def get_user_session() -> UserSession | None:
+    """Sesión del usuario en el almacén del servidor, con el token renovado si está por
+    vencer (ver app.get_user_session)."""
+    store = get_session_store()
+    if 'sid' not in session and 'access_token' in session:
+        user_session = await asyncio.to_thread(store.create, {'access_token': session.pop('access_token')},
+                                               session.pop('profile', None))
+        session['sid'] = user_session.session_id
+    user_session = await store.get_async(session.get('sid'))
+    if user_session is None:
+        session.pop('sid', None)
+        return None
+    if user_session.needs_refresh(store.refresh_margin):
+        try:
+            user_session = await store.refresh_async(user_session, get_trakt_auth().refresh_access_token)
+        except TokenRequestError:
+            if user_session.is_expired():
+                await asyncio.to_thread(store.delete, user_session.session_id)
+                session.pop('sid', None)
+                return None
+    return user_session
+
+
+async def get_user() -> 'AsyncUser | None':
+    """Cliente del usuario de la sesión, o None si no ha iniciado sesión."""
+    user_session = await get_user_session()
+    if user_session is None:
+        return None
+    user = user_session.state.get('async_user')
+    if user is None:
+        from async_cine_traker import AsyncUser
+
+        user = AsyncUser(current_app.config['CLIENT_ID'], user_session.access_token, user_session.profile)
+        user_session.state['async_user'] = user
+    return user
+
+
+async def rate_limited(err: RateLimitError):
+    """Página 503 con Retry-After cuando no hubo cupo a tiempo (ver app.rate_limited)."""
+    await flash(err.args[0], err.args[1])
+    response = Response(await render_template("base_main.html"), status=503, mimetype='text/html')
+    response.retry_after = RATE_LIMIT_RETRY_AFTER
+    return response
+
+
+async def login_required():
+    await flash("Debes iniciar sesión para acceder a esta página.", "error")
+    return redirect(url_for('url_auth'))
+
+
+@route('/img/<path:tmdb_path>')
+async def tmdb_image(tmdb_path):
+    """Sirve una imagen de TMDB desde la caché en disco (ver app.tmdb_image)."""
+    from image_proxy import CARD_IMAGE_WIDTH, IMAGE_WIDTHS, choose_format, get_image_proxy
+
+    width = request.args.get('w', CARD_IMAGE_WIDTH, type=int)
+    if width not in IMAGE_WIDTHS:
+        abort(404)
+    fmt = choose_format(request.headers.get('Accept', ''))
+    try:
+        # La descarga y el redimensionado bloquean, así que van en un hilo aparte
+        path, mimetype = await asyncio.to_thread(get_image_proxy().get_variant, tmdb_path, width, fmt)
+    except ImageNotFoundError:
+        abort(404)
+    except ErrorFetchImage:
+        abort(502)
+    response = await send_file(path, mimetype=mimetype, cache_timeout=IMAGE_MAX_AGE, conditional=True)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    response.vary.add('Accept')
+    return response
+
+@route('/metrics')
+async def metrics():
+    """Métricas del proceso en formato Prometheus; con METRICS_TOKEN se exige ese token."""
+    token = os.getenv('METRICS_TOKEN')
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        abort(401)
+    return Response(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@route('/')
+async def url_auth():
+    auth_url = get_trakt_auth().get_authorization_url()
+    return await render_template('auth_template.html', auth_url=auth_url)
+
+@route('/get-token', methods=['POST'])
+async def get_token():
+    auth_code = (await request.form).get('auth_code')
+
+    if not auth_code:
+        await flash('Por favor, ingresa el código de autorización.', "error")
+        return redirect(url_for('url_auth'))
+
+    try:
+        from async_cine_traker import AsyncTraktApi
+        from cache_warmer import get_cache_warmer
+
+        token_data = await get_trakt_auth().request_token(auth_code)
+        profile = await AsyncTraktApi(current_app.config['CLIENT_ID'], token_data['access_token']).get_user_info()
+        store = get_session_store()
+        if 'sid' in session:
+            await asyncio.to_thread(store.delete, session['sid'])
+        user_session = await asyncio.to_thread(store.create, token_data, profile)
+        session.pop('access_token', None)
+        session.pop('profile', None)
+        session['sid'] = user_session.session_id
+        get_cache_warmer().prefetch_user(user_session.access_token, profile)
+        await flash("Bienvenido", "success")
+        return redirect(url_for('home'))
+    except (TokenRequestError, ApiRequestProfileError) as err:
+        await flash(err.args[0], err.args[1])
+        return redirect(url_for('url_auth'))
+
+@route("/home_page")
+async def home():
+    user = await get_user()
+    if user is None:
+        return await login_required()
+    try:
+        names = current_app.config['DASHBOARD_LISTS']
+        dashboard, errors = await user.get_dashboard(names, current_app.config['DASHBOARD_PER_LIST'])
+        with timed(render_seconds, 'render', template='dashboard.html'):
+            return await render_template("dashboard.html", lists=[get_list_spec(name) for name in names],
+                                         dashboard=dashboard, errors=errors)
+    except ErrorFetchImage as err:
+        await flash(err.args[0], err.args[1])
+        return await render_template("base_main.html")
+    except Exception:
+        await flash("Ha ocurrido un error inesperado. Por favor, inténtalo de nuevo.", "error")
+        return await render_template("base_main.html")
+
+@route("/api/dashboard")
+async def dashboard_api():
+    """Devuelve en un solo JSON varias listas con sus posters (?lists=trend,watchlist)."""
+    user = await get_user()
+    if user is None:
+        return jsonify({"error": "Debes iniciar sesión para acceder a esta página."}), 401
+    names = request.args.get('lists')
+    names = names.split(',') if names else current_app.config['DASHBOARD_LISTS']
+    per_list = request.args.get('per_list', current_app.config['DASHBOARD_PER_LIST'], type=int)
+    per_list = min(max(1, per_list), MAX_PER_PAGE)
+    try:
+        dashboard, errors = await user.get_dashboard(names, per_list)
+    except ListNotFoundError as err:
+        return jsonify({"error": err.args[0]}), 404
+    except RateLimitError as err:
+        return jsonify({"error": err.args[0]}), 503, {'Retry-After': str(RATE_LIMIT_RETRY_AFTER)}
+    return jsonify({
+        "lists": {name: {"title": get_list_spec(name).title, "movies": [asdict(movie) for movie in movies]}
+                  for name, movies in dashboard.items()},
+        "errors": errors,
+    })
+
+async def render_movie_list(name: str, movie_id: int | None = None):
+    """Renderiza la página visible de cualquier lista del registro, con ETag y caché
+    de respuestas (ver app.render_movie_list)."""
+    user = await get_user()
+    if user is None:
+        return await login_required()
+    try:
+        spec = get_list_spec(name) if movie_id is None else related_spec(movie_id)
+    except ListNotFoundError:
+        abort(404)
+    page, per_page = get_page_args(request.args, current_app.config['LIST_PER_PAGE'])
+    query = get_list_query(request.args)
+    try:
+        movies, pagination = await user.get_page_movies(spec, page, per_page, query)
+    except RateLimitError as err:
+        return await rate_limited(err)
+    except ApiRequestError:
+        if movie_id is None:
+            raise
+        abort(404)  # Trakt no conoce la película (o el id no es válido)
+    etag = list_etag(spec, page, per_page, movies, query)
+    key = response_cache_key(spec, user.access_token, page, per_page, query)
+    cached = get_response_cache().get(key)
+
+    if request.if_none_match.contains(etag):
+        response_cache_requests.inc(result='not_modified')
+        response = Response('', status=304)
+    elif cached is not None and cached.etag == etag:
+        response_cache_requests.inc(result='hit')
+        response = Response(cached.body, mimetype='text/html')
+        response.last_modified = cached.last_modified
+    else:
+        response_cache_requests.inc(result='miss')
+        last_modified = datetime.now(timezone.utc).replace(microsecond=0)
+        movies_data = await user.enrich_movies(movies, spec.name)
+        with timed(render_seconds, 'render', template='base_card_movie.html'):
+            body = await render_template('base_card_movie.html', list_title=spec.title, movies=movies_data,
+                                         pagination=pagination, query=query, sorts=SORTS)
+        get_response_cache().set(key, CachedPage(etag, last_modified, body),
+                                 current_app.config['RESPONSE_CACHE_TTL'])
+        response = Response(body, mimetype='text/html')
+        response.last_modified = last_modified
+
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    response.vary.add('Cookie')
+    return await response.make_conditional(request)
+
+@route('/list/<name>')
+async def movie_list(name):
+    return await render_movie_list(name)
+
+@route('/watch-list')
+async def watchlist():
+    return await render_movie_list('watchlist')
+
+@route('/watched-list')
+async def watchedlist():
+    return await render_movie_list('watched')
+
+@route('/trend-list')
+async def trendlist():
+    return await render_movie_list('trend')
+
+@route('/favorited-list')
+async def favlist():
+    return await render_movie_list('favorited')
+
+@route('/cinema-list')
+async def cinelist():
+    return await render_movie_list('cinema')
+
+@route('/coming-list')
+async def cominglist():
+    return await render_movie_list('anticipated')
+
+@route('/recommended-list')
+async def recommendedlist():
+    return await render_movie_list('recommended')
+
+@route('/related-list')
+async def relatedlist():
+    return await render_movie_list('related')
+
+@route('/related-list/<int:trakt_id>')
+async def movie_related_list(trakt_id):
+    return await render_movie_list('related', trakt_id)
+
+if __name__ == '__main__':
+    create_app().run(debug=True)
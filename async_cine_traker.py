@@ -0,0 +1,440 @@
+import asyncio
+import os
+import threading
+from functools import partial
+from errors.error import *
+from cache import AsyncSingleFlight, TieredCache, get_chart_cache, get_image_cache, get_related_cache
+from cine_traker import (RELATED_CACHE_TTL, RELATED_PER_MOVIE, RELATED_SOURCES, ImageTMDB, User, build_pagination,
+                         parse_pagination, parse_profile, rank_related)
+from models import Movie, MovieList
+from movie_lists import CHART, LISTS, RELATED, SYNC, ListSpec, get_list_spec
+from movie_index import MovieIndex, MovieQuery, get_movie_indexes
+from sync_store import get_sync_store, history_rows, watched_rows, watchlist_rows
+from metrics import enriched_movies, enrichment_seconds, image_errors, timed
+from upstream import TMDB_API_URL, TMDB_IMAGE_URL, TRAKT_API_URL
+
+# Versiones asíncronas de los clientes de cine_traker.py para el modo ASGI (asgi_app.py).
+# Comparten las cachés y el almacén local con el modo síncrono.
+
+_trakt_requests = AsyncSingleFlight()
+_tmdb_requests = AsyncSingleFlight()
+
+
+class AsyncHttpClient:
+    """Base de los clientes asíncronos: el cliente httpx compartido se crea con la primera
+    solicitud (ver HttpClient)."""
+    def __init__(self, http=None):
+        self._http = http
+
+    @property
+    def http(self):
+        if self._http is None:
+            from http_session import get_async_http_client
+            self._http = get_async_http_client()
+        return self._http
+
+
+class AsyncTraktAuth(AsyncHttpClient):
+    def __init__(self, CLIENT_ID: str, CLIENT_SECRET: str, REDIRECT_URI: str, http=None):
+        super().__init__(http)
+        self.CLIENT_ID: str = CLIENT_ID
+        self.CLIENT_SECRET: str = CLIENT_SECRET
+        self.REDIRECT_URI = REDIRECT_URI
+        self.API_URL: str = TRAKT_API_URL
+        self.AUTH_URL: str = f'{self.API_URL}/oauth/authorize'
+        self.TOKEN_URL: str = f'{self.API_URL}/oauth/token'
+
+    def get_authorization_url(self) -> str:
+        """Genera la URL de autorización para redirigir al usuario."""
+        return f'{self.AUTH_URL}?response_type=code&client_id={self.CLIENT_ID}&redirect_uri={self.REDIRECT_URI}'
+
+    async def _request_token(self, data: dict, error_message: str) -> dict:
+        """Hace la solicitud a /oauth/token (ver TraktAuth._request_token)."""
+        data = {
+            **data,
+            'client_id': self.CLIENT_ID,
+            'client_secret': self.CLIENT_SECRET,
+            'redirect_uri': self.REDIRECT_URI,
+        }
+        response = await self.http.post(self.TOKEN_URL, json=data)
+        if response.status_code == 200:
+            return response.json()
+        else:
+            raise TokenRequestError(error_message, "error")
+
+    async def request_token(self, auth_code: str) -> dict:
+        """Intercambia el código de autorización por los tokens de Trakt."""
+        return await self._request_token({'code': auth_code, 'grant_type': 'authorization_code'},
+                                         "Error al obtener el token para acceder")
+
+    async def refresh_access_token(self, refresh_token: str) -> dict:
+        """Obtiene un token de acceso nuevo con el token de renovación."""
+        return await self._request_token({'refresh_token': refresh_token, 'grant_type': 'refresh_token'},
+                                         "Error al renovar el token de acceso")
+
+    async def get_access_token(self, auth_code: str) -> str | None:
+        """Intercambia el código de autorización por un token de acceso en Trakt."""
+        self.access_token = (await self.request_token(auth_code))['access_token']
+        return self.access_token
+
+
+class AsyncTraktApi(AsyncHttpClient):
+    def __init__(self, CLIENT_ID: str, access_token: str = None, profile: dict[str, str] | None = None,
+                 http=None):
+        super().__init__(http)
+        self.CLIENT_ID: str = CLIENT_ID
+        self.access_token: str = access_token
+        self.API_URL: str = TRAKT_API_URL
+        self.profile: dict[str, str] | None = profile
+
+    def get_headers(self) -> dict[str, str]:
+        """Genera los headers para las solicitudes a la API de Trakt."""
+        headers = {
+            "trakt-api-version": "2",
+            "trakt-api-key": self.CLIENT_ID
+        }
+        if self.access_token:
+            headers["Authorization"] = f"Bearer {self.access_token}"
+        return headers
+
+    async def _get(self, url: str, error_message: str, params: dict | None = None,
+                   error_class: type[CineTrakerError] = ApiRequestError):
+        """GET a Trakt compartido entre solicitudes idénticas en curso (ver TraktApi._get)."""
+        key = (url, tuple(sorted((params or {}).items())), self.access_token)
+        response = await _trakt_requests.do(key, lambda: self.http.get(url, headers=self.get_headers(), params=params))
+        if response.status_code != 200:
+            raise error_class(error_message, "error")
+        return response
+
+    async def get_user_info(self) -> dict[str, str]:
+        """Obtiene la información del perfil del usuario autenticado."""
+        if self.profile is None:
+            response = await self._get(f"{self.API_URL}/users/settings",
+                                       "Error al obtener el perfil de usuario",
+                                       error_class=ApiRequestProfileError)
+            self.profile = parse_profile(response.json())
+        return self.profile
+
+    async def get_list_items(self, spec: ListSpec) -> list[dict]:
+        """Obtiene los elementos de una lista de Trakt descrita en el registro de listas."""
+        url = f"{self.API_URL}{spec.endpoint}"
+        if "{user_id}" in url:
+            url = url.format(user_id=(await self.get_user_info()).get("user_id"))
+        response = await self._get(url, spec.error_message)
+        return response.json()
+
+    async def get_watched_movies(self) -> list[dict]:
+        """Obtiene las películas YA vistas por el usuario"""
+        return await self.get_list_items(LISTS['watched'])
+
+    async def get_watchlist_movies(self) -> list[dict]:
+        """Obtiene la lista de seguimiento del usuario"""
+        return await self.get_list_items(LISTS['watchlist'])
+
+    async def get_movies_page(self, url: str, page: int, limit: int, error_message: str,
+                              params: dict | None = None) -> tuple[list[dict], dict[str, int]]:
+        """Obtiene una página de una lista de Trakt junto con la información de paginación."""
+        params = {**(params or {}), "page": page, "limit": limit}
+        response = await self._get(url, error_message, params)
+        return parse_pagination(response.headers, response.json(), page, limit)
+
+    async def iter_movies_pages(self, get_page, limit: int = 100):
+        """Recorre página por página una lista de Trakt (ver TraktApi.iter_movies_pages)."""
+        page = 1
+        while True:
+            movies, pagination = await get_page(page, limit)
+            yield movies
+            if page >= pagination["page_count"]:
+                break
+            page += 1
+
+    async def get_last_activities(self) -> dict:
+        """Obtiene las marcas de tiempo de la última actividad del usuario en cada lista."""
+        response = await self._get(f"{self.API_URL}/sync/last_activities",
+                                   "Error al obtener la última actividad del usuario")
+        return response.json()
+
+    async def get_watched_count(self) -> int:
+        """Obtiene cuántas películas distintas vio el usuario, según sus estadísticas."""
+        url = f"{self.API_URL}/users/{(await self.get_user_info()).get('user_id')}/stats"
+        response = await self._get(url, "Error al obtener las estadísticas del usuario")
+        return response.json()['movies']['watched']
+
+    async def get_history_movies_page(self, start_at: str, page: int = 1,
+                                      limit: int = 100) -> tuple[list[dict], dict[str, int]]:
+        """Obtiene una página de las reproducciones de películas posteriores a `start_at`"""
+        return await self.get_movies_page(f"{self.API_URL}/sync/history/movies", page, limit,
+                                          "Error al obtener el historial de películas vistas",
+                                          params={"start_at": start_at})
+
+    async def get_related_movies(self, trakt_id: int, limit: int = 10) -> list[dict]:
+        """Obtiene las películas relacionadas con una película (no depende del usuario)"""
+        url = f"{self.API_URL}{LISTS['related'].endpoint.format(trakt_id=trakt_id)}"
+        response = await self._get(url, LISTS['related'].error_message, {"limit": limit})
+        return response.json()
+
+
+class AsyncImageTMDB(AsyncHttpClient):
+    def __init__(self, cache: TieredCache | None = None, http=None):
+        super().__init__(http)
+        self.api_key = os.getenv('TMDB_ID')
+        self.base_url = TMDB_API_URL
+        self.image_base_url = f"{TMDB_IMAGE_URL}/w500"
+        self.cache: TieredCache = cache if cache is not None else get_image_cache()
+        self.cache_ttl: int = int(os.getenv('TMDB_CACHE_TTL', 7 * 24 * 3600))
+        self.negative_cache_ttl: int = int(os.getenv('TMDB_NEGATIVE_CACHE_TTL', 24 * 3600))
+
+    # Mismo formato de URLs que la versión síncrona
+    parse_backdrops = ImageTMDB.parse_backdrops
+
+    async def get_movie_images(self, movie_id) -> list[str]:
+        """Obtiene las imágenes de una película, usando la caché de metadatos de TMDB."""
+        backdrop_urls = await self.cache.get_async(movie_id)
+        if backdrop_urls is not None:
+            return backdrop_urls
+        return await _tmdb_requests.do(movie_id, lambda: self._load_movie_images(movie_id))
+
+    async def _load_movie_images(self, movie_id) -> list[str]:
+        backdrop_urls = await self.fetch_movie_images(movie_id)
+        ttl = self.cache_ttl if backdrop_urls else self.negative_cache_ttl
+        await self.cache.set_async(movie_id, backdrop_urls, ttl)
+        return backdrop_urls
+
+    async def fetch_movie_images(self, movie_id) -> list[str]:
+        """Consulta a TMDB las imágenes (posters y backdrops) de una película por su ID."""
+        if not self.api_key:
+            raise ValueError("API Key de TMDB no está configurada.")
+        url = f"{self.base_url}/movie/{movie_id}/images"
+        try:
+            response = await self.http.get(url, params={"api_key": self.api_key})
+            response.raise_for_status()
+            return self.parse_backdrops(response.json())
+        except Exception as e:
+            raise ErrorFetchImage(f"Error al realizar la solicitud: {e}", "error")
+
+
+_async_image_tmdb: AsyncImageTMDB | None = None
+_async_image_tmdb_lock = threading.Lock()
+
+
+def get_async_image_tmdb() -> AsyncImageTMDB:
+    """Cliente asíncrono de TMDB compartido por todos los usuarios."""
+    global _async_image_tmdb
+    if _async_image_tmdb is None:
+        with _async_image_tmdb_lock:
+            if _async_image_tmdb is None:
+                _async_image_tmdb = AsyncImageTMDB()
+    return _async_image_tmdb
+
+
+class AsyncUser(AsyncTraktApi):
+    def __init__(self, CLIENT_ID, access_token=None, profile: dict[str, str] | None = None,
+                 max_concurrency: int | None = None, image_tmdb: AsyncImageTMDB | None = None):
+        super().__init__(CLIENT_ID, access_token, profile)
+        self.image_tmdb: AsyncImageTMDB = image_tmdb or get_async_image_tmdb()
+        # Número máximo de solicitudes simultáneas a TMDB al enriquecer una lista
+        self.max_concurrency: int = max_concurrency or int(os.getenv('TMDB_ASYNC_CONCURRENCY', 32))
+
+    async def enrich_movies(self, movies: list[Movie], name: str = '') -> MovieList:
+        """Obtiene los posters de un lote de películas de forma concurrente,
+        conservando el orden original de la lista."""
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def build(movie: Movie) -> Movie:
+            if movie.poster_image is not None:  # Las listas globales ya vienen enriquecidas
+                return movie
+            async with semaphore:
+                try:
+                    movie_images = await self.image_tmdb.get_movie_images(movie.tmdb_id)
+                except ErrorFetchImage as e:
+                    image_errors.inc()
+                    print(f"Error al obtener imágenes para {movie.title}: {e}")
+                    movie_images = []  # Imagen por defecto (ver User._build_movie_data)
+            return movie.set_poster(movie_images)
+
+        with timed(enrichment_seconds, 'enrich', list=name):
+            movies_data = await asyncio.gather(*(build(movie) for movie in movies))
+        movie_list = MovieList(name, movies_data)
+        enriched_movies.inc(len(movie_list), list=name)
+        return movie_list
+
+    async def sync_watched(self):
+        """Sincroniza la copia local de películas vistas (ver User.sync_watched)."""
+        store = get_sync_store()
+        user_id = (await self.get_user_info()).get("user_id")
+        pending = await asyncio.to_thread(store.pending_activity, user_id, 'watched',
+                                          await self.get_last_activities())
+        if pending is None:
+            return
+        remote_activity, local_activity = pending
+
+        movies = []
+        if local_activity is not None:
+            get_page = lambda page, limit: self.get_history_movies_page(local_activity, page, limit)
+            async for items in self.iter_movies_pages(get_page):
+                movies.extend(history_rows(items))
+        if movies:
+            watched_count = await self.get_watched_count()
+            if await asyncio.to_thread(store.merge_history, user_id, movies, remote_activity, watched_count):
+                return
+
+        movies = watched_rows(await self.get_watched_movies() or [])
+        await asyncio.to_thread(store.save_movies, user_id, 'watched', movies, remote_activity, replace=True)
+
+    async def sync_watchlist(self):
+        """Sincroniza la copia local de la lista de seguimiento (ver User.sync_watchlist)."""
+        store = get_sync_store()
+        user_id = (await self.get_user_info()).get("user_id")
+        pending = await asyncio.to_thread(store.pending_activity, user_id, 'watchlist',
+                                          await self.get_last_activities())
+        if pending is None:
+            return
+        remote_activity, _ = pending
+
+        movies = watchlist_rows(await self.get_watchlist_movies() or [])
+        await asyncio.to_thread(store.save_movies, user_id, 'watchlist', movies, remote_activity, replace=True)
+
+    async def load_list(self, spec: ListSpec) -> MovieList:
+        """Descarga una lista de Trakt y la enriquece con posters, sin pasar por cachés."""
+        return await self.enrich_movies(await self.fetch_list_movies(spec), spec.name)
+
+    async def fetch_list_movies(self, spec: ListSpec, limit: int | None = None) -> list[Movie]:
+        """Descarga una lista de Trakt y la convierte en películas sin poster; el JSON se
+        libera antes de enriquecerla (ver User.fetch_list_movies)."""
+        items = await self.get_list_items(spec) or []
+        if spec.limit is not None:
+            limit = spec.limit if limit is None else min(limit, spec.limit)
+        return [Movie.from_trakt(spec.extractor(item)) for item in items[:limit]]
+
+    async def sync_list(self, spec: ListSpec):
+        """Actualiza la copia local de una lista del usuario."""
+        if spec.name == 'watched':
+            await self.sync_watched()
+        else:
+            await self.sync_watchlist()
+
+    async def get_list(self, name: str) -> MovieList:
+        """Obtiene una lista del registro por su nombre (ver User.get_list)."""
+        spec = get_list_spec(name)
+        if spec.cache == CHART:
+            # Las listas globales salen de la caché compartida; solo una carga en frío usa
+            # el cliente síncrono, en un hilo aparte para no bloquear el event loop
+            loader = partial(User(self.CLIENT_ID).load_list, spec)
+            return await asyncio.to_thread(get_chart_cache().get, spec.name, loader)
+        if spec.cache == SYNC:
+            await self.sync_list(spec)
+            user_id = (await self.get_user_info()).get("user_id")
+            movies = await asyncio.to_thread(get_sync_store().get_movies, user_id, spec.name,
+                                             descending=spec.descending)
+            return await self.enrich_movies(movies, spec.name)
+        if spec.cache == RELATED:
+            return await self.enrich_movies(await self.get_related(spec.movie_id), spec.name)
+        return await self.load_list(spec)
+
+    async def get_movie_related(self, trakt_id: int) -> list[Movie]:
+        """Obtiene las relacionadas con una película desde la caché (ver User.get_movie_related)."""
+        cache = get_related_cache()
+        rows = await cache.get_async(trakt_id)
+        if rows is None:
+            items = await AsyncTraktApi(self.CLIENT_ID).get_related_movies(trakt_id, RELATED_PER_MOVIE) or []
+            rows = [[movie.title, movie.year, movie.trakt_id, movie.tmdb_id]
+                    for movie in (Movie.from_trakt(item) for item in items)]
+            await cache.set_async(trakt_id, rows, RELATED_CACHE_TTL)
+        return [Movie(*row) for row in rows]
+
+    async def _get_movie_related(self, trakt_id: int) -> list[Movie]:
+        try:
+            return await self.get_movie_related(trakt_id)
+        except CineTrakerError as e:
+            print(f"Error al obtener las relacionadas de la película {trakt_id}: {e}")
+            return []
+
+    async def get_recent_related(self) -> list[Movie]:
+        """Obtiene las relacionadas con las últimas vistas por el usuario, consultadas a la
+        vez y ordenadas por frecuencia (ver User.get_recent_related)."""
+        await self.sync_list(LISTS['watched'])
+        user_id = (await self.get_user_info()).get("user_id")
+        store = get_sync_store()
+        recent = await asyncio.to_thread(store.get_movies, user_id, 'watched', 0, RELATED_SOURCES, descending=True)
+        related = await asyncio.gather(*(self._get_movie_related(movie.trakt_id) for movie in recent))
+        return rank_related(related, await asyncio.to_thread(store.get_trakt_ids, user_id, 'watched'))
+
+    async def get_related(self, movie_id: int | None = None) -> list[Movie]:
+        """Relacionadas con una película, o con las últimas vistas si no se indica ninguna."""
+        if movie_id is not None:
+            return await self.get_movie_related(movie_id)
+        return await self.get_recent_related()
+
+    async def get_page_movies(self, name: str, page: int = 1, per_page: int = 50,
+                              query: MovieQuery | None = None) -> tuple[list[Movie], dict[str, int]]:
+        """Obtiene las películas de la página visible sin pedir posters (ver User.get_page_movies)."""
+        spec = get_list_spec(name)
+        if spec.cache == SYNC:
+            await self.sync_list(spec)
+            user_id = (await self.get_user_info()).get("user_id")
+            store = get_sync_store()
+            if query:
+                index = await asyncio.to_thread(get_movie_indexes().get, store, user_id, spec.name, spec.descending)
+                movies, count = index.search(query, (page - 1) * per_page, per_page)
+                return movies, build_pagination(page, per_page, count)
+            count = await asyncio.to_thread(store.count_movies, user_id, spec.name)
+            movies = await asyncio.to_thread(store.get_movies, user_id, spec.name, (page - 1) * per_page, per_page,
+                                             spec.descending)
+            return movies, build_pagination(page, per_page, count)
+        movies = await self.get_list_movies(spec)
+        if query:
+            movies, _ = MovieIndex.from_movies(movies).search(query)
+        pagination = build_pagination(page, per_page, len(movies))
+        return movies[(page - 1) * per_page: page * per_page], pagination
+
+    async def get_list_page(self, name: str, page: int = 1, per_page: int = 50) -> tuple[MovieList, dict[str, int]]:
+        """Obtiene solo la página visible de una lista, ya con posters."""
+        movies, pagination = await self.get_page_movies(name, page, per_page)
+        return await self.enrich_movies(movies, name), pagination
+
+    async def get_list_movies(self, spec: ListSpec, limit: int | None = None) -> list[Movie]:
+        """Obtiene las primeras `limit` películas de una lista (ver User.get_list_movies)."""
+        if spec.cache == CHART:
+            return list((await self.get_list(spec.name))[:limit])
+        if spec.cache == SYNC:
+            await self.sync_list(spec)
+            user_id = (await self.get_user_info()).get("user_id")
+            return await asyncio.to_thread(get_sync_store().get_movies, user_id, spec.name, 0, limit, spec.descending)
+        if spec.cache == RELATED:
+            return (await self.get_related(spec.movie_id))[:limit]
+        return await self.fetch_list_movies(spec, limit)
+
+    async def get_dashboard(self, names: list[str], per_list: int = 10) -> tuple[dict[str, MovieList], dict[str, str]]:
+        """Obtiene varias listas a la vez para el panel principal (ver User.get_dashboard)."""
+        specs = [get_list_spec(name) for name in names]
+        results = await asyncio.gather(*(self.get_list_movies(spec, per_list) for spec in specs),
+                                       return_exceptions=True)
+        lists, errors = {}, {}
+        for spec, result in zip(specs, results):
+            if isinstance(result, CineTrakerError):
+                errors[spec.name] = result.args[0]
+            elif isinstance(result, BaseException):
+                raise result
+            else:
+                lists[spec.name] = result
+
+        # Cada id de TMDB se consulta una sola vez aunque aparezca en varias listas
+        pending = {}
+        for movies in lists.values():
+            for movie in movies:
+                if movie.poster_image is None:
+                    pending.setdefault(movie.tmdb_id, movie)
+        enriched = await self.enrich_movies(list(pending.values()))
+        posters = {movie.tmdb_id: movie.poster_image for movie in enriched}
+
+        dashboard = {}
+        for name, movies in lists.items():
+            movie_list = MovieList(name)
+            for movie in movies:
+                if movie.poster_image is None:
+                    if movie.tmdb_id not in posters:
+                        continue
+                    movie.poster_image = posters[movie.tmdb_id]
+                movie_list.add(movie)
+            dashboard[name] = movie_list
+        return dashboard, errors
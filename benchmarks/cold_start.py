@@ -0,0 +1,159 @@
+"""Benchmark de arranque en frío: tiempo desde que se lanza el proceso hasta que sirve `/`.
+
+Cada corrida levanta un proceso nuevo que importa la aplicación, la crea con create_app y la
+sirve; este proceso pide `/` hasta recibir la respuesta. Se reporta la mediana y el máximo
+del total y de cada etapa (intérprete, imports, create_app, primera respuesta) y se compara
+con la línea base guardada; una regresión mayor a la tolerancia termina con código 1.
+
+Uso:
+    python benchmarks/cold_start.py                      # compara con benchmarks/cold_start_baseline.json
+    python benchmarks/cold_start.py --save-baseline
+    python benchmarks/cold_start.py --module asgi_app    # modo ASGI (requiere uvicorn)
+    python benchmarks/cold_start.py --importtime         # además, los imports más lentos
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCHMARKS_DIR)
+BASELINE = os.path.join(BENCHMARKS_DIR, 'cold_start_baseline.json')
+STAGES = ('interpreter', 'import', 'create_app', 'first_response', 'total')
+# Proceso hijo: importa y sirve la aplicación informando cuándo termina cada etapa. Va con -c
+# para no sumarle al arranque los imports de este script.
+SERVE = {
+    'app': "from werkzeug.serving import make_server; make_server('127.0.0.1', {port}, app).serve_forever()",
+    'asgi_app': "import uvicorn; uvicorn.run(app, host='127.0.0.1', port={port}, log_level='error')",
+}
+CHILD = """import sys, time
+started = time.time()
+sys.path.insert(0, {root!r})
+from {module} import create_app
+imported = time.time()
+app = create_app()
+created = time.time()
+print(started, imported, created, flush=True)
+{serve}
+"""
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def run_once(module: str, instance_dir: str, python_flags: tuple[str, ...] = ()) -> tuple[dict, str]:
+    """Lanza un proceso, espera la primera respuesta de `/` y devuelve la duración de cada
+    etapa (y la salida de error del proceso, donde -X importtime escribe)."""
+    port = free_port()
+    env = dict(os.environ, CACHE_WARMER='0', CINETRAKER_INSTANCE_DIR=instance_dir)
+    for name, value in {'CLIENT_ID': 'benchmark', 'FLASH_SECRET': 'benchmark'}.items():
+        env.setdefault(name, value)
+    code = CHILD.format(root=ROOT_DIR, module=module, serve=SERVE[module].format(port=port))
+    argv = [sys.executable, *python_flags, '-c', code]
+    launched = time.time()
+    process = subprocess.Popen(argv, env=env, cwd=ROOT_DIR, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                               text=True)
+    try:
+        while True:
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/", timeout=5) as response:
+                    response.read()
+                break
+            except OSError:
+                if process.poll() is not None:
+                    raise RuntimeError(f"La aplicación terminó antes de responder:\n{process.stderr.read()}")
+                time.sleep(0.001)
+        responded = time.time()
+        started, imported, created = map(float, process.stdout.readline().split())
+    finally:
+        process.terminate()
+        _, stderr = process.communicate()
+    return {
+        'interpreter': started - launched,
+        'import': imported - started,
+        'create_app': created - imported,
+        'first_response': responded - created,
+        'total': responded - launched,
+    }, stderr
+
+
+def slowest_imports(importtime: str, count: int = 15) -> list[tuple[int, str]]:
+    """Los módulos con más tiempo acumulado según -X importtime (µs), hasta los que importa
+    directamente cada import de primer nivel (p. ej. flask y cine_traker dentro de app)."""
+    imports = []
+    for line in importtime.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative, name = line.split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        if cumulative.strip().isdigit() and depth <= 1:
+            imports.append((int(cumulative), name.strip()))
+    return sorted(imports, reverse=True)[:count]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--module', default='app', choices=('app', 'asgi_app'))
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--save-baseline', action='store_true', help='Guarda los resultados como línea base')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='Empeoramiento tolerado (0.25 = 25%%)')
+    parser.add_argument('--min-delta', type=float, default=0.03,
+                        help='Diferencia mínima (s) para contar como regresión')
+    parser.add_argument('--importtime', action='store_true', help='Muestra los imports más lentos')
+    args = parser.parse_args()
+
+    runs = []
+    with tempfile.TemporaryDirectory() as instance_dir:
+        run_once(args.module, instance_dir)  # Descartada: compila los .pyc y calienta la caché de disco
+        for _ in range(args.runs):
+            runs.append(run_once(args.module, instance_dir)[0])
+        if args.importtime:
+            _, stderr = run_once(args.module, instance_dir, ('-X', 'importtime'))
+            print("Imports más lentos (acumulado):")
+            for cumulative, name in slowest_imports(stderr):
+                print(f"  {cumulative / 1000:>8.1f} ms  {name}")
+
+    results = {}
+    print(f"{'etapa':<16} {'mediana ms':>11} {'máx ms':>8}")
+    for stage in STAGES:
+        values = [run[stage] for run in runs]
+        results[stage] = {'median': statistics.median(values), 'max': max(values)}
+        print(f"{stage:<16} {results[stage]['median'] * 1000:>11.1f} {results[stage]['max'] * 1000:>8.1f}")
+
+    if args.save_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as file:
+                baseline = json.load(file)
+        baseline[args.module] = results
+        with open(args.baseline, 'w') as file:
+            json.dump(baseline, file, indent=2, sort_keys=True)
+        print(f"Línea base guardada en {args.baseline}")
+        return
+    previous = None
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as file:
+            previous = json.load(file).get(args.module)
+    if previous is None:
+        print("Sin línea base para comparar (usar --save-baseline)")
+        return
+    old, new = previous['total']['median'], results['total']['median']
+    change = (new - old) / old
+    if change > args.tolerance and new - old >= args.min_delta:
+        print(f"REGRESIÓN arranque en frío: {old * 1000:.0f} ms -> {new * 1000:.0f} ms ({change:+.0%})")
+        sys.exit(1)
+    print(f"Sin regresiones respecto de la línea base ({old * 1000:.0f} ms -> {new * 1000:.0f} ms)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,260 @@
+"""Servidor falso de Trakt y TMDB para correr los benchmarks sin red ni credenciales.
+
+Imita los endpoints que usa la aplicación (/oauth/token, /users/settings, /users/{id}/watched/movies,
+/movies/trending, /sync/last_activities, /3/movie/{id}/images, las imágenes de image.tmdb.org...)
+con latencia, tamaño de las respuestas, tasa de errores 5xx y de respuestas 429 configurables.
+Trakt, TMDB y las imágenes escuchan en puertos distintos para que los límites por host
+y las métricas los distingan como en producción.
+
+Uso:
+    python benchmarks/fake_upstream.py --latency 0.05 --movies 2000 --error-rate 0.01
+    # Imprime las variables de entorno (TRAKT_API_URL, TMDB_API_URL, TMDB_IMAGE_URL) a usar
+"""
+import argparse
+import json
+import os
+import random
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+STATIC_IMAGE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                            'static', 'img', 'fondo_gris.jpg')
+ACTIVITY = "2024-01-01T00:00:00.000Z"
+
+
+def fake_movie(i: int) -> dict:
+    """Objeto `movie` de Trakt para la película número `i`."""
+    return {
+        "title": f"Película {i}",
+        "year": 1980 + i % 45,
+        "ids": {"trakt": i, "slug": f"pelicula-{i}", "imdb": f"tt{i:07d}", "tmdb": i},
+    }
+
+
+class FakeUpstream:
+    """Servidores HTTP falsos de Trakt, TMDB e imágenes de TMDB, en hilos de este proceso."""
+    def __init__(self, movies: int = 500, chart_size: int = 30, backdrops: int = 3, latency: float = 0.05,
+                 jitter: float = 0.0, error_rate: float = 0.0, rate_limit_rate: float = 0.0,
+                 retry_after: int = 1, seed: int = 0):
+        self.movies: int = movies  # Películas vistas de cada usuario (tamaño de la respuesta)
+        self.chart_size: int = chart_size  # Películas de las listas globales y recomendaciones
+        self.backdrops: int = backdrops  # Imágenes por película en TMDB
+        self.latency: float = latency
+        self.jitter: float = jitter
+        self.error_rate: float = error_rate
+        self.rate_limit_rate: float = rate_limit_rate
+        self.retry_after: int = retry_after
+        self.random = random.Random(seed)
+        with open(STATIC_IMAGE, 'rb') as file:
+            self.image: bytes = file.read()
+        self.requests: Counter = Counter()  # Solicitudes recibidas por servicio
+        self._lock = threading.Lock()
+        self._servers: dict[str, ThreadingHTTPServer] = {}
+
+    def start(self, host: str = '127.0.0.1') -> 'FakeUpstream':
+        """Levanta los tres servidores en puertos libres."""
+        for service in ('trakt', 'tmdb', 'image'):
+            handler = type(f'{service.title()}Handler', (FakeHandler,), {'upstream': self, 'service': service})
+            server = ThreadingHTTPServer((host, 0), handler)
+            server.daemon_threads = True
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            self._servers[service] = server
+        return self
+
+    def stop(self):
+        for server in self._servers.values():
+            server.shutdown()
+            server.server_close()
+
+    def url(self, service: str) -> str:
+        host, port = self._servers[service].server_address[:2]
+        return f"http://{host}:{port}"
+
+    def environ(self) -> dict[str, str]:
+        """Variables de entorno que apuntan la aplicación a estos servidores."""
+        return {
+            'TRAKT_API_URL': self.url('trakt'),
+            'TMDB_API_URL': f"{self.url('tmdb')}/3",
+            'TMDB_IMAGE_URL': f"{self.url('image')}/t/p",
+        }
+
+    def count(self, service: str):
+        with self._lock:
+            self.requests[service] += 1
+
+    def get_stats(self) -> dict[str, int]:
+        with self._lock:
+            return dict(self.requests)
+
+    def failure(self) -> int | None:
+        """Decide si la solicitud falla: 429, 500 o None."""
+        with self._lock:
+            roll = self.random.random()
+        if roll < self.rate_limit_rate:
+            return 429
+        if roll < self.rate_limit_rate + self.error_rate:
+            return 500
+        return None
+
+    def delay(self):
+        with self._lock:
+            extra = self.random.uniform(0, self.jitter) if self.jitter else 0
+        time.sleep(self.latency + extra)
+
+    # Respuestas de Trakt
+
+    def trakt(self, method: str, path: str, query: dict[str, str], token: str | None):
+        if method == 'POST' and path == '/oauth/token':
+            return {"access_token": f"token-{self.random.randrange(10**9)}", "refresh_token": "refresh",
+                    "expires_in": 7776000, "created_at": int(time.time()), "token_type": "bearer"}
+        slug = token or 'bench'
+        if path == '/users/settings':
+            return {"user": {"username": slug, "ids": {"slug": slug}}}
+        if path == '/sync/last_activities':
+            return {"movies": {"watched_at": ACTIVITY, "watchlisted_at": ACTIVITY}}
+        if path == '/sync/history/movies':
+            return []
+        if re.fullmatch(r'/users/[^/]+/watched/movies', path):
+            return [{"plays": 1, "last_watched_at": ACTIVITY, "last_updated_at": ACTIVITY, "movie": fake_movie(i)}
+                    for i in range(1, self.movies + 1)]
+        if re.fullmatch(r'/users/[^/]+/stats', path):
+            return {"movies": {"plays": self.movies, "watched": self.movies, "minutes": 120 * self.movies}}
+        if re.fullmatch(r'/users/[^/]+/watchlist/movies/rank', path):
+            return [{"rank": rank, "listed_at": ACTIVITY, "type": "movie", "movie": fake_movie(self.movies + rank)}
+                    for rank in range(1, min(self.movies, 100) + 1)]
+        if path in ('/movies/trending', '/movies/boxoffice', '/movies/anticipated', '/movies/favorited/weekly'):
+            return [{"watchers": self.chart_size - i, "movie": fake_movie(10**6 + i)} for i in range(self.chart_size)]
+        if path == '/recommendations/movies':
+            return [fake_movie(2 * 10**6 + i) for i in range(self.chart_size)]
+        match = re.fullmatch(r'/movies/(\d+)/related', path)
+        if match:
+            # Las relacionadas de películas cercanas se solapan, como en Trakt
+            movie_id = int(match.group(1))
+            limit = int(query.get('limit', 10))
+            return [fake_movie(movie_id + offset) for offset in range(1, limit + 1)]
+        return None
+
+    # Respuestas de TMDB
+
+    def tmdb(self, path: str) -> dict | None:
+        match = re.fullmatch(r'/3/movie/(\d+)/images', path)
+        if match is None:
+            return None
+        movie_id = int(match.group(1))
+        # Una de cada diez películas no tiene imágenes (se usa el poster por defecto)
+        count = 0 if movie_id % 10 == 0 else self.backdrops
+        return {"id": movie_id, "posters": [], "logos": [], "backdrops": [
+            {"file_path": f"/backdrop{movie_id}x{k}.jpg", "width": 1280, "height": 720, "aspect_ratio": 1.778}
+            for k in range(count)
+        ]}
+
+
+class FakeHandler(BaseHTTPRequestHandler):
+    upstream: FakeUpstream
+    service: str
+    protocol_version = 'HTTP/1.1'  # Keep-alive, como las APIs reales
+
+    def do_GET(self):
+        self.respond('GET')
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        self.rfile.read(length)
+        self.respond('POST')
+
+    def respond(self, method: str):
+        upstream = self.upstream
+        url = urlsplit(self.path)
+        if url.path == '/_stats':  # Contadores de solicitudes, para los benchmarks
+            return self.send_json(200, upstream.get_stats())
+        upstream.count(self.service)
+        upstream.delay()
+        status = upstream.failure()
+        if status == 429:
+            return self.send_json(429, {"error": "rate limited"}, {'Retry-After': str(upstream.retry_after)})
+        if status == 500:
+            return self.send_json(500, {"error": "internal error"})
+
+        if self.service == 'image':
+            if not re.fullmatch(r'/t/p/\w+/[\w-]+\.jpg', url.path):
+                return self.send_json(404, {"status_message": "not found"})
+            return self.send_body(200, upstream.image, 'image/jpeg')
+        if self.service == 'tmdb':
+            data = upstream.tmdb(url.path)
+            return self.send_json(200 if data is not None else 404, data or {"status_message": "not found"})
+
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        authorization = self.headers.get('Authorization', '')
+        token = authorization.removeprefix('Bearer ') or None
+        data = upstream.trakt(method, url.path, query, token)
+        if data is None:
+            return self.send_json(404, {"error": "not found"})
+        headers = {}
+        if isinstance(data, list) and 'page' in query:
+            page, limit = int(query['page']), int(query.get('limit', 10))
+            headers = {
+                'X-Pagination-Page': str(page),
+                'X-Pagination-Limit': str(limit),
+                'X-Pagination-Page-Count': str(max(1, -(-len(data) // limit))),
+                'X-Pagination-Item-Count': str(len(data)),
+            }
+            data = data[(page - 1) * limit: page * limit]
+        self.send_json(200, data, headers)
+
+    def send_json(self, status: int, data, headers: dict[str, str] | None = None):
+        self.send_body(status, json.dumps(data).encode(), 'application/json', headers)
+
+    def send_body(self, status: int, body: bytes, content_type: str, headers: dict[str, str] | None = None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Sin una línea por solicitud: distorsiona los tiempos
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    """Opciones del servidor falso, compartidas con run_benchmarks.py."""
+    group = parser.add_argument_group('servidor falso')
+    group.add_argument('--latency', type=float, default=0.05, help='Segundos de latencia por solicitud')
+    group.add_argument('--jitter', type=float, default=0.0, help='Latencia extra aleatoria máxima (s)')
+    group.add_argument('--movies', type=int, default=500, help='Películas vistas por usuario')
+    group.add_argument('--chart-size', type=int, default=30, help='Películas de las listas globales')
+    group.add_argument('--backdrops', type=int, default=3, help='Imágenes por película en TMDB')
+    group.add_argument('--error-rate', type=float, default=0.0, help='Fracción de respuestas 500')
+    group.add_argument('--rate-limit-rate', type=float, default=0.0, help='Fracción de respuestas 429')
+    group.add_argument('--retry-after', type=int, default=1, help='Segundos del header Retry-After')
+    group.add_argument('--seed', type=int, default=0)
+
+
+def from_arguments(args: argparse.Namespace) -> FakeUpstream:
+    return FakeUpstream(movies=args.movies, chart_size=args.chart_size, backdrops=args.backdrops,
+                        latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                        rate_limit_rate=args.rate_limit_rate, retry_after=args.retry_after, seed=args.seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    upstream = from_arguments(args).start()
+    # Primera línea: el entorno en JSON, para que otro proceso pueda leerlo
+    print(json.dumps(upstream.environ()), flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        upstream.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""Prueba de carga simple para comparar el modo síncrono (app.py) con el asíncrono (asgi_app.py).
+
+Uso:
+    python benchmarks/load_test.py --base-url http://127.0.0.1:5000 --cookie "session=..." \
+        --concurrency 50 --requests 500 /trend-list /watch-list
+
+Levantar cada modo contra las mismas APIs (o el servidor falso de benchmarks) y comparar
+el throughput y las latencias que reporta este script.
+"""
+import argparse
+import statistics
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+
+def fetch(url: str, cookie: str | None) -> tuple[float, int]:
+    """Hace una solicitud GET y devuelve (segundos, código de estado)."""
+    request = urllib.request.Request(url, headers={'Cookie': cookie} if cookie else {})
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    return time.perf_counter() - start, status
+
+
+def percentile(values: list[float], percent: float) -> float:
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(percent / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def run(base_url: str, path: str, cookie: str | None, concurrency: int, total: int) -> dict:
+    url = base_url.rstrip('/') + path
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(lambda _: fetch(url, cookie), range(total)))
+    elapsed = time.perf_counter() - start
+    latencies = [latency for latency, _ in results]
+    errors = sum(1 for _, status in results if status >= 400)
+    return {
+        'path': path,
+        'throughput': total / elapsed,
+        'p50': percentile(latencies, 50),
+        'p95': percentile(latencies, 95),
+        'p99': percentile(latencies, 99),
+        'mean': statistics.mean(latencies),
+        'errors': errors,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('paths', nargs='+', help='Rutas a probar, p. ej. /trend-list')
+    parser.add_argument('--base-url', default='http://127.0.0.1:5000')
+    parser.add_argument('--cookie', help='Cookie de sesión de un usuario autenticado')
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--requests', type=int, default=200)
+    args = parser.parse_args()
+
+    print(f"{'ruta':<20} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'media ms':>9} {'errores':>8}")
+    for path in args.paths:
+        result = run(args.base_url, path, args.cookie, args.concurrency, args.requests)
+        print(f"{result['path']:<20} {result['throughput']:>8.1f} {result['p50'] * 1000:>8.1f} "
+              f"{result['p95'] * 1000:>8.1f} {result['p99'] * 1000:>8.1f} {result['mean'] * 1000:>9.1f} {result['errors']:>8}")
+
+
+if __name__ == '__main__':
+    main()
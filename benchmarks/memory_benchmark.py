@@ -0,0 +1,128 @@
+"""Memoria de cargar una lista grande por el camino real de la aplicación: User.load_list
+(lista descargada completa, como las globales) y User.get_list sobre la copia sincronizada
+(películas vistas), hasta la MovieList con posters. Como línea base se arma la misma lista
+con la representación anterior: un dict por película, con el JSON de Trakt retenido
+mientras se piden los posters.
+
+Trakt se reemplaza por una sesión HTTP en memoria (un servidor local sumaría sus propias
+asignaciones a la medición) y los posters salen de la caché de TMDB ya cargada. Para cada
+camino se reporta la memoria en uso al pedir el primer poster (el JSON de la respuesta ya
+debería estar liberado), el pico y lo que queda retenido con la lista armada.
+
+Uso:
+    python benchmarks/memory_benchmark.py --movies 20000
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import tracemalloc
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARKS_DIR))
+sys.path.insert(0, BENCHMARKS_DIR)
+os.environ.setdefault('CINETRAKER_INSTANCE_DIR', tempfile.mkdtemp(prefix='cinetraker-memory-'))
+
+from cache import LRUCache, TieredCache
+from cine_traker import ImageTMDB, User
+from fake_upstream import ACTIVITY, fake_movie
+from movie_lists import LISTS
+
+POSTER = ["https://image.tmdb.org/t/p/w500/abcdefghijklmnopqrstuvwxyz.jpg"]
+
+
+class FakeResponse:
+    status_code = 200
+    headers: dict = {}
+
+    def __init__(self, body: str):
+        self.body = body
+
+    def json(self):
+        return json.loads(self.body)
+
+
+class FakeTraktSession:
+    """Sesión HTTP con las respuestas de Trakt ya serializadas, como llegarían por la red."""
+    def __init__(self, movies: int):
+        watched = [{"plays": 1, "last_watched_at": ACTIVITY, "last_updated_at": ACTIVITY, "movie": fake_movie(i)}
+                   for i in range(1, movies + 1)]
+        self.responses = {
+            '/users/settings': json.dumps({"user": {"username": "bench", "ids": {"slug": "bench"}}}),
+            '/sync/last_activities': json.dumps({"movies": {"watched_at": ACTIVITY, "watchlisted_at": ACTIVITY}}),
+            '/users/bench/watched/movies': json.dumps(watched),
+        }
+
+    def get(self, url: str, **kwargs) -> FakeResponse:
+        path = url.split('://', 1)[-1].split('/', 1)[-1]
+        return FakeResponse(self.responses[f"/{path}"])
+
+
+class MeasuredImageTMDB(ImageTMDB):
+    """Cliente de TMDB que anota la memoria en uso al pedir el primer poster."""
+    def __init__(self, cache: TieredCache):
+        super().__init__(cache)
+        self.at_enrich: int | None = None
+
+    def get_movie_images(self, movie_id):
+        if self.at_enrich is None:
+            self.at_enrich = tracemalloc.get_traced_memory()[0]
+        return super().get_movie_images(movie_id)
+
+
+def load_dicts(user: User) -> list[dict]:
+    """Forma anterior: se conserva el JSON completo mientras se arma un dict por película."""
+    watched_movies = user.get_watched_movies()
+    movies_data = []
+    for item in watched_movies:
+        movie = item['movie']
+        movie_images = user.image_tmdb.get_movie_images(movie['ids']['tmdb'])
+        movies_data.append({
+            'title': movie['title'],
+            'year': movie['year'],
+            'poster_image': movie_images[0],
+        })
+    return movies_data
+
+
+def measure(load, image_tmdb: MeasuredImageTMDB) -> tuple[int, int, int]:
+    """Devuelve (memoria al enriquecer, pico, retenido) en bytes al cargar la lista."""
+    image_tmdb.at_enrich = None
+    tracemalloc.start()
+    result = load()
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return image_tmdb.at_enrich or 0, peak, retained
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--movies', type=int, default=20000)
+    args = parser.parse_args()
+
+    http = FakeTraktSession(args.movies)
+    image_tmdb = MeasuredImageTMDB(TieredCache(LRUCache(args.movies)))
+    for tmdb_id in range(1, args.movies + 1):
+        image_tmdb.cache.set(tmdb_id, POSTER)
+    user = User('benchmark', 'benchmark', image_tmdb=image_tmdb, http=http)
+    user.get_user_info()
+    user.sync_list(LISTS['watched'])  # La primera sincronización no se mide, solo la lectura
+
+    size = len(http.responses['/users/bench/watched/movies'])
+    print(f"{args.movies} películas, respuesta de {size / 1024:.0f} KiB")
+    print(f"{'camino':<10} {'al enriquecer KiB':>18} {'pico KiB':>10} {'retenido KiB':>13} {'bytes/película':>15}")
+    paths = [
+        ('dict', lambda: load_dicts(user)),
+        ('load_list', lambda: user.load_list(LISTS['watched'])),
+        ('get_list', lambda: user.get_list('watched')),
+    ]
+    for name, load in paths:
+        at_enrich, peak, retained = measure(load, image_tmdb)
+        print(f"{name:<10} {at_enrich / 1024:>18.0f} {peak / 1024:>10.0f} {retained / 1024:>13.0f} "
+              f"{retained / args.movies:>15.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,207 @@
+"""Benchmarks sin red de la aplicación Flask contra el servidor falso de Trakt/TMDB.
+
+Levanta fake_upstream.py en otro proceso y la aplicación (app.py) en este, con cachés
+vacías en un directorio temporal. Luego recorre cada ruta de lista con clientes
+concurrentes y reporta la latencia de la primera solicitud (caché fría), p50/p95/p99,
+throughput, errores, solicitudes a las APIs y memoria pico del proceso. Los resultados se
+comparan con la línea base guardada; una regresión mayor a la tolerancia termina con código 1.
+
+Uso:
+    python benchmarks/run_benchmarks.py                     # compara con benchmarks/baseline.json
+    python benchmarks/run_benchmarks.py --save-baseline     # guarda los resultados como línea base
+    python benchmarks/run_benchmarks.py --latency 0.2 --error-rate 0.05 --rate-limit-rate 0.02 /trend-list
+"""
+import argparse
+import json
+import logging
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from itertools import cycle
+from flask import Flask
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARKS_DIR))
+sys.path.insert(0, BENCHMARKS_DIR)
+
+from fake_upstream import add_arguments
+from load_test import fetch, percentile
+
+BASELINE = os.path.join(BENCHMARKS_DIR, 'baseline.json')
+ROUTES = ['/watch-list', '/watched-list', '/trend-list', '/favorited-list', '/cinema-list',
+          '/coming-list', '/recommended-list', '/related-list', '/home_page']
+# Métricas comparadas con la línea base y en qué dirección empeoran
+COMPARED = {'p50': 'higher', 'p95': 'higher', 'p99': 'higher', 'throughput': 'lower', 'peak_rss_mib': 'higher'}
+LATENCIES = ('p50', 'p95', 'p99')
+
+
+def start_fake_upstream(args: argparse.Namespace) -> tuple[subprocess.Popen, dict[str, str]]:
+    """Levanta el servidor falso en otro proceso (no compite por el GIL ni suma memoria a
+    la aplicación) y devuelve el proceso y las variables de entorno que lo apuntan."""
+    options = ['latency', 'jitter', 'movies', 'chart_size', 'backdrops', 'error_rate',
+               'rate_limit_rate', 'retry_after', 'seed']
+    argv = [sys.executable, os.path.join(BENCHMARKS_DIR, 'fake_upstream.py')]
+    for option in options:
+        argv += [f"--{option.replace('_', '-')}", str(getattr(args, option))]
+    process = subprocess.Popen(argv, stdout=subprocess.PIPE, text=True)
+    return process, json.loads(process.stdout.readline())
+
+
+def upstream_requests(environ: dict[str, str]) -> int:
+    """Total de solicitudes que recibió el servidor falso."""
+    with urllib.request.urlopen(f"{environ['TRAKT_API_URL']}/_stats") as response:
+        return sum(json.load(response).values())
+
+
+def start_app(environ: dict[str, str], instance_dir: str) -> tuple[str, Flask]:
+    """Crea la aplicación apuntando al servidor falso y la sirve en un hilo; devuelve su URL
+    y la aplicación."""
+    os.environ.update(environ)
+    os.environ['CINETRAKER_INSTANCE_DIR'] = instance_dir
+    os.environ['CACHE_WARMER'] = '0'  # Las cachés se calientan con la primera solicitud medida
+    for name, value in {
+        'CLIENT_ID': 'benchmark', 'TMDB_ID': 'benchmark', 'FLASH_SECRET': 'benchmark',
+        # Límites holgados: se mide la aplicación, no la espera por cupo
+        'TRAKT_RATE_LIMIT': '100000/1', 'TRAKT_TOKEN_RATE_LIMIT': '100000/1', 'TMDB_RATE_LIMIT': '100000/1',
+    }.items():
+        os.environ.setdefault(name, value)
+
+    from werkzeug.serving import make_server
+    from app import create_app
+
+    app = create_app()
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)  # Sin una línea por solicitud
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}", app
+
+
+def session_cookies(app: Flask, users: int) -> list[str]:
+    """Cookies de sesión firmadas de `users` usuarios distintos, ya autenticados (con su
+    sesión creada en el almacén del servidor)."""
+    from session_store import get_session_store
+
+    serializer = app.session_interface.get_signing_serializer(app)
+    cookies = []
+    for i in range(users):
+        slug = f"bench-{i}"
+        user_session = get_session_store().create({'access_token': slug},
+                                                  {'user_name': slug, 'user_id': slug})
+        value = serializer.dumps({'sid': user_session.session_id})
+        cookies.append(f"{app.config['SESSION_COOKIE_NAME']}={value}")
+    return cookies
+
+
+def run_scenario(base_url: str, path: str, cookies: list[str], concurrency: int, total: int,
+                 environ: dict[str, str]) -> dict:
+    """Mide una ruta: primero una solicitud por usuario con la caché fría, luego `total`
+    solicitudes con `concurrency` clientes repartidas entre los usuarios."""
+    url = base_url + path
+    calls_before = upstream_requests(environ)
+    cold = [fetch(url, cookie) for cookie in cookies]
+
+    assigned = cycle(cookies)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(lambda cookie: fetch(url, cookie), [next(assigned) for _ in range(total)]))
+    elapsed = time.perf_counter() - start
+
+    latencies = [latency for latency, _ in results]
+    return {
+        'cold': max(latency for latency, _ in cold),
+        'p50': percentile(latencies, 50),
+        'p95': percentile(latencies, 95),
+        'p99': percentile(latencies, 99),
+        'throughput': total / elapsed,
+        'errors': sum(1 for _, status in cold + results if status >= 400),
+        'upstream_requests': upstream_requests(environ) - calls_before,
+        # Pico de memoria residente del proceso hasta ahora (Linux lo reporta en KiB)
+        'peak_rss_mib': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def compare(results: dict, baseline: dict, tolerance: float, min_delta: float) -> list[str]:
+    """Lista las métricas que empeoraron más que `tolerance` respecto de la línea base.
+    En las latencias además se exige una diferencia de al menos `min_delta` segundos: en
+    las rutas servidas desde caché unos milisegundos de ruido son un porcentaje grande."""
+    regressions = []
+    for path, result in results.items():
+        previous = baseline.get(path)
+        if previous is None:
+            continue
+        for metric, worse in COMPARED.items():
+            old, new = previous[metric], result[metric]
+            change = (new - old) / old if old else 0
+            if metric in LATENCIES and new - old < min_delta:
+                continue
+            if (worse == 'higher' and change > tolerance) or (worse == 'lower' and -change > tolerance):
+                regressions.append(f"{path} {metric}: {old:.4g} -> {new:.4g} ({change:+.0%})")
+        if result['errors'] > previous['errors']:
+            regressions.append(f"{path} errores: {previous['errors']} -> {result['errors']}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('paths', nargs='*', default=ROUTES, help='Rutas a medir (por defecto, todas las listas)')
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--requests', type=int, default=200, help='Solicitudes por ruta')
+    parser.add_argument('--users', type=int, default=4, help='Usuarios distintos entre los clientes')
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--save-baseline', action='store_true', help='Guarda los resultados como línea base')
+    parser.add_argument('--tolerance', type=float, default=0.5, help='Empeoramiento tolerado (0.5 = 50%%)')
+    parser.add_argument('--min-delta', type=float, default=0.05,
+                        help='Diferencia mínima de latencia (s) para contar como regresión')
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    upstream, environ = start_fake_upstream(args)
+    try:
+        with tempfile.TemporaryDirectory() as instance_dir:
+            base_url, app = start_app(environ, instance_dir)
+            cookies = session_cookies(app, args.users)
+            print(f"{'ruta':<18} {'fría ms':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'req/s':>8} "
+                  f"{'errores':>8} {'APIs':>6} {'RSS MiB':>8}")
+            results = {}
+            for path in args.paths:
+                result = run_scenario(base_url, path, cookies, args.concurrency, args.requests, environ)
+                results[path] = result
+                print(f"{path:<18} {result['cold'] * 1000:>8.1f} {result['p50'] * 1000:>8.1f} "
+                      f"{result['p95'] * 1000:>8.1f} {result['p99'] * 1000:>8.1f} {result['throughput']:>8.1f} "
+                      f"{result['errors']:>8} {result['upstream_requests']:>6} {result['peak_rss_mib']:>8.1f}")
+    finally:
+        upstream.terminate()
+        upstream.wait()
+
+    # La configuración se guarda con la línea base: comparar corridas distintas no tiene sentido
+    config = {name: getattr(args, name) for name in ('concurrency', 'requests', 'users', 'latency', 'jitter',
+                                                     'movies', 'chart_size', 'backdrops', 'error_rate',
+                                                     'rate_limit_rate', 'retry_after', 'seed')}
+    if args.save_baseline:
+        with open(args.baseline, 'w') as file:
+            json.dump({'config': config, 'results': results}, file, indent=2, sort_keys=True)
+        print(f"Línea base guardada en {args.baseline}")
+        return
+    if not os.path.exists(args.baseline):
+        print("Sin línea base para comparar (usar --save-baseline)")
+        return
+    with open(args.baseline) as file:
+        baseline = json.load(file)
+    if baseline['config'] != config:
+        print(f"La línea base se tomó con otra configuración: {baseline['config']}")
+    regressions = compare(results, baseline['results'], args.tolerance, args.min_delta)
+    for regression in regressions:
+        print(f"REGRESIÓN {regression}")
+    if regressions:
+        sys.exit(1)
+    print("Sin regresiones respecto de la línea base")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,437 @@
+import itertools
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Awaitable, Callable
+from metrics import registry
+
+INSTANCE_DIR = os.getenv('CINETRAKER_INSTANCE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance'))
+
+_MISSING = object()
+
+
+class LRUCache:
+    """Caché en memoria con expiración por entrada y desalojo LRU por tamaño."""
+    def __init__(self, max_size: int = 1024):
+        self.max_size: int = max_size
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING:
+                return default
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.time():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl: float | None = None):
+        expires_at = time.time() + ttl if ttl is not None else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class SQLiteCache:
+    """Caché en disco (SQLite) compartida entre procesos, con expiración por entrada
+    y desalojo de las entradas menos usadas cuando supera su tamaño máximo.
+
+    Para no escribir en cada lectura, la marca de último uso solo se actualiza si tiene más
+    de `touch_interval` segundos, y el tamaño se revisa cada `evict_every` inserciones (la
+    tabla puede pasarse hasta en esa cantidad por proceso entre una revisión y otra)."""
+    def __init__(self, path: str, max_entries: int = 50000, table: str = 'cache',
+                 touch_interval: float = 60, evict_every: int | None = None):
+        self.path: str = path
+        self.max_entries: int = max_entries
+        self.table: str = table
+        self.touch_interval: float = touch_interval
+        self.evict_every: int = evict_every or max(1, min(100, max_entries // 100))
+        self._inserts = itertools.count(1)
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._execute(
+            f"CREATE TABLE IF NOT EXISTS {self.table} ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL, accessed_at REAL NOT NULL)"
+        )
+        self._execute(f"CREATE INDEX IF NOT EXISTS {self.table}_accessed ON {self.table} (accessed_at)")
+
+    def _connection(self) -> sqlite3.Connection:
+        """Cada hilo usa su propia conexión; WAL permite lectores y escritores concurrentes."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _execute(self, sql: str, params: tuple = ()):
+        return self._connection().execute(sql, params)
+
+    def _touch(self, key, accessed_at: float, now: float):
+        """Marca la entrada como usada, solo si la marca anterior ya es vieja."""
+        if now - accessed_at >= self.touch_interval:
+            self._execute(f"UPDATE {self.table} SET accessed_at = ? WHERE key = ?", (now, str(key)))
+
+    def get(self, key, default=None):
+        now = time.time()
+        row = self._execute(
+            f"SELECT value, expires_at, accessed_at FROM {self.table} WHERE key = ?", (str(key),)
+        ).fetchone()
+        if row is None:
+            return default
+        value, expires_at, accessed_at = row
+        if expires_at is not None and expires_at <= now:
+            self._execute(f"DELETE FROM {self.table} WHERE key = ?", (str(key),))
+            return default
+        self._touch(key, accessed_at, now)
+        return json.loads(value)
+
+    def get_with_expiry(self, key):
+        """Devuelve (valor, expires_at) o None, para poder copiar la entrada a otro nivel."""
+        now = time.time()
+        row = self._execute(
+            f"SELECT value, expires_at, accessed_at FROM {self.table} WHERE key = ?", (str(key),)
+        ).fetchone()
+        if row is None:
+            return None
+        value, expires_at, accessed_at = row
+        if expires_at is not None and expires_at <= now:
+            return None
+        self._touch(key, accessed_at, now)
+        return json.loads(value), expires_at
+
+    def set(self, key, value, ttl: float | None = None):
+        now = time.time()
+        expires_at = now + ttl if ttl is not None else None
+        self._execute(
+            f"INSERT OR REPLACE INTO {self.table} (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+            (str(key), json.dumps(value), expires_at, now),
+        )
+        if next(self._inserts) % self.evict_every == 0:
+            self._evict()
+
+    def delete(self, key):
+        self._execute(f"DELETE FROM {self.table} WHERE key = ?", (str(key),))
+
+    def _evict(self):
+        """Elimina las entradas expiradas y, si aún sobra espacio, las menos usadas."""
+        count = self._execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+        if count <= self.max_entries:
+            return
+        self._execute(f"DELETE FROM {self.table} WHERE expires_at IS NOT NULL AND expires_at <= ?", (time.time(),))
+        self._execute(
+            f"DELETE FROM {self.table} WHERE key IN ("
+            f"SELECT key FROM {self.table} ORDER BY accessed_at ASC LIMIT "
+            f"MAX(0, (SELECT COUNT(*) FROM {self.table}) - ?))",
+            (self.max_entries,),
+        )
+
+
+class TieredCache:
+    """Caché de dos niveles: LRU en memoria delante de una caché SQLite en disco.
+    Lleva contadores de aciertos y fallos para poder medir su efectividad."""
+    def __init__(self, memory: LRUCache, disk: SQLiteCache | None = None):
+        self.memory: LRUCache = memory
+        self.disk: SQLiteCache | None = disk
+        self.stats: dict[str, int] = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0}
+        self._stats_lock = threading.Lock()
+
+    def _count(self, name: str):
+        with self._stats_lock:
+            self.stats[name] += 1
+
+    def get(self, key, default=None):
+        value = self.memory.get(key, _MISSING)
+        if value is not _MISSING:
+            self._count('memory_hits')
+            return value
+        if self.disk is not None:
+            entry = self.disk.get_with_expiry(key)
+            if entry is not None:
+                value, expires_at = entry
+                ttl = expires_at - time.time() if expires_at is not None else None
+                self.memory.set(key, value, ttl)
+                self._count('disk_hits')
+                return value
+        self._count('misses')
+        return default
+
+    def set(self, key, value, ttl: float | None = None):
+        self.memory.set(key, value, ttl)
+        if self.disk is not None:
+            self.disk.set(key, value, ttl)
+
+    def delete(self, key):
+        self.memory.delete(key)
+        if self.disk is not None:
+            self.disk.delete(key)
+
+    async def get_async(self, key, default=None):
+        """Versión de get para el modo asíncrono: la memoria se consulta en línea y el
+        disco en un hilo aparte, para no bloquear el event loop con SQLite."""
+        value = self.memory.get(key, _MISSING)
+        if value is not _MISSING:
+            self._count('memory_hits')
+            return value
+        if self.disk is None:
+            self._count('misses')
+            return default
+        import asyncio  # Solo el modo asíncrono lo usa; no se carga al arrancar la app Flask
+        return await asyncio.to_thread(self.get, key, default)
+
+    async def set_async(self, key, value, ttl: float | None = None):
+        """Versión de set para el modo asíncrono: la escritura en disco va en un hilo aparte."""
+        self.memory.set(key, value, ttl)
+        if self.disk is not None:
+            import asyncio
+            await asyncio.to_thread(self.disk.set, key, value, ttl)
+
+    def get_stats(self) -> dict[str, int]:
+        with self._stats_lock:
+            stats = dict(self.stats)
+        stats['hits'] = stats['memory_hits'] + stats['disk_hits']
+        return stats
+
+
+class SingleFlight:
+    """Agrupa llamadas idénticas concurrentes: solo la primera ejecuta la función y las
+    demás esperan y reciben el mismo resultado (o la misma excepción)."""
+    def __init__(self):
+        self._calls: dict[object, Future] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn: Callable[[], object]):
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+        if not leader:
+            return future.result()
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+    def __len__(self):
+        return len(self._calls)
+
+
+class AsyncSingleFlight:
+    """Versión de SingleFlight para corrutinas del modo asíncrono."""
+    def __init__(self):
+        self._calls: dict[object, 'asyncio.Task'] = {}
+
+    async def do(self, key, fn: Callable[[], Awaitable]):
+        import asyncio  # Solo el modo asíncrono lo usa; no se carga al arrancar la app Flask
+
+        task = self._calls.get(key)
+        if task is None:
+            task = self._calls[key] = asyncio.ensure_future(fn())
+            task.add_done_callback(lambda _: self._calls.pop(key, None))
+        # shield: si se cancela una solicitud, las demás siguen esperando el mismo resultado
+        return await asyncio.shield(task)
+
+
+class ChartCache:
+    """Caché de listas globales ya enriquecidas (tendencia, taquilla, etc.) con
+    semántica stale-while-revalidate: una entrada vencida se sigue sirviendo
+    mientras se actualiza en segundo plano."""
+    def __init__(self, ttl: float = 600, max_stale: float = 6 * 3600):
+        self.ttl: float = ttl  # Segundos que una entrada se considera fresca
+        self.max_stale: float = max_stale  # Segundos extra que se puede servir vencida
+        self._entries: dict[str, tuple[object, float]] = {}
+        self._loaders: dict[str, Callable[[], object]] = {}
+        self._refreshing: set[str] = set()
+        self._lock = threading.Lock()
+        self._in_flight = SingleFlight()
+        self.stats: dict[str, int] = {'fresh_hits': 0, 'stale_hits': 0, 'misses': 0}
+
+    def get(self, key: str, loader: Callable[[], object]):
+        """Devuelve la entrada `key`, usando `loader` para cargarla si no existe
+        o para actualizarla en segundo plano si ya está vencida."""
+        self.register(key, loader)
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None:
+            value, fetched_at = entry
+            age = time.time() - fetched_at
+            if age < self.ttl:
+                self._count('fresh_hits')
+                return value
+            if age < self.ttl + self.max_stale:
+                self._count('stale_hits')
+                self.refresh_async(key)
+                return value
+        self._count('misses')
+        return self.refresh(key)
+
+    def _count(self, name: str):
+        with self._lock:
+            self.stats[name] += 1
+
+    def get_stats(self) -> dict[str, int]:
+        with self._lock:
+            return dict(self.stats)
+
+    def register(self, key: str, loader: Callable[[], object]):
+        """Registra (o reemplaza) la función que carga la entrada `key`."""
+        with self._lock:
+            self._loaders[key] = loader
+
+    def refresh(self, key: str):
+        """Carga de nuevo la entrada `key` de forma síncrona; si ya hay una carga en
+        curso de la misma lista, espera esa en lugar de repetirla."""
+        return self._in_flight.do(key, lambda: self._load(key))
+
+    def _load(self, key: str):
+        loader = self._loaders[key]
+        value = loader()
+        with self._lock:
+            self._entries[key] = (value, time.time())
+        return value
+
+    def refresh_async(self, key: str):
+        """Actualiza la entrada `key` en un hilo aparte, sin duplicar actualizaciones en curso."""
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+        threading.Thread(target=self._refresh_quietly, args=(key,), daemon=True).start()
+
+    def _refresh_quietly(self, key: str):
+        from rate_limit import BACKGROUND, request_priority  # Evita la importación circular con rate_limit
+
+        try:
+            # Las actualizaciones en segundo plano ceden el cupo de Trakt/TMDB a las páginas
+            with request_priority(BACKGROUND):
+                self.refresh(key)
+        except Exception as e:
+            # Se conserva la entrada anterior; se reintentará en la próxima actualización
+            print(f"Error al actualizar la lista {key}: {e}")
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+
+_image_cache: TieredCache | None = None
+_image_cache_lock = threading.Lock()
+
+
+def get_image_cache() -> TieredCache:
+    """Devuelve la caché de metadatos de imágenes de TMDB compartida por el proceso."""
+    global _image_cache
+    if _image_cache is None:
+        with _image_cache_lock:
+            if _image_cache is None:
+                memory = LRUCache(int(os.getenv('TMDB_CACHE_MEMORY_SIZE', 2048)))
+                disk = None
+                if os.getenv('TMDB_CACHE_DISK', '1') != '0':
+                    disk = SQLiteCache(
+                        os.path.join(INSTANCE_DIR, 'tmdb_images.sqlite3'),
+                        max_entries=int(os.getenv('TMDB_CACHE_DISK_SIZE', 50000)),
+                    )
+                _image_cache = TieredCache(memory, disk)
+    return _image_cache
+
+
+_chart_cache: ChartCache | None = None
+_chart_cache_lock = threading.Lock()
+
+
+_related_cache: TieredCache | None = None
+_related_cache_lock = threading.Lock()
+
+
+def get_related_cache() -> TieredCache:
+    """Devuelve la caché de películas relacionadas (por película de Trakt) compartida por el proceso."""
+    global _related_cache
+    if _related_cache is None:
+        with _related_cache_lock:
+            if _related_cache is None:
+                memory = LRUCache(int(os.getenv('RELATED_CACHE_MEMORY_SIZE', 1024)))
+                disk = None
+                if os.getenv('RELATED_CACHE_DISK', '1') != '0':
+                    disk = SQLiteCache(os.path.join(INSTANCE_DIR, 'trakt_related.sqlite3'),
+                                       max_entries=int(os.getenv('RELATED_CACHE_DISK_SIZE', 20000)))
+                _related_cache = TieredCache(memory, disk)
+    return _related_cache
+
+
+def get_chart_cache() -> ChartCache:
+    """Devuelve la caché de listas globales compartida por el proceso."""
+    global _chart_cache
+    if _chart_cache is None:
+        with _chart_cache_lock:
+            if _chart_cache is None:
+                _chart_cache = ChartCache(
+                    ttl=float(os.getenv('CHART_CACHE_TTL', 600)),
+                    max_stale=float(os.getenv('CHART_CACHE_MAX_STALE', 6 * 3600)),
+                )
+    return _chart_cache
+
+
+_response_cache: LRUCache | None = None
+_response_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> LRUCache:
+    """Devuelve la caché de páginas de listas ya renderizadas compartida por el proceso."""
+    global _response_cache
+    if _response_cache is None:
+        with _response_cache_lock:
+            if _response_cache is None:
+                _response_cache = LRUCache(int(os.getenv('RESPONSE_CACHE_SIZE', 256)))
+    return _response_cache
+
+
+def collect_cache_metrics():
+    """Exporta los aciertos y fallos de las cachés del proceso."""
+    if _image_cache is not None:
+        for result, value in _image_cache.get_stats().items():
+            if result != 'hits':
+                yield ("cinetraker_image_cache_total", "counter", "Consultas a la caché de imágenes de TMDB",
+                       {"result": result}, value)
+    if _related_cache is not None:
+        for result, value in _related_cache.get_stats().items():
+            if result != 'hits':
+                yield ("cinetraker_related_cache_total", "counter", "Consultas a la caché de películas relacionadas",
+                       {"result": result}, value)
+    if _chart_cache is not None:
+        for result, value in _chart_cache.get_stats().items():
+            yield ("cinetraker_chart_cache_total", "counter", "Consultas a la caché de listas globales",
+                   {"result": result}, value)
+    if _response_cache is not None:
+        yield "cinetraker_response_cache_entries", "gauge", "Páginas renderizadas en caché", {}, len(_response_cache)
+
+
+registry.add_collector(collect_cache_metrics)
@@ -0,0 +1,154 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from cache import get_chart_cache
+from cine_traker import User
+from errors.error import CineTrakerError
+from image_proxy import CARD_IMAGE_WIDTH, choose_format, get_image_proxy, proxy_path, supports
+from movie_lists import CHART, LISTS
+from rate_limit import BACKGROUND, request_priority
+from metrics import registry
+
+# Precarga en segundo plano: las listas globales (con sus posters) se cargan al arrancar y se
+# actualizan cada cierto tiempo, y al iniciar sesión se adelantan las listas del usuario, para
+# que ninguna página tenga que hacer un enriquecimiento en frío.
+
+PREFETCH_LISTS = ('watchlist', 'recommended')
+
+
+class CacheWarmer:
+    def __init__(self, CLIENT_ID: str, interval: float = 600, max_workers: int = 2, warm_images: bool = True):
+        self.CLIENT_ID: str = CLIENT_ID
+        self.interval: float = interval  # Segundos entre cada recarga de las listas globales
+        self.warm_images: bool = warm_images  # Generar también las variantes del proxy de imágenes
+        self.per_page: int = int(os.getenv('LIST_PER_PAGE', 50))
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='cache-warmer')
+        self._thread: threading.Thread | None = None
+        self._lock = threading.Lock()
+        self.stats: dict[str, float | int | None] = {
+            "runs": 0,
+            "charts_warmed": 0,
+            "posters_warmed": 0,
+            "images_warmed": 0,
+            "users_prefetched": 0,
+            "errors": 0,
+            "last_run_at": None,
+            "last_run_seconds": None,
+        }
+
+    def _count(self, name: str, amount: int = 1):
+        with self._lock:
+            self.stats[name] += amount
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return dict(self.stats)
+
+    def warm_charts(self):
+        """Carga de nuevo cada lista global en la caché compartida, junto con sus posters."""
+        start = time.perf_counter()
+        chart_cache = get_chart_cache()
+        client = User(self.CLIENT_ID)
+        with request_priority(BACKGROUND):
+            for spec in LISTS.values():
+                if spec.cache != CHART:
+                    continue
+                try:
+                    chart_cache.register(spec.name, partial(client.load_list, spec))
+                    movies = chart_cache.refresh(spec.name)
+                except CineTrakerError as e:
+                    print(f"Error al precargar la lista {spec.name}: {e}")
+                    self._count("errors")
+                    continue
+                self._count("charts_warmed")
+                self._count("posters_warmed", len(movies))
+                if self.warm_images:
+                    self._warm_images(movies)
+        with self._lock:
+            self.stats["runs"] += 1
+            self.stats["last_run_at"] = time.time()
+            self.stats["last_run_seconds"] = time.perf_counter() - start
+
+    def _warm_images(self, movies):
+        """Genera la variante de tarjeta de cada poster en el proxy de imágenes."""
+        if not supports('jpeg'):  # Sin Pillow no hay variantes que generar
+            return
+        fmt = choose_format('image/avif,image/webp')
+        proxy = get_image_proxy()
+        for movie in movies:
+            tmdb_path = proxy_path(movie.poster_image)
+            if tmdb_path is None:
+                continue
+            try:
+                proxy.get_variant(tmdb_path, CARD_IMAGE_WIDTH, fmt)
+                self._count("images_warmed")
+            except (CineTrakerError, OSError) as e:
+                print(f"Error al precargar la imagen de {movie.title}: {e}")
+                self._count("errors")
+
+    def prefetch_user(self, access_token: str, profile: dict[str, str] | None = None):
+        """Adelanta en segundo plano la primera página de las listas del usuario."""
+        self._executor.submit(self._prefetch_user, access_token, profile)
+
+    def _prefetch_user(self, access_token: str, profile: dict[str, str] | None):
+        user = User(self.CLIENT_ID, access_token, profile)
+        with request_priority(BACKGROUND):
+            for name in PREFETCH_LISTS:
+                try:
+                    movies, _ = user.get_page_movies(name, 1, self.per_page)
+                    for _ in user.iter_enriched_movies(movies, name):
+                        pass
+                except CineTrakerError as e:
+                    print(f"Error al precargar la lista {name} del usuario: {e}")
+                    self._count("errors")
+        self._count("users_prefetched")
+
+    def run_forever(self):
+        while True:
+            self.warm_charts()
+            time.sleep(self.interval)
+
+    def start(self):
+        """Inicia la precarga periódica en un hilo aparte (una sola vez por proceso)."""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self.run_forever, name='cache-warmer', daemon=True)
+        self._thread.start()
+
+
+_cache_warmer: CacheWarmer | None = None
+_cache_warmer_lock = threading.Lock()
+
+
+def get_cache_warmer() -> CacheWarmer:
+    """Precargador compartido por el proceso."""
+    global _cache_warmer
+    if _cache_warmer is None:
+        with _cache_warmer_lock:
+            if _cache_warmer is None:
+                _cache_warmer = CacheWarmer(
+                    os.getenv('CLIENT_ID'),
+                    interval=float(os.getenv('CHART_REFRESH_INTERVAL', 600)),
+                    warm_images=os.getenv('WARM_IMAGES', '1') != '0',
+                )
+    return _cache_warmer
+
+
+def collect_warmer_metrics():
+    """Exporta los contadores del precargador del proceso."""
+    if _cache_warmer is None:
+        return
+    stats = _cache_warmer.get_stats()
+    for name in ("runs", "charts_warmed", "posters_warmed", "images_warmed", "users_prefetched", "errors"):
+        yield f"cinetraker_warmer_{name}_total", "counter", f"Precargador: {name}", {}, stats[name]
+    if stats["last_run_seconds"] is not None:
+        yield ("cinetraker_warmer_last_run_seconds", "gauge", "Duración de la última precarga de listas globales",
+               {}, stats["last_run_seconds"])
+        yield ("cinetraker_warmer_last_run_timestamp", "gauge", "Momento de la última precarga de listas globales",
+               {}, stats["last_run_at"])
+
+
+registry.add_collector(collect_warmer_metrics)
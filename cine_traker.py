@@ -1,13 +1,104 @@
 from errors.error import *
-import requests
+from cache import SingleFlight, TieredCache, get_chart_cache, get_image_cache, get_related_cache
+from sync_store import get_sync_store, history_rows, watched_rows, watchlist_rows
+from models import Movie, MovieList
+from movie_lists import CHART, LISTS, RELATED, SYNC, ListSpec, get_list_spec
+from movie_index import MovieIndex, MovieQuery, get_movie_indexes
+from rate_limit import bind_context
+from metrics import enriched_movies, enrichment_seconds, image_errors, timed
+from upstream import TMDB_API_URL, TMDB_IMAGE_URL, TRAKT_API_URL
 import os
+import threading
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from itertools import islice
+from typing import TYPE_CHECKING, Iterator
+
+if TYPE_CHECKING:
+    import requests
+
+def build_pagination(page: int, per_page: int, item_count: int) -> dict[str, int]:
+    """Arma la información de paginación de una lista de `item_count` películas."""
+    return {
+        "page": page,
+        "per_page": per_page,
+        "page_count": max(1, -(-item_count // per_page)),
+        "item_count": item_count,
+    }
+
+def parse_pagination(headers, movies: list[dict], page: int, limit: int) -> tuple[list[dict], dict[str, int]]:
+    """Arma la información de paginación a partir de los headers X-Pagination-* de Trakt."""
+    if "X-Pagination-Page" in headers:
+        pagination = {
+            "page": int(headers["X-Pagination-Page"]),
+            "per_page": int(headers["X-Pagination-Limit"]),
+            "page_count": int(headers["X-Pagination-Page-Count"]),
+            "item_count": int(headers["X-Pagination-Item-Count"]),
+        }
+    else:
+        # Algunos endpoints ignoran la paginación y devuelven todo; se recorta aquí
+        pagination = build_pagination(page, limit, len(movies))
+        movies = movies[(page - 1) * limit: page * limit]
+    return movies, pagination
+
+def parse_profile(data: dict) -> dict[str, str]:
+    """Extrae el nombre y el slug del usuario de la respuesta de /users/settings."""
+    return {
+        "user_name" : data["user"]["username"],
+        "user_id" : data["user"]["ids"]["slug"]
+        }
 
-class TraktAuth:
-    def __init__(self, CLIENT_ID: str, CLIENT_SECRET: str, REDIRECT_URI: str):
+def rank_related(related_lists: list[list[Movie]], exclude: set[int]) -> list[Movie]:
+    """Combina varias listas de relacionadas: primero las que aparecen en más listas y, a
+    igual frecuencia, las mejor ubicadas en alguna; se omiten las de `exclude` (ya vistas)."""
+    counts, best, movies = Counter(), {}, {}
+    for related in related_lists:
+        for position, movie in enumerate(related):
+            if movie.trakt_id is None or movie.trakt_id in exclude:
+                continue
+            counts[movie.trakt_id] += 1
+            best[movie.trakt_id] = min(best.get(movie.trakt_id, position), position)
+            movies.setdefault(movie.trakt_id, movie)
+    ranked = sorted(movies, key=lambda trakt_id: (-counts[trakt_id], best[trakt_id]))
+    return [movies[trakt_id] for trakt_id in ranked]
+
+# Relacionadas pedidas por película, cuántas de las últimas vistas se combinan y cuánto se
+# guardan (cambian muy poco y son iguales para todos los usuarios)
+RELATED_PER_MOVIE = int(os.getenv('RELATED_PER_MOVIE', 10))
+RELATED_SOURCES = int(os.getenv('RELATED_SOURCES', 10))
+RELATED_CACHE_TTL = int(os.getenv('RELATED_CACHE_TTL', 7 * 24 * 3600))
+
+# Solicitudes idénticas en curso (misma URL y mismo usuario) se comparten entre hilos
+_trakt_requests = SingleFlight()
+_tmdb_requests = SingleFlight()
+
+class HttpClient:
+    """Base de los clientes de Trakt y TMDB. La sesión HTTP compartida (y con ella
+    requests) se carga con la primera solicitud, así que crear un cliente es gratis."""
+    def __init__(self, http: 'requests.Session | None' = None):
+        self._http: 'requests.Session | None' = http
+
+    @property
+    def http(self) -> 'requests.Session':
+        if self._http is None:
+            from http_session import get_http_session
+            self._http = get_http_session()
+        return self._http
+
+    @property
+    def timeout(self) -> tuple[float, float]:
+        from http_session import get_timeout
+        return get_timeout()
+
+class TraktAuth(HttpClient):
+    def __init__(self, CLIENT_ID: str, CLIENT_SECRET: str, REDIRECT_URI: str,
+                 http: 'requests.Session | None' = None):
+        super().__init__(http)
         self.CLIENT_ID: str = CLIENT_ID
         self.CLIENT_SECRET: str = CLIENT_SECRET
         self.REDIRECT_URI = REDIRECT_URI
-        self.API_URL: str = 'https://api.trakt.tv'
+        self.API_URL: str = TRAKT_API_URL
         self.AUTH_URL: str = f'{self.API_URL}/oauth/authorize'
         self.TOKEN_URL: str = f'{self.API_URL}/oauth/token'
 
@@ -15,160 +106,189 @@ class TraktAuth:
         """Genera la URL de autorización para redirigir al usuario."""
         return f'{self.AUTH_URL}?response_type=code&client_id={self.CLIENT_ID}&redirect_uri={self.REDIRECT_URI}'
 
-    def get_access_token(self, auth_code: str) -> str | None:
-        """Intercambia el código de autorización por un token de acceso en Trakt."""
+    def _request_token(self, data: dict, error_message: str) -> dict:
+        """Hace la solicitud a /oauth/token y devuelve la respuesta completa: token de
+        acceso, de renovación, created_at y expires_in."""
         data = {
-            'code': auth_code,
+            **data,
             'client_id': self.CLIENT_ID,
             'client_secret': self.CLIENT_SECRET,
             'redirect_uri': self.REDIRECT_URI,
-            'grant_type': 'authorization_code',
         }
-        response = requests.post(self.TOKEN_URL, json=data)
+        response = self.http.post(self.TOKEN_URL, json=data, timeout=self.timeout)
         if response.status_code == 200:
-            token_data = response.json()
-            self.access_token = token_data['access_token']
-            return self.access_token
+            return response.json()
         else:
-            raise TokenRequestError(f"Error al obtener el token para acceder", "error")
+            raise TokenRequestError(error_message, "error")
+
+    def request_token(self, auth_code: str) -> dict:
+        """Intercambia el código de autorización por los tokens de Trakt."""
+        return self._request_token({'code': auth_code, 'grant_type': 'authorization_code'},
+                                   "Error al obtener el token para acceder")
 
+    def refresh_access_token(self, refresh_token: str) -> dict:
+        """Obtiene un token de acceso nuevo con el token de renovación."""
+        return self._request_token({'refresh_token': refresh_token, 'grant_type': 'refresh_token'},
+                                   "Error al renovar el token de acceso")
 
-class TraktApi:
-    def __init__(self, CLIENT_ID: str, access_token: str= None):
+    def get_access_token(self, auth_code: str) -> str | None:
+        """Intercambia el código de autorización por un token de acceso en Trakt."""
+        self.access_token = self.request_token(auth_code)['access_token']
+        return self.access_token
+
+
+class TraktApi(HttpClient):
+    def __init__(self, CLIENT_ID: str, access_token: str= None, profile: dict[str, str] | None = None,
+                 http: 'requests.Session | None' = None):
+        super().__init__(http)
         self.CLIENT_ID: str = CLIENT_ID
         self.access_token: str = access_token
-        self.API_URL: str| None = "https://api.trakt.tv"
+        self.API_URL: str| None = TRAKT_API_URL
+        # Perfil resuelto al iniciar sesión; evita consultar /users/settings en cada lista
+        self.profile: dict[str, str] | None = profile
 
     def get_headers(self) -> dict[str, str]:
         """Genera los headers para las solicitudes a la API de Trakt."""
-        return {
-            "Authorization": f"Bearer {self.access_token}",
+        headers = {
             "trakt-api-version": "2",
             "trakt-api-key": self.CLIENT_ID
         }
+        if self.access_token:  # Las listas globales no necesitan usuario autenticado
+            headers["Authorization"] = f"Bearer {self.access_token}"
+        return headers
+
+    def _get(self, url: str, error_message: str, params: dict | None = None,
+             error_class: type[CineTrakerError] = ApiRequestError) -> 'requests.Response':
+        """Hace un GET a Trakt; si otro hilo ya hizo la misma solicitud (misma URL,
+        parámetros y usuario) y sigue en curso, espera su respuesta en lugar de repetirla."""
+        key = (url, tuple(sorted((params or {}).items())), self.access_token)
+        response = _trakt_requests.do(key, lambda: self.http.get(url, headers=self.get_headers(), params=params,
+                                                                 timeout=self.timeout))
+        if response.status_code != 200:
+            raise error_class(error_message, "error")
+        return response
 
     def get_user_info(self):
         """Obtiene la información del perfil del usuario autenticado."""
-        headers = self.get_headers()
-        url = f"{self.API_URL}/users/settings"
-        response = requests.get(url, headers=headers)
-
-        if response.status_code == 200:
-            data = response.json()
-            username = data["user"]["username"]
-            user_id = data["user"]["ids"]["slug"]
-            
-            profile_info = {
-                "user_name" : username, 
-                "user_id" : user_id
-                }
-            return profile_info
-        else:
-            raise ApiRequestProfileError("Error al obtener el perfil de usuario", "error")
+        if self.profile is not None:
+            return self.profile
+        response = self._get(f"{self.API_URL}/users/settings", "Error al obtener el perfil de usuario",
+                             error_class=ApiRequestProfileError)
+        self.profile = parse_profile(response.json())
+        return self.profile
+
+    def get_list_items(self, spec: ListSpec) -> list[dict]:
+        """Obtiene los elementos de una lista de Trakt descrita en el registro de listas."""
+        url = f"{self.API_URL}{spec.endpoint}"
+        if "{user_id}" in url:
+            url = url.format(user_id=self.get_user_info().get("user_id"))
+        return self._get(url, spec.error_message).json()
 
     def get_watched_movies(self) -> list[dict[str, str]] | None:
         """Obtiene las películas YA vistas por el usuario"""
-        user_info = self.get_user_info()
-        user_id = user_info.get("user_id")
-        
-        headers = self.get_headers()
-        url = f"{self.API_URL}/users/{user_id}/watched/movies"
-        response = requests.get(url, headers=headers)
-
-        if response.status_code == 200:
-            return response.json()  # Lista de diccionarios con las películas vistas
-        else:
-            raise ApiRequestError("Error al obtener la lista de peliculas vistas", "error")
+        return self.get_list_items(LISTS['watched'])
 
     def get_watchlist_movies(self) -> list[dict[str, str]] | None:
         """Obtiene la lista de seguimiento del usuario"""
-        user_info = self.get_user_info()
-        user_id = user_info.get("user_id")
-        headers = self.get_headers()
-        url = f"{self.API_URL}/users/{user_id}/watchlist/movies/rank"
-        response = requests.get(url, headers=headers)
-
-        if response.status_code == 200:
-            return response.json()  # Lista de diccionarios con las películas en la lista de seguimiento
-        else:
-            raise ApiRequestError("Error al obtener la lista de películas en seguimiento", "error")
+        return self.get_list_items(LISTS['watchlist'])
+
+    def get_movies_page(self, url: str, page: int, limit: int, error_message: str,
+                        params: dict | None = None) -> tuple[list[dict], dict[str, int]]:
+        """Obtiene una página de una lista de Trakt usando los parámetros `page`/`limit`
+        y devuelve sus películas junto con la información de paginación."""
+        params = {**(params or {}), "page": page, "limit": limit}
+        response = self._get(url, error_message, params)
+        return parse_pagination(response.headers, response.json(), page, limit)
+
+    def iter_movies_pages(self, get_page, limit: int = 100):
+        """Recorre página por página una lista de Trakt, produciendo cada página a medida que llega."""
+        page = 1
+        while True:
+            movies, pagination = get_page(page, limit)
+            yield movies
+            if page >= pagination["page_count"]:
+                break
+            page += 1
+
+    def get_last_activities(self) -> dict:
+        """Obtiene las marcas de tiempo de la última actividad del usuario en cada lista."""
+        return self._get(f"{self.API_URL}/sync/last_activities",
+                         "Error al obtener la última actividad del usuario").json()
+
+    def get_watched_count(self) -> int:
+        """Obtiene cuántas películas distintas vio el usuario, según sus estadísticas."""
+        url = f"{self.API_URL}/users/{self.get_user_info().get('user_id')}/stats"
+        return self._get(url, "Error al obtener las estadísticas del usuario").json()['movies']['watched']
+
+    def get_history_movies_page(self, start_at: str, page: int = 1, limit: int = 100) -> tuple[list[dict], dict[str, int]]:
+        """Obtiene una página de las reproducciones de películas posteriores a `start_at`"""
+        url = f"{self.API_URL}/sync/history/movies"
+        return self.get_movies_page(url, page, limit, "Error al obtener el historial de películas vistas",
+                                    params={"start_at": start_at})
 
     def get_trend_movies(self) -> list[dict[str, str]] | None:
         """Obtiene las películas en tendencia"""
-        headers = self.get_headers()
-        url = f"{self.API_URL}/movies/trending"
-        response = requests.get(url, headers=headers)
-
-        if response.status_code == 200:
-            return response.json()  # Lista de diccionarios con las películas en tendencia
-        else:
-            raise ApiRequestError("Error al obtener la lista de películas en tendencia", "error")
+        return self.get_list_items(LISTS['trend'])
 
     def get_favorited_movies(self)-> list[dict[str, str]] | None:
         """Obtiene las películas favoritas"""
-        headers = self.get_headers()
-        url = f"{self.API_URL}/movies/favorited/weekly"
-        response = requests.get(url, headers= headers)
-    
-        if response.status_code == 200:
-            return response.json()  # Lista de diccionarios con las películas favoritas
-        else:
-            raise ApiRequestError("Error al obtener la lista de películas favoritas", "error")
+        return self.get_list_items(LISTS['favorited'])
 
     def get_cinema_movies(self)-> list[dict[str, str]] | None:
-        """Obtiene las películas favoritas"""
-        headers = self.get_headers()
-        url = f"{self.API_URL}/movies/boxoffice"
-        response = requests.get(url, headers= headers)
-    
-        if response.status_code == 200:
-            return response.json()  # Lista de diccionarios con las películas favoritas
-        else:
-            raise ApiRequestError("Error al obtener la lista de películas en cartelera", "error")
+        """Obtiene las películas en cartelera"""
+        return self.get_list_items(LISTS['cinema'])
 
     def get_anticipated_movies(self)-> list[dict[str, str]] | None:
-        """Obtiene las películas favoritas"""
-        headers = self.get_headers()
-        url = f"{self.API_URL}/movies/anticipated"
-        response = requests.get(url, headers= headers)
-    
-        if response.status_code == 200:
-            return response.json()  # Lista de diccionarios con las películas favoritas
-        else:
-            raise ApiRequestError("Error al obtener la lista de películas próximas a estrenar", "error")
+        """Obtiene las películas próximas a estrenar"""
+        return self.get_list_items(LISTS['anticipated'])
 
     def get_recommended_movies(self)-> list[dict[str, str]] | None:
-        """Obtiene las películas favoritas"""
-        headers = self.get_headers()
-        url = f"{self.API_URL}/recommendations/movies?ignore_collected=false&ignore_watchlisted=false"
-        response = requests.get(url, headers= headers)
-    
-        if response.status_code == 200:
-            return response.json()  # Lista de diccionarios con las películas favoritas
-        else:
-            raise ApiRequestError("Error al obtener la lista de películas próximas a estrenar", "error")
-
-    def get_related_movies(self)-> list[dict[str, str]] | None:
-        """Obtiene las películas relacionadas en colombia"""
-        user_info = self.get_user_info()
-        user_id = user_info.get("user_id")
-        headers = self.get_headers()
-        url = f"{self.API_URL}/movies/308/related"
-        response = requests.get(url, headers= headers)
-    
-        if response.status_code == 200:
-            return response.json()
-        else:
-            raise ApiRequestError("Error al obtener la lista de películas próximas a estrenar", "error")
+        """Obtiene las películas recomendadas para el usuario"""
+        return self.get_list_items(LISTS['recommended'])
 
-class ImageTMDB:
-    def __init__(self):
+    def get_related_movies(self, trakt_id: int, limit: int = 10) -> list[dict[str, str]] | None:
+        """Obtiene las películas relacionadas con una película (no depende del usuario)"""
+        url = f"{self.API_URL}{LISTS['related'].endpoint.format(trakt_id=trakt_id)}"
+        return self._get(url, LISTS['related'].error_message, {"limit": limit}).json()
+
+class ImageTMDB(HttpClient):
+    def __init__(self, cache: TieredCache | None = None, http: 'requests.Session | None' = None):
+        super().__init__(http)
         self.api_key = os.getenv('TMDB_ID')  # API Key para solicitudes
-        self.base_url = "https://api.themoviedb.org/3"
-        self.image_base_url = "https://image.tmdb.org/t/p/w500"
+        self.base_url = TMDB_API_URL
+        self.image_base_url = f"{TMDB_IMAGE_URL}/w500"
+        self.cache: TieredCache = cache if cache is not None else get_image_cache()
+        # Los posters casi nunca cambian; las películas sin imágenes se reintentan antes
+        self.cache_ttl: int = int(os.getenv('TMDB_CACHE_TTL', 7 * 24 * 3600))
+        self.negative_cache_ttl: int = int(os.getenv('TMDB_NEGATIVE_CACHE_TTL', 24 * 3600))
 
     def get_movie_images(self, movie_id):
-        """Obtiene las imágenes (posters y backdrops) de una película por su ID."""
+        """Obtiene las imágenes (posters y backdrops) de una película por su ID,
+        usando la caché de metadatos de TMDB cuando es posible."""
+        backdrop_urls = self.cache.get(movie_id)
+        if backdrop_urls is not None:
+            return backdrop_urls
+        # Varias listas o usuarios pidiendo la misma película a la vez hacen una sola consulta
+        return _tmdb_requests.do(movie_id, lambda: self._load_movie_images(movie_id))
+
+    def _load_movie_images(self, movie_id):
+        backdrop_urls = self.fetch_movie_images(movie_id)
+        ttl = self.cache_ttl if backdrop_urls else self.negative_cache_ttl
+        self.cache.set(movie_id, backdrop_urls, ttl)
+        return backdrop_urls
+
+    def parse_backdrops(self, images_data: dict) -> list[str]:
+        """Arma las URLs completas de los backdrops de la respuesta de TMDB."""
+        backdrops = images_data.get('backdrops', [])
+        return [
+            f"{self.image_base_url}{backdrop['file_path']}" 
+            for backdrop in backdrops if 'file_path' in backdrop
+        ]
+
+    def fetch_movie_images(self, movie_id):
+        """Consulta a TMDB las imágenes (posters y backdrops) de una película por su ID."""
+        from requests.exceptions import HTTPError  # Ya cargado: lo usa self.http
+
         url = f"{self.base_url}/movie/{movie_id}/images"
         params = {
             "api_key": self.api_key,  # Solo API Key aquí
@@ -178,252 +298,311 @@ class ImageTMDB:
             raise ValueError("API Key de TMDB no está configurada.")
 
         try:
-            response = requests.get(url, params=params)
+            response = self.http.get(url, params=params, timeout=self.timeout)
             response.raise_for_status()  # Lanza una excepción si el código de estado no es 200
 
-            images_data = response.json()
-            backdrops = images_data.get('backdrops', [])
-
-            backdrop_urls = [
-                f"{self.image_base_url}{backdrop['file_path']}" 
-                for backdrop in backdrops if 'file_path' in backdrop
-            ]
-            return backdrop_urls
-        except requests.exceptions.HTTPError as e:
+            return self.parse_backdrops(response.json())
+        except HTTPError as e:
             # Agregar información sobre el error específico
             raise ErrorFetchImage(f"Error al realizar la solicitud: {e}", "error")
         except Exception as e:
             raise ErrorFetchImage(f"Error inesperado: {e}", "error")
 
+_image_tmdb: ImageTMDB | None = None
+_image_tmdb_lock = threading.Lock()
+
+
+def get_image_tmdb() -> ImageTMDB:
+    """Cliente de TMDB compartido por todos los usuarios (no depende del usuario)."""
+    global _image_tmdb
+    if _image_tmdb is None:
+        with _image_tmdb_lock:
+            if _image_tmdb is None:
+                _image_tmdb = ImageTMDB()
+    return _image_tmdb
+
 class User(TraktApi):
-    def __init__(self, CLIENT_ID, access_token = None):
-        super().__init__(CLIENT_ID, access_token)
+    def __init__(self, CLIENT_ID, access_token = None, profile: dict[str, str] | None = None,
+                 max_workers: int | None = None, image_tmdb: ImageTMDB | None = None,
+                 http: 'requests.Session | None' = None):
+        super().__init__(CLIENT_ID, access_token, profile, http)
         self.lists: dict[str, list] = {}
-        self.image_tmdb = ImageTMDB()
-        
-    def get_watch_list(self):
+        self.image_tmdb: ImageTMDB = image_tmdb or get_image_tmdb()
+        # Número máximo de solicitudes simultáneas a TMDB al enriquecer una lista
+        self.max_workers: int = max_workers or int(os.getenv('TMDB_MAX_WORKERS', 8))
+
+    def _build_movie_data(self, movie: Movie) -> Movie:
+        """Obtiene el poster de una película y lo asigna para la plantilla."""
+        if movie.poster_image is not None:  # Las listas globales ya vienen enriquecidas
+            return movie
+        try:
+            movie_images = self.image_tmdb.get_movie_images(movie.tmdb_id)
+        except ErrorFetchImage as e:
+            image_errors.inc()
+            print(f"Error al obtener imágenes para {movie.title}: {e}")
+            # Se muestra con la imagen por defecto: la página debe tener las mismas películas
+            # que su ETag, calculado antes de pedir los posters
+            movie_images = []
+        return movie.set_poster(movie_images)
+
+    def iter_enriched_movies(self, movies: list[Movie], name: str = '') -> Iterator[Movie]:
+        """Obtiene los posters de un lote de películas de Trakt de forma concurrente y
+        produce cada película en cuanto está lista, conservando el orden original."""
+        if not movies:
+            return
+        workers = min(self.max_workers, len(movies))
+        executor = ThreadPoolExecutor(max_workers=workers)
+        build = bind_context(self._build_movie_data)
+        # Solo unas pocas tareas en cola a la vez: con miles de películas, un Future por cada
+        # una (como hace executor.map) pesa más que la lista misma
+        remaining = iter(movies)
+        pending = deque(executor.submit(build, movie) for movie in islice(remaining, 4 * workers))
+        count = 0
+        try:
+            with timed(enrichment_seconds, 'enrich', list=name):
+                while pending:
+                    movie = pending.popleft().result()
+                    next_movie = next(remaining, None)
+                    if next_movie is not None:
+                        pending.append(executor.submit(build, next_movie))
+                    count += 1
+                    yield movie
+        finally:
+            # Si el cliente corta la respuesta no se siguen pidiendo posters
+            executor.shutdown(wait=False, cancel_futures=True)
+            enriched_movies.inc(count, list=name)
+
+    def enrich_movies(self, movies: list[Movie], name: str = '') -> MovieList:
+        """Obtiene los posters de un lote de películas de Trakt de forma concurrente,
+        conservando el orden original de la lista."""
+        return MovieList(name, self.iter_enriched_movies(movies, name))
+
+    def _chart_client(self) -> 'User':
+        """Cliente sin usuario para cargar las listas globales, que son iguales para todos."""
+        return User(self.CLIENT_ID, max_workers=self.max_workers)
+
+    def load_list(self, spec: ListSpec) -> MovieList:
+        """Descarga una lista de Trakt y la enriquece con posters, sin pasar por cachés."""
+        return self.enrich_movies(self.fetch_list_movies(spec), spec.name)
+
+    def fetch_list_movies(self, spec: ListSpec, limit: int | None = None) -> list[Movie]:
+        """Descarga una lista de Trakt y la convierte en películas sin poster. El JSON de la
+        respuesta se libera al volver, antes de que empiece a pedirse ningún poster."""
+        items = self.get_list_items(spec) or []
+        if spec.limit is not None:
+            limit = spec.limit if limit is None else min(limit, spec.limit)
+        return [Movie.from_trakt(spec.extractor(item)) for item in items[:limit]]
+
+    def sync_list(self, spec: ListSpec):
+        """Actualiza la copia local de una lista del usuario."""
+        if spec.name == 'watched':
+            self.sync_watched()
+        else:
+            self.sync_watchlist()
+
+    def get_list(self, name: str) -> MovieList:
+        """Obtiene una lista del registro por su nombre, aplicando su política de caché."""
+        spec = get_list_spec(name)
+        if spec.cache == CHART:
+            return get_chart_cache().get(spec.name, partial(self._chart_client().load_list, spec))
+        if spec.cache == SYNC:
+            self.sync_list(spec)
+            user_id = self.get_user_info().get("user_id")
+            movies = get_sync_store().get_movies(user_id, spec.name, descending=spec.descending)
+            return self.enrich_movies(movies, spec.name)
+        if spec.cache == RELATED:
+            return self.enrich_movies(self.get_related(spec.movie_id), spec.name)
+        return self.load_list(spec)
+
+    def get_movie_related(self, trakt_id: int) -> list[Movie]:
+        """Obtiene las películas relacionadas con una película desde la caché de
+        relacionadas; si no están, se piden a Trakt sin usuario (son iguales para todos)."""
+        cache = get_related_cache()
+        rows = cache.get(trakt_id)
+        if rows is None:
+            items = self._chart_client().get_related_movies(trakt_id, RELATED_PER_MOVIE) or []
+            rows = [[movie.title, movie.year, movie.trakt_id, movie.tmdb_id]
+                    for movie in (Movie.from_trakt(item) for item in items)]
+            cache.set(trakt_id, rows, RELATED_CACHE_TTL)
+        return [Movie(*row) for row in rows]
+
+    def _get_movie_related(self, trakt_id: int) -> list[Movie]:
+        try:
+            return self.get_movie_related(trakt_id)
+        except CineTrakerError as e:
+            print(f"Error al obtener las relacionadas de la película {trakt_id}: {e}")
+            return []
+
+    def get_recent_related(self) -> list[Movie]:
+        """Obtiene las películas relacionadas con las últimas vistas por el usuario.
+
+        Las relacionadas de cada película se consultan en paralelo y se ordenan por cuántas
+        veces aparecen; las que el usuario ya vio se descartan."""
+        self.sync_list(LISTS['watched'])
+        user_id = self.get_user_info().get("user_id")
+        store = get_sync_store()
+        recent = store.get_movies(user_id, 'watched', 0, RELATED_SOURCES, descending=True)
+        if not recent:
+            return []
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(recent))) as executor:
+            related = list(executor.map(bind_context(self._get_movie_related), [movie.trakt_id for movie in recent]))
+        return rank_related(related, store.get_trakt_ids(user_id, 'watched'))
+
+    def get_related(self, movie_id: int | None = None) -> list[Movie]:
+        """Relacionadas con una película, o con las últimas vistas si no se indica ninguna."""
+        if movie_id is not None:
+            return self.get_movie_related(movie_id)
+        return self.get_recent_related()
+
+    def get_page_movies(self, name: str, page: int = 1, per_page: int = 50,
+                        query: MovieQuery | None = None) -> tuple[list[Movie], dict[str, int]]:
+        """Obtiene las películas de la página visible de una lista, sin pedir posters
+        (salvo que la lista ya los tenga), junto con la información de paginación.
+        Con `query` se busca, filtra y ordena sobre el índice en memoria de la lista."""
+        spec = get_list_spec(name)
+        if spec.cache == SYNC:
+            self.sync_list(spec)
+            user_id = self.get_user_info().get("user_id")
+            store = get_sync_store()
+            if query:
+                index = get_movie_indexes().get(store, user_id, spec.name, spec.descending)
+                movies, count = index.search(query, (page - 1) * per_page, per_page)
+                return movies, build_pagination(page, per_page, count)
+            pagination = build_pagination(page, per_page, store.count_movies(user_id, spec.name))
+            return store.get_movies(user_id, spec.name, (page - 1) * per_page, per_page, spec.descending), pagination
+        movies = self.get_list_movies(spec)
+        if query:
+            movies, _ = MovieIndex.from_movies(movies).search(query)
+        pagination = build_pagination(page, per_page, len(movies))
+        return movies[(page - 1) * per_page: page * per_page], pagination
+
+    def get_list_page(self, name: str, page: int = 1, per_page: int = 50) -> tuple[Iterator[Movie], dict[str, int]]:
+        """Obtiene solo la página visible de una lista; los posters que faltan se
+        resuelven a medida que se recorre el iterador."""
+        movies, pagination = self.get_page_movies(name, page, per_page)
+        return self.iter_enriched_movies(movies, name), pagination
+
+    def get_list_movies(self, spec: ListSpec, limit: int | None = None) -> list[Movie]:
+        """Obtiene las primeras `limit` películas de una lista. Las listas globales ya
+        vienen con poster; las demás se devuelven sin enriquecer."""
+        if spec.cache == CHART:
+            return list(self.get_list(spec.name)[:limit])
+        if spec.cache == SYNC:
+            self.sync_list(spec)
+            user_id = self.get_user_info().get("user_id")
+            return get_sync_store().get_movies(user_id, spec.name, 0, limit, spec.descending)
+        if spec.cache == RELATED:
+            return self.get_related(spec.movie_id)[:limit]
+        return self.fetch_list_movies(spec, limit)
+
+    def _get_posters(self, tmdb_id) -> list[str]:
+        try:
+            return self.image_tmdb.get_movie_images(tmdb_id)
+        except ErrorFetchImage as e:
+            image_errors.inc()
+            print(f"Error al obtener imágenes para la película {tmdb_id}: {e}")
+            return []  # Igual que en enrich_movies, queda con la imagen por defecto
+
+    def get_dashboard(self, names: list[str], per_list: int = 10) -> tuple[dict[str, MovieList], dict[str, str]]:
+        """Obtiene varias listas a la vez para el panel principal.
+
+        Las listas se descargan en paralelo y luego se piden todos los posters que faltan
+        en una sola pasada, una vez por id de TMDB aunque la película esté en varias listas.
+        Devuelve las listas cargadas y los mensajes de error de las que fallaron."""
+        specs = [get_list_spec(name) for name in names]
+        if not specs:
+            return {}, {}
+        with ThreadPoolExecutor(max_workers=len(specs)) as executor:
+            get_list_movies = bind_context(self.get_list_movies)
+            futures = {spec.name: executor.submit(get_list_movies, spec, per_list) for spec in specs}
+        lists, errors = {}, {}
+        for name, future in futures.items():
+            try:
+                lists[name] = future.result()
+            except CineTrakerError as err:
+                errors[name] = err.args[0]
+
+        tmdb_ids = list({movie.tmdb_id for movies in lists.values() for movie in movies
+                         if movie.poster_image is None})
+        posters = {}
+        if tmdb_ids:
+            with ThreadPoolExecutor(max_workers=min(self.max_workers, len(tmdb_ids))) as executor:
+                posters = dict(zip(tmdb_ids, executor.map(bind_context(self._get_posters), tmdb_ids)))
+
+        dashboard = {}
+        for name, movies in lists.items():
+            movie_list = MovieList(name)
+            for movie in movies:
+                if movie.poster_image is None:
+                    movie.set_poster(posters[movie.tmdb_id])
+                movie_list.add(movie)
+            dashboard[name] = movie_list
+        return dashboard, errors
+
+    def sync_watched(self):
+        """Sincroniza la copia local de películas vistas: solo descarga lo que cambió
+        desde la última actividad guardada."""
+        store = get_sync_store()
+        user_id = self.get_user_info().get("user_id")
+        pending = store.pending_activity(user_id, 'watched', self.get_last_activities())
+        if pending is None:
+            return
+        remote_activity, local_activity = pending
+
+        movies = []
+        if local_activity is not None:
+            get_page = lambda page, limit: self.get_history_movies_page(local_activity, page, limit)
+            for items in self.iter_movies_pages(get_page):
+                movies.extend(history_rows(items))
+        if movies and store.merge_history(user_id, movies, remote_activity, self.get_watched_count()):
+            return
+
+        # Primera sincronización, o cambió la actividad sin reproducciones nuevas o con películas
+        # que ya no están en Trakt (p. ej. se borró historial): se descarga la lista completa
+        movies = watched_rows(self.get_watched_movies() or [])
+        store.save_movies(user_id, 'watched', movies, remote_activity, replace=True)
+
+    def sync_watchlist(self):
+        """Sincroniza la copia local de la lista de seguimiento si cambió en Trakt."""
+        store = get_sync_store()
+        user_id = self.get_user_info().get("user_id")
+        pending = store.pending_activity(user_id, 'watchlist', self.get_last_activities())
+        if pending is None:
+            return
+        remote_activity, _ = pending
+
+        # La lista de seguimiento es corta y puede reordenarse, así que se reemplaza completa
+        movies = watchlist_rows(self.get_watchlist_movies() or [])
+        store.save_movies(user_id, 'watchlist', movies, remote_activity, replace=True)
+
+    def get_watch_list(self) -> MovieList:
         """Obtiene y almacena las películas por ver del usuario en una lista."""
-        watch_movies = self.get_watchlist_movies()
-        movies_data = []  # Lista para almacenar los datos de las películas
-
-        if watch_movies:
-            for item in watch_movies:
-                movie_title = item['movie']['title']
-                movie_year = item['movie']['year']
-                movie_id = item['movie']['ids']['tmdb']
-
-                try:
-                    movie_images = self.image_tmdb.get_movie_images(movie_id)
-                    poster_image = movie_images[0] if movie_images else "static/img/fondo_gris.jpg"
-                    
-                    # Agregar la información de la película a la lista
-                    movies_data.append({
-                        'title': movie_title,
-                        'year': movie_year,
-                        'poster_image': poster_image
-                    })
-                except ErrorFetchImage as e:
-                    print(f"Error al obtener imágenes para {movie_title}: {e}")
-
-        return movies_data
-
-    def get_watched_list(self):
-        """Obtiene y almacena las películas YA VISTAS del usuario en una lista."""
-        watched_movies = self.get_watched_movies()
-        movies_data = []  # Lista para almacenar los datos de las películas
-
-        if watched_movies:
-            for item in watched_movies:
-                movie_title = item['movie']['title']
-                movie_year = item['movie']['year']
-                movie_id = item['movie']['ids']['tmdb']
-
-                try:
-                    movie_images = self.image_tmdb.get_movie_images(movie_id)
-                    poster_image = movie_images[0] if movie_images else "static/img/fondo_gris.jpg"
-                    
-                    # Agregar la información de la película a la lista
-                    movies_data.append({
-                        'title': movie_title,
-                        'year': movie_year,
-                        'poster_image': poster_image
-                    })
-                except ErrorFetchImage as e:
-                    print(f"Error al obtener imágenes para {movie_title}: {e}")
-
-        return movies_data
-
-    def get_trend_list(self):
-        """Obtiene y almacena las películas en tendencia del usuario en una lista."""
-        trend_movies = self.get_trend_movies()
-        movies_data = []  # Lista para almacenar los datos de las películas
-
-        if trend_movies:
-            for item in trend_movies[:10]:
-                movie_title = item['movie']['title']
-                movie_year = item['movie']['year']
-                movie_id = item['movie']['ids']['tmdb']
-
-                try:
-                    movie_images = self.image_tmdb.get_movie_images(movie_id)
-                    poster_image = movie_images[0] if movie_images else "static/img/fondo_gris.jpg"
-                    
-                    # Agregar la información de la película a la lista
-                    movies_data.append({
-                        'title': movie_title,
-                        'year': movie_year,
-                        'poster_image': poster_image
-                    })
-                except ErrorFetchImage as e:
-                    print(f"Error al obtener imágenes para {movie_title}: {e}")
-
-        return movies_data
-
-    def get_favorited_list(self):
-        """Obtiene y almacena las películas YA VISTAS del usuario en una lista."""
-        fav_movies = self.get_favorited_movies()
-        movies_data = []  # Lista para almacenar los datos de las películas
-
-        if fav_movies:
-            for item in fav_movies:
-                movie_title = item['movie']['title']
-                movie_year = item['movie']['year']
-                movie_id = item['movie']['ids']['tmdb']
-
-                try:
-                    movie_images = self.image_tmdb.get_movie_images(movie_id)
-                    poster_image = movie_images[0] if movie_images else "static/img/fondo_gris.jpg"
-                    
-                    # Agregar la información de la película a la lista
-                    movies_data.append({
-                        'title': movie_title,
-                        'year': movie_year,
-                        'poster_image': poster_image
-                    })
-                except ErrorFetchImage as e:
-                    print(f"Error al obtener imágenes para {movie_title}: {e}")
-
-        return movies_data
-    
-    def get_cinema_list(self):
+        return self.get_list('watchlist')
+
+    def get_watched_list(self) -> MovieList:
         """Obtiene y almacena las películas YA VISTAS del usuario en una lista."""
-        cine_movies = self.get_cinema_movies()
-        movies_data = []  # Lista para almacenar los datos de las películas
-
-        if cine_movies:
-            for item in cine_movies[:10]:
-                movie_title = item['movie']['title']
-                movie_year = item['movie']['year']
-                movie_id = item['movie']['ids']['tmdb']
-
-                try:
-                    movie_images = self.image_tmdb.get_movie_images(movie_id)
-                    poster_image = movie_images[0] if movie_images else "static/img/fondo_gris.jpg"
-                    
-                    # Agregar la información de la película a la lista
-                    movies_data.append({
-                        'title': movie_title,
-                        'year': movie_year,
-                        'poster_image': poster_image
-                    })
-                except ErrorFetchImage as e:
-                    print(f"Error al obtener imágenes para {movie_title}: {e}")
-
-        return movies_data
-    
-    def get_anticipated_list(self):
-        """Obtiene y almacena las películas prontas a estrenar en cine en una lista."""
-        cine_movies = self.get_anticipated_movies()
-        movies_data = []  # Lista para almacenar los datos de las películas
-
-        if cine_movies:
-            for item in cine_movies[:10]:
-                movie_title = item['movie']['title']
-                movie_year = item['movie']['year']
-                movie_id = item['movie']['ids']['tmdb']
-
-                try:
-                    movie_images = self.image_tmdb.get_movie_images(movie_id)
-                    poster_image = movie_images[0] if movie_images else "static/img/fondo_gris.jpg"
-                    
-                    # Agregar la información de la película a la lista
-                    movies_data.append({
-                        'title': movie_title,
-                        'year': movie_year,
-                        'poster_image': poster_image
-                    })
-                except ErrorFetchImage as e:
-                    print(f"Error al obtener imágenes para {movie_title}: {e}")
-
-        return movies_data
-
-    def get_recommended_list(self):
+        return self.get_list('watched')
+
+    def get_trend_list(self) -> MovieList:
+        """Obtiene y almacena las películas en tendencia en una lista."""
+        return self.get_list('trend')
+
+    def get_favorited_list(self) -> MovieList:
+        """Obtiene y almacena las películas favoritas en una lista."""
+        return self.get_list('favorited')
+
+    def get_cinema_list(self) -> MovieList:
+        """Obtiene y almacena las películas en cartelera en una lista."""
+        return self.get_list('cinema')
+
+    def get_anticipated_list(self) -> MovieList:
         """Obtiene y almacena las películas prontas a estrenar en cine en una lista."""
-        cine_movies = self.get_recommended_movies()
-        movies_data = []  # Lista para almacenar los datos de las películas
-
-        if cine_movies:
-            for item in cine_movies[:10]:
-                movie_title = item['title']
-                movie_year = item['year']
-                movie_id = item['ids']['tmdb']
-
-                try:
-                    movie_images = self.image_tmdb.get_movie_images(movie_id)
-                    poster_image = movie_images[0] if movie_images else "static/img/fondo_gris.jpg"
-                    
-                    # Agregar la información de la película a la lista
-                    movies_data.append({
-                        'title': movie_title,
-                        'year': movie_year,
-                        'poster_image': poster_image
-                    })
-                except ErrorFetchImage as e:
-                    print(f"Error al obtener imágenes para {movie_title}: {e}")
-
-        return movies_data
-
-    def get_related_list(self):
-        """Obtiene y almacena las películas relacionadas en una lista."""
-        related_movies = self.get_related_movies()
-        movies_data = []  # Lista para almacenar los datos de las películas
-
-        if related_movies:
-            for item in related_movies[:10]:
-                movie_title = item['title']
-                movie_year = item['year']
-                movie_id = item['ids']['tmdb']
-
-                try:
-                    movie_images = self.image_tmdb.get_movie_images(movie_id)
-                    poster_image = movie_images[0] if movie_images else "static/img/fondo_gris.jpg"
-                    
-                    # Agregar la información de la película a la lista
-                    movies_data.append({
-                        'title': movie_title,
-                        'year': movie_year,
-                        'poster_image': poster_image
-                    })
-                except ErrorFetchImage as e:
-                    print(f"Error al obtener imágenes para {movie_title}: {e}")
-        return movies_data
-
-class Movie:
-    """Representa una película con su título, año y poster."""
-    def __init__(self, title: str, year: str, poster_image: str= None):
-        #Poner en el construcro poster_img
-        #self.poster: str = poster
-        self.title: str = title
-        self.year: str = year
-        self.poster_image: str = poster_image
-
-    def __str__(self):
-        if self.poster_image:
-            return f"{self.title} ({self.year}) - Poster: {self.poster_image}"
-        return f"{self.title} ({self.year})"
-
-class MovieList:
-    """Representa una lista de películas."""
-    def __init__(self, name: str):
-        self.name: str = name
-        self.movies: list[Movie] = []
\ No newline at end of file
+        return self.get_list('anticipated')
+
+    def get_recommended_list(self) -> MovieList:
+        """Obtiene y almacena las películas recomendadas en una lista."""
+        return self.get_list('recommended')
+
+    def get_related_list(self) -> MovieList:
+        """Obtiene y almacena las películas relacionadas con las últimas vistas en una lista."""
+        return self.get_list('related')
@@ -24,4 +24,9 @@ class ErrorFetchImage(CineTrakerError):
     pass
 
 class ListNotFoundError(CineTrakerError):
-    pass
\ No newline at end of file
+    pass
+class ImageNotFoundError(CineTrakerError):
+    pass
+
+class RateLimitError(ApiRequestError):
+    pass
@@ -0,0 +1,40 @@
+import hashlib
+from dataclasses import dataclass
+from datetime import datetime
+from models import Movie
+from movie_index import MovieQuery
+from movie_lists import CHART, ListSpec
+
+# Caché HTTP de las páginas de listas: cada página se identifica por un hash de su contenido
+# (ETag), que se calcula antes de pedir posters y renderizar. Si el navegador ya tiene esa
+# versión se responde 304, y si el servidor ya la renderizó se reutiliza el HTML guardado.
+
+
+@dataclass(frozen=True, slots=True)
+class CachedPage:
+    """HTML ya renderizado de una página de lista, con su versión."""
+    etag: str
+    last_modified: datetime
+    body: str
+
+
+def list_etag(spec: ListSpec, page: int, per_page: int, movies: list[Movie],
+              query: MovieQuery | None = None) -> str:
+    """Calcula el ETag de una página de lista a partir de las películas que contiene
+    (y de la búsqueda, que también se muestra en la página)."""
+    content = hashlib.sha1(f"{spec.name}:{spec.movie_id}:{page}:{per_page}:{query or ''}".encode())
+    for movie in movies:
+        content.update(f"|{movie.trakt_id}:{movie.tmdb_id}:{movie.title}:{movie.year}".encode())
+    return content.hexdigest()
+
+
+def response_cache_key(spec: ListSpec, access_token: str, page: int, per_page: int,
+                       query: MovieQuery | None = None) -> tuple:
+    """Clave de la caché de respuestas: las listas globales se comparten entre usuarios y
+    las demás se separan por usuario (un hash del token, nunca el token mismo). Las
+    relacionadas con una película también son iguales para todos."""
+    query = query or None  # Sin búsqueda ni orden es la misma página que sin parámetros
+    if spec.cache == CHART or spec.movie_id is not None:
+        return (spec.name, spec.movie_id, page, per_page, query)
+    identity = hashlib.sha256(access_token.encode()).hexdigest()[:16]
+    return (identity, spec.name, page, per_page, query)
@@ -0,0 +1,147 @@
+import os
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from metrics import rate_limit_wait_seconds, record_upstream, timed, upstream_retries
+from rate_limit import RequestScheduler, get_scheduler
+from upstream import url_host
+
+_session: requests.Session | None = None
+_session_lock = threading.Lock()
+
+
+def get_timeout() -> tuple[float, float]:
+    """Devuelve el timeout (conexión, lectura) que se aplica a toda solicitud saliente."""
+    return (
+        float(os.getenv('HTTP_CONNECT_TIMEOUT', 3.05)),
+        float(os.getenv('HTTP_READ_TIMEOUT', 10)),
+    )
+
+
+class ScheduledSession(requests.Session):
+    """Sesión que pasa cada solicitud por el planificador de límites de Trakt/TMDB,
+    reintenta las respuestas 429 cuando el bucket vuelve a tener cupo (Retry-After) y
+    registra la duración, el código de estado y el tamaño de cada respuesta."""
+    def __init__(self, scheduler: RequestScheduler | None, max_retries: int = 3):
+        super().__init__()
+        self.scheduler: RequestScheduler | None = scheduler
+        self.max_retries: int = max_retries
+
+    def request(self, method, url, *args, **kwargs):
+        host = url_host(url)
+        buckets = self.scheduler.get_buckets(url, kwargs.get('headers')) if self.scheduler else []
+        for attempt in range(self.max_retries + 1):
+            if buckets:
+                with timed(rate_limit_wait_seconds, 'rate-limit', host=host):
+                    self.scheduler.acquire(buckets)
+            start = time.perf_counter()
+            response = super().request(method, url, *args, **kwargs)
+            record_upstream(host, response.status_code, time.perf_counter() - start, len(response.content))
+            # Reintentos que urllib3 ya hizo dentro de esta solicitud (5xx o fallos de conexión)
+            retries = getattr(getattr(response, 'raw', None), 'retries', None)
+            for retry in getattr(retries, 'history', ()):
+                upstream_retries.inc(host=host, reason=retry.status or 'connection')
+            if buckets:
+                self.scheduler.record_response(buckets, response.status_code, response.headers)
+            if response.status_code != 429 or not buckets or attempt == self.max_retries:
+                return response
+            upstream_retries.inc(host=host, reason=429)
+            response.close()
+
+
+def build_http_session() -> requests.Session:
+    """Crea una sesión HTTP con conexiones keep-alive reutilizables, reintentos con
+    backoff ante respuestas 5xx y control de límites de solicitudes (429)."""
+    max_retries = int(os.getenv('HTTP_MAX_RETRIES', 3))
+    retries = Retry(
+        total=max_retries,
+        backoff_factor=float(os.getenv('HTTP_BACKOFF_FACTOR', 0.5)),
+        status_forcelist=(500, 502, 503, 504),  # Los 429 los maneja el planificador
+        respect_retry_after_header=True,
+        raise_on_status=False,  # La última respuesta la manejan los clientes como siempre
+    )
+    adapter = HTTPAdapter(
+        pool_connections=int(os.getenv('HTTP_POOL_CONNECTIONS', 4)),  # Número de hosts con pool
+        pool_maxsize=int(os.getenv('HTTP_POOL_MAXSIZE', 16)),  # Conexiones por host
+        max_retries=retries,
+    )
+    session = ScheduledSession(get_scheduler(), max_retries)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def get_http_session() -> requests.Session:
+    """Devuelve la sesión HTTP compartida por todo el proceso."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = build_http_session()
+    return _session
+
+
+_async_client = None
+
+
+def get_async_http_client():
+    """Devuelve el cliente HTTP asíncrono (httpx) compartido por el proceso, con la
+    misma configuración de pool y timeouts que la sesión síncrona."""
+    global _async_client
+    if _async_client is None:
+        import httpx  # Dependencia opcional, solo para el modo asíncrono
+
+        connect_timeout, read_timeout = get_timeout()
+        _async_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            limits=httpx.Limits(
+                max_connections=int(os.getenv('HTTP_ASYNC_MAX_CONNECTIONS', 100)),
+                max_keepalive_connections=int(os.getenv('HTTP_POOL_MAXSIZE', 16)),
+            ),
+            # httpx solo reintenta fallos de conexión; los 429 los maneja el planificador
+            transport=ScheduledAsyncTransport(
+                httpx.AsyncHTTPTransport(retries=int(os.getenv('HTTP_MAX_RETRIES', 3))),
+                get_scheduler(),
+                int(os.getenv('HTTP_MAX_RETRIES', 3)),
+            ),
+        )
+    return _async_client
+
+
+class ScheduledAsyncTransport:
+    """Transporte httpx que pasa cada solicitud por el planificador (ver ScheduledSession)."""
+    def __init__(self, transport, scheduler: RequestScheduler | None, max_retries: int = 3):
+        self.transport = transport
+        self.scheduler: RequestScheduler | None = scheduler
+        self.max_retries: int = max_retries
+
+    async def handle_async_request(self, request):
+        host = url_host(str(request.url))
+        buckets = self.scheduler.get_buckets(str(request.url), request.headers) if self.scheduler else []
+        for attempt in range(self.max_retries + 1):
+            if buckets:
+                with timed(rate_limit_wait_seconds, 'rate-limit', host=host):
+                    await self.scheduler.acquire_async(buckets)
+            start = time.perf_counter()
+            response = await self.transport.handle_async_request(request)
+            # El cuerpo aún no se leyó: el tamaño sale de Content-Length cuando viene
+            record_upstream(host, response.status_code, time.perf_counter() - start,
+                            int(response.headers.get('Content-Length', 0)))
+            if buckets:
+                await self.scheduler.record_response_async(buckets, response.status_code, response.headers)
+            if response.status_code != 429 or not buckets or attempt == self.max_retries:
+                return response
+            upstream_retries.inc(host=host, reason=429)
+            await response.aclose()
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+    async def __aenter__(self):
+        await self.transport.__aenter__()
+        return self
+
+    async def __aexit__(self, *args):
+        await self.transport.__aexit__(*args)
@@ -0,0 +1,212 @@
+import os
+import re
+import threading
+import time
+from cache import INSTANCE_DIR, SingleFlight
+from errors.error import ErrorFetchImage, ImageNotFoundError
+from http_session import get_http_session, get_timeout
+from upstream import TMDB_IMAGE_URL
+
+try:
+    from PIL import Image, features
+except ImportError:  # Pillow es opcional: sin él se sirve la imagen original sin recomprimir
+    Image = None
+
+# Proxy de imágenes de TMDB: cada imagen se descarga una sola vez, se guarda en disco y se
+# sirve redimensionada al tamaño de las tarjetas en el formato más liviano que acepte el navegador.
+
+CARD_IMAGE_WIDTH = int(os.getenv('CARD_IMAGE_WIDTH', 400))
+# Anchos permitidos; evita generar variantes arbitrarias
+IMAGE_WIDTHS = tuple(sorted({200, 400, 600, CARD_IMAGE_WIDTH}))
+# AVIF tiene su propia escala: ~50 equivale visualmente a ~70 en WebP/JPEG
+AVIF_QUALITY = int(os.getenv('AVIF_QUALITY', 50))
+MIMETYPES = {
+    'avif': 'image/avif',
+    'webp': 'image/webp',
+    'jpeg': 'image/jpeg',
+    'png': 'image/png',
+}
+# Los nombres de archivo de TMDB son un hash del contenido, así que nunca cambian
+_TMDB_FILE = re.compile(r'^/?([A-Za-z0-9_-]+)\.(jpg|jpeg|png)$')
+
+
+# Una imagen pedida por varias tarjetas o usuarios a la vez se descarga y redimensiona una vez
+_image_jobs = SingleFlight()
+
+
+def supports(fmt: str) -> bool:
+    """Indica si Pillow puede codificar el formato en esta instalación."""
+    if Image is None:
+        return False
+    if fmt in ('avif', 'webp'):
+        return features.check(fmt)
+    return True
+
+
+def choose_format(accept: str) -> str:
+    """Elige el formato más liviano que acepta el navegador según su header Accept."""
+    for fmt in ('avif', 'webp'):
+        if MIMETYPES[fmt] in accept and supports(fmt):
+            return fmt
+    return 'jpeg'
+
+
+def save_variant(source: str, target: str, width: int, fmt: str, quality: int):
+    """Redimensiona `source` a `width` px de ancho (sin agrandarla) y la guarda en `target`."""
+    with Image.open(source) as image:
+        image.thumbnail((width, image.height), Image.LANCZOS)
+        if fmt == 'jpeg' and image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        options = {'quality': quality}
+        if fmt == 'jpeg':
+            options.update(optimize=True, progressive=True)
+        elif fmt == 'avif':
+            options = {'quality': AVIF_QUALITY}
+        elif fmt == 'png':
+            options = {'optimize': True}
+        temp = f"{target}.{threading.get_ident()}.tmp"
+        image.save(temp, format=fmt.upper(), **options)
+    os.replace(temp, target)  # Escritura atómica: otro worker nunca lee un archivo a medias
+
+
+class ImageProxy:
+    """Caché de imágenes en disco con tamaño máximo: al pasarse de `max_bytes` se borran
+    las imágenes usadas hace más tiempo (según su mtime, que se actualiza al servirlas a lo
+    sumo una vez cada `touch_interval` segundos) hasta bajar al 90 %."""
+    def __init__(self, cache_dir: str | None = None, http=None, max_bytes: int | None = None,
+                 touch_interval: float = 3600):
+        self.cache_dir: str = cache_dir or os.path.join(INSTANCE_DIR, 'images')
+        self.source_size: str = os.getenv('IMAGE_PROXY_SOURCE_SIZE', 'w780')
+        self.quality: int = int(os.getenv('IMAGE_QUALITY', 70))
+        self.max_bytes: int = max_bytes or int(os.getenv('IMAGE_CACHE_MAX_MB', 1024)) * 1024 * 1024
+        self.touch_interval: float = touch_interval
+        self.http = http or get_http_session()
+        self.timeout: tuple[float, float] = get_timeout()
+        # Bytes en disco según este proceso; None hasta recorrer la carpeta por primera vez
+        self._size: int | None = None
+        self._pruning: bool = False
+        self._size_lock = threading.Lock()
+
+    def parse_file_name(self, tmdb_path: str) -> tuple[str, str]:
+        """Valida la ruta de TMDB y devuelve (nombre, extensión)."""
+        match = _TMDB_FILE.match(tmdb_path)
+        if match is None:
+            raise ImageNotFoundError(f"Imagen no válida: {tmdb_path}", "error")
+        return match.group(1), match.group(2)
+
+    def get_original(self, tmdb_path: str) -> str:
+        """Devuelve la ruta en disco de la imagen original, descargándola si hace falta."""
+        name, extension = self.parse_file_name(tmdb_path)
+        path = os.path.join(self.cache_dir, 'original', f"{name}.{extension}")
+        if os.path.exists(path):
+            return self._touch(path)
+        return _image_jobs.do(path, lambda: self._download(name, extension, path))
+
+    def _download(self, name: str, extension: str, path: str) -> str:
+        url = f"{TMDB_IMAGE_URL}/{self.source_size}/{name}.{extension}"
+        response = self.http.get(url, timeout=self.timeout)
+        if response.status_code == 404:
+            raise ImageNotFoundError(f"La imagen {name} no existe en TMDB", "error")
+        if response.status_code != 200:
+            raise ErrorFetchImage(f"Error al descargar la imagen {name}: {response.status_code}", "error")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp = f"{path}.{threading.get_ident()}.tmp"
+        with open(temp, 'wb') as file:
+            file.write(response.content)
+        os.replace(temp, path)
+        self._added(path)
+        return path
+
+    def get_variant(self, tmdb_path: str, width: int, fmt: str) -> tuple[str, str]:
+        """Devuelve (ruta, mimetype) de la imagen redimensionada a `width` en `fmt`."""
+        name, _ = self.parse_file_name(tmdb_path)
+        path = os.path.join(self.cache_dir, str(width), f"{name}.{fmt}")
+        if supports(fmt) and os.path.exists(path):
+            # La variante ya existe: no hace falta el original (la limpieza pudo haberlo borrado)
+            return self._touch(path), MIMETYPES[fmt]
+        original = self.get_original(tmdb_path)
+        if not supports(fmt):
+            extension = os.path.splitext(original)[1].lstrip('.')
+            return original, MIMETYPES['png' if extension == 'png' else 'jpeg']
+        if not os.path.exists(path):
+            _image_jobs.do(path, lambda: self._save_variant(original, path, width, fmt))
+        return path, MIMETYPES[fmt]
+
+    def _save_variant(self, original: str, path: str, width: int, fmt: str):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        save_variant(original, path, width, fmt, self.quality)
+        self._added(path)
+
+    def _touch(self, path: str) -> str:
+        """Marca la imagen como usada para la limpieza, solo si la marca anterior ya es vieja."""
+        try:
+            if time.time() - os.path.getmtime(path) >= self.touch_interval:
+                os.utime(path)
+        except FileNotFoundError:
+            pass
+        return path
+
+    def _added(self, path: str):
+        """Suma un archivo nuevo al tamaño de la caché y, si se pasó del máximo (o aún no se
+        conoce el tamaño), la limpia en un hilo aparte."""
+        size = os.path.getsize(path)
+        with self._size_lock:
+            if self._size is not None:
+                self._size += size
+                if self._size <= self.max_bytes:
+                    return
+            if self._pruning:
+                return
+            self._pruning = True
+        threading.Thread(target=self.prune, name='image-cache-prune', daemon=True).start()
+
+    def prune(self):
+        """Borra las imágenes usadas hace más tiempo hasta dejar la carpeta en el 90 % de
+        `max_bytes`. Las usadas en el último `touch_interval` no se tocan: pueden estar
+        sirviéndose en este momento."""
+        total = None
+        try:
+            files = []
+            for root, _, names in os.walk(self.cache_dir):
+                for name in names:
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except FileNotFoundError:  # Otro worker la borró o la renombró
+                        continue
+                    files.append((stat.st_mtime, stat.st_size, path))
+            total = sum(size for _, size, _ in files)
+            if total > self.max_bytes:
+                target = self.max_bytes * 0.9
+                cutoff = time.time() - self.touch_interval
+                for mtime, size, path in sorted(files):
+                    if total <= target or mtime >= cutoff:
+                        break
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+                    total -= size
+        finally:
+            with self._size_lock:
+                if total is not None:
+                    self._size = total
+                self._pruning = False
+
+
+def proxy_path(url: str | None) -> str | None:
+    """Extrae la ruta de TMDB (p. ej. /abc.jpg) de una URL de imagen de TMDB."""
+    if not url or not url.startswith(TMDB_IMAGE_URL):
+        return None
+    return '/' + url.rsplit('/', 1)[-1]
+
+
+_image_proxy: ImageProxy | None = None
+
+
+def get_image_proxy() -> ImageProxy:
+    """Proxy de imágenes compartido por el proceso."""
+    global _image_proxy
+    if _image_proxy is None:
+        _image_proxy = ImageProxy()
+    return _image_proxy
@@ -0,0 +1,218 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Iterable
+from upstream import TMDB_HOST, TMDB_IMAGE_HOST, TRAKT_HOST
+
+# Métricas de rendimiento en formato Prometheus (sin dependencias externas) y tiempos por
+# solicitud para el header Server-Timing. Los valores son por proceso: Prometheus suma los
+# de cada worker al consultarlos.
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels: Iterable[tuple[str, str]]) -> str:
+    labels = list(labels)
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+
+class Counter:
+    """Contador acumulado, con etiquetas opcionales."""
+    type_name = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        self.name: str = name
+        self.documentation: str = documentation
+        self.labelnames: tuple[str, ...] = labelnames
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for key, value in values.items():
+            yield self.name, zip(self.labelnames, key), value
+
+
+class Histogram:
+    """Histograma de duraciones (u otros valores) por buckets acumulados, con etiquetas."""
+    type_name = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = (),
+                 buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name: str = name
+        self.documentation: str = documentation
+        self.labelnames: tuple[str, ...] = labelnames
+        self.buckets: tuple[float, ...] = buckets
+        self._values: dict[tuple, list] = {}  # etiquetas -> [conteo por bucket, suma, total]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            if index < len(self.buckets):
+                entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def samples(self):
+        with self._lock:
+            values = {key: (list(counts), total, count) for key, (counts, total, count) in self._values.items()}
+        for key, (counts, total, count) in values.items():
+            labels = list(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                yield f"{self.name}_bucket", labels + [('le', repr(float(bound)))], cumulative
+            yield f"{self.name}_bucket", labels + [('le', '+Inf')], count
+            yield f"{self.name}_sum", labels, total
+            yield f"{self.name}_count", labels, count
+
+
+class Registry:
+    """Conjunto de métricas del proceso más funciones que leen valores al momento de
+    exportar (contadores de cachés, estado del precargador, etc.)."""
+    def __init__(self):
+        self._metrics: list = []
+        self._collectors: list[Callable[[], Iterable[tuple[str, str, str, dict, float]]]] = []
+
+    def counter(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()) -> Counter:
+        metric = Counter(name, documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, documentation: str, labelnames: tuple[str, ...] = (),
+                  buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector: Callable[[], Iterable[tuple[str, str, str, dict, float]]]):
+        """Registra una función que produce `(nombre, tipo, ayuda, etiquetas, valor)`."""
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        """Exporta todas las métricas en el formato de texto de Prometheus."""
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type_name}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{_format_labels(labels)} {value}")
+        described = set()
+        for collector in self._collectors:
+            try:
+                samples = list(collector())
+            except Exception as e:
+                print(f"Error al leer métricas: {e}")
+                continue
+            for name, type_name, documentation, labels, value in samples:
+                if name not in described:
+                    described.add(name)
+                    lines.append(f"# HELP {name} {documentation}")
+                    lines.append(f"# TYPE {name} {type_name}")
+                lines.append(f"{name}{_format_labels(labels.items())} {value}")
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+upstream_seconds = registry.histogram(
+    'cinetraker_upstream_request_seconds', 'Duración de las solicitudes a Trakt y TMDB', ('host', 'status'))
+upstream_requests = registry.counter(
+    'cinetraker_upstream_requests_total', 'Solicitudes a Trakt y TMDB por código de estado', ('host', 'status'))
+upstream_retries = registry.counter(
+    'cinetraker_upstream_retries_total', 'Reintentos de solicitudes a Trakt y TMDB', ('host', 'reason'))
+upstream_bytes = registry.counter(
+    'cinetraker_upstream_response_bytes_total', 'Bytes recibidos de Trakt y TMDB', ('host',))
+rate_limit_wait_seconds = registry.histogram(
+    'cinetraker_rate_limit_wait_seconds', 'Espera en el planificador antes de cada solicitud', ('host',))
+enrichment_seconds = registry.histogram(
+    'cinetraker_enrichment_seconds', 'Duración de la obtención de posters de una lista', ('list',))
+enriched_movies = registry.counter(
+    'cinetraker_enriched_movies_total', 'Películas enriquecidas con poster', ('list',))
+image_errors = registry.counter(
+    'cinetraker_image_errors_total', 'Películas cuyas imágenes no se pudieron obtener de TMDB')
+render_seconds = registry.histogram(
+    'cinetraker_render_seconds', 'Duración del renderizado de plantillas (incluye el streaming)', ('template',))
+response_cache_requests = registry.counter(
+    'cinetraker_response_cache_total', 'Resultado de la caché de páginas de listas', ('result',))
+http_request_seconds = registry.histogram(
+    'cinetraker_http_request_seconds', 'Duración de las solicitudes atendidas por la aplicación',
+    ('endpoint', 'method', 'status'))
+
+# Tiempos de la solicitud en curso (nombre -> segundos) para el header Server-Timing
+_request_timings: ContextVar[dict[str, float] | None] = ContextVar('request_timings', default=None)
+_timings_lock = threading.Lock()
+
+
+def start_request_timing() -> dict[str, float]:
+    """Empieza a acumular los tiempos de la solicitud actual."""
+    timings: dict[str, float] = {}
+    _request_timings.set(timings)
+    return timings
+
+
+def add_timing(name: str, seconds: float):
+    """Suma `seconds` al tiempo `name` de la solicitud en curso, si la hay."""
+    timings = _request_timings.get()
+    if timings is not None:
+        with _timings_lock:
+            timings[name] = timings.get(name, 0.0) + seconds
+
+
+@contextmanager
+def timed(histogram: Histogram, timing_name: str | None = None, **labels):
+    """Mide el bloque en `histogram` y, opcionalmente, en el Server-Timing de la solicitud."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        histogram.observe(elapsed, **labels)
+        if timing_name is not None:
+            add_timing(timing_name, elapsed)
+
+
+def upstream_name(host: str | None) -> str:
+    """Nombre corto de un host para el Server-Timing (trakt, tmdb, tmdb-img)."""
+    return {
+        TRAKT_HOST: 'trakt',
+        TMDB_HOST: 'tmdb',
+        TMDB_IMAGE_HOST: 'tmdb-img',
+    }.get(host, host or 'upstream')
+
+
+def server_timing_header(timings: dict[str, float], total: float | None = None) -> str:
+    """Arma el valor del header Server-Timing (duraciones en milisegundos)."""
+    with _timings_lock:
+        items = list(timings.items())
+    if total is not None:
+        items.append(('total', total))
+    return ', '.join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in items)
+
+
+def record_upstream(host: str | None, status_code: int, seconds: float, size: int = 0):
+    """Registra una solicitud a Trakt/TMDB en las métricas y en el Server-Timing."""
+    upstream_seconds.observe(seconds, host=host, status=status_code)
+    upstream_requests.inc(host=host, status=status_code)
+    if size:
+        upstream_bytes.inc(size, host=host)
+    add_timing(upstream_name(host), seconds)
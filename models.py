@@ -0,0 +1,83 @@
+from dataclasses import dataclass
+from typing import Iterable, Iterator, overload
+
+DEFAULT_POSTER = "static/img/fondo_gris.jpg"
+
+
+@dataclass(slots=True)
+class Movie:
+    """Representa una película con su título, año, ids y poster."""
+    title: str
+    year: int | None
+    trakt_id: int | None = None
+    tmdb_id: int | None = None
+    poster_image: str | None = None
+
+    @classmethod
+    def from_trakt(cls, data: dict) -> 'Movie':
+        """Crea la película a partir del objeto `movie` de una respuesta de Trakt."""
+        ids = data.get('ids', {})
+        return cls(data['title'], data.get('year'), ids.get('trakt'), ids.get('tmdb'))
+
+    def set_poster(self, movie_images: list[str]) -> 'Movie':
+        """Asigna el primer backdrop como poster, o la imagen por defecto si no hay."""
+        self.poster_image = movie_images[0] if movie_images else DEFAULT_POSTER
+        return self
+
+    def __str__(self):
+        if self.poster_image:
+            return f"{self.title} ({self.year}) - Poster: {self.poster_image}"
+        return f"{self.title} ({self.year})"
+
+
+class MovieList:
+    """Representa una lista de películas, sin repetidos y con búsqueda por id de Trakt."""
+    __slots__ = ('name', 'movies', '_by_id')
+
+    def __init__(self, name: str, movies: Iterable[Movie] = ()):
+        self.name: str = name
+        self.movies: list[Movie] = []
+        self._by_id: dict[int, Movie] = {}
+        self.extend(movies)
+
+    def add(self, movie: Movie) -> bool:
+        """Agrega la película si no está en la lista; devuelve si se agregó."""
+        if movie.trakt_id is not None:
+            if movie.trakt_id in self._by_id:
+                return False
+            self._by_id[movie.trakt_id] = movie
+        self.movies.append(movie)
+        return True
+
+    def extend(self, movies: Iterable[Movie]):
+        for movie in movies:
+            self.add(movie)
+
+    def get(self, trakt_id: int) -> Movie | None:
+        """Busca una película por su id de Trakt."""
+        return self._by_id.get(trakt_id)
+
+    def __contains__(self, movie) -> bool:
+        trakt_id = movie.trakt_id if isinstance(movie, Movie) else movie
+        return trakt_id in self._by_id
+
+    @overload
+    def __getitem__(self, index: int) -> Movie: ...
+    @overload
+    def __getitem__(self, index: slice) -> 'MovieList': ...
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return MovieList(self.name, self.movies[index])
+        return self.movies[index]
+
+    def __iter__(self) -> Iterator[Movie]:
+        return iter(self.movies)
+
+    def __len__(self) -> int:
+        return len(self.movies)
+
+    def __bool__(self) -> bool:
+        return bool(self.movies)
+
+    def __repr__(self):
+        return f"MovieList({self.name!r}, {len(self.movies)} películas)"
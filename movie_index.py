@@ -0,0 +1,260 @@
+import bisect
+import os
+import re
+import threading
+import unicodedata
+from dataclasses import dataclass, replace
+from typing import Iterable
+from cache import LRUCache, SingleFlight
+from models import Movie
+
+# Búsqueda, filtro y orden sobre las listas de un usuario (?q=, ?year=, ?sort=) sin recorrer
+# ni volver a pedir la lista: cada lista sincronizada tiene un índice en memoria con los
+# trigramas y prefijos de los títulos, las películas por año y los órdenes ya calculados.
+# El índice se actualiza con cada sincronización y se reconstruye si otro proceso la cambió.
+
+SORTS = {
+    'default': "Orden de la lista",
+    'title': "Título (A-Z)",
+    '-title': "Título (Z-A)",
+    'year': "Más antiguas primero",
+    '-year': "Más recientes primero",
+}
+_YEAR = re.compile(r'^\s*(\d{4})\s*(?:-\s*(\d{4})\s*)?$')
+
+
+def normalize(text: str) -> str:
+    """Minúsculas, sin acentos ni signos: 'El Niño, ¡ya!' -> 'el nino ya'."""
+    text = unicodedata.normalize('NFKD', text.casefold())
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    return ' '.join(re.findall(r'\w+', text))
+
+
+def trigrams(word: str) -> set[str]:
+    return {word[i:i + 3] for i in range(len(word) - 2)}
+
+
+@dataclass(frozen=True, slots=True)
+class MovieQuery:
+    """Búsqueda, filtro por año y orden pedidos para una lista."""
+    text: str = ''
+    year_from: int | None = None
+    year_to: int | None = None
+    sort: str = 'default'
+
+    @classmethod
+    def parse(cls, q: str | None = None, year: str | None = None, sort: str | None = None) -> 'MovieQuery':
+        """Interpreta los parámetros de la URL; los valores inválidos se ignoran.
+        El año puede ser uno solo (1999) o un rango (1990-1999)."""
+        year_from = year_to = None
+        match = _YEAR.match(year or '')
+        if match:
+            year_from = int(match.group(1))
+            year_to = int(match.group(2) or match.group(1))
+            year_from, year_to = min(year_from, year_to), max(year_from, year_to)
+        return cls((q or '').strip()[:100], year_from, year_to, sort if sort in SORTS else 'default')
+
+    @property
+    def year(self) -> str:
+        if self.year_from is None:
+            return ''
+        if self.year_from == self.year_to:
+            return str(self.year_from)
+        return f"{self.year_from}-{self.year_to}"
+
+    def to_args(self) -> dict[str, str]:
+        """Parámetros de la URL que reproducen esta consulta (para la paginación)."""
+        args = {'q': self.text, 'year': self.year, 'sort': self.sort if self.sort != 'default' else ''}
+        return {name: value for name, value in args.items() if value}
+
+    def __bool__(self) -> bool:
+        return bool(self.text) or self.year_from is not None or self.sort != 'default'
+
+
+class MovieIndex:
+    """Índice en memoria de una lista de películas con su clave de orden (`sort_key`).
+
+    Los títulos se indexan por trigramas (búsqueda de subcadenas de 3 o más letras) y por
+    los prefijos de 1 y 2 letras de cada palabra; los años, en buckets; y los órdenes por
+    lista, título y año se mantienen ordenados al agregar películas."""
+    def __init__(self, entries: Iterable[tuple[Movie, str]] = (), descending: bool = False,
+                 version: str | None = None):
+        self.descending: bool = descending  # Sentido del orden por defecto de la lista
+        self.version: str | None = version  # Última actividad de Trakt que refleja el índice
+        self._movies: dict[int, Movie] = {}
+        self._sort_keys: dict[int, str] = {}
+        self._titles: dict[int, str] = {}  # Título normalizado
+        self._ids: dict[int, int] = {}  # trakt_id -> id interno
+        self._trigrams: dict[str, set[int]] = {}
+        self._prefixes: dict[str, set[int]] = {}
+        self._years: dict[int | None, set[int]] = {}
+        self._orders: dict[str, list[int]] = {}  # Se arman al primer uso
+        self._next_id: int = 0
+        self._lock = threading.RLock()
+        self.update(entries)
+
+    @classmethod
+    def from_movies(cls, movies: Iterable[Movie]) -> 'MovieIndex':
+        """Índice de una lista ya ordenada (p. ej. una lista global), en ese orden."""
+        return cls((movie, f"{position:08d}") for position, movie in enumerate(movies))
+
+    def _order_key(self, order: str):
+        # El id interno desempata: cada película tiene una posición única en cada orden
+        if order == 'title':
+            return lambda doc: (self._titles[doc], self._movies[doc].year or 0, doc)
+        if order == 'year':
+            return lambda doc: (self._movies[doc].year or 0, self._titles[doc], doc)
+        return lambda doc: (self._sort_keys[doc], doc)
+
+    def _order(self, order: str) -> list[int]:
+        if order not in self._orders:
+            self._orders[order] = sorted(self._movies, key=self._order_key(order))
+        return self._orders[order]
+
+    def update(self, entries: Iterable[tuple[Movie, str]], version: str | None = None):
+        """Agrega o actualiza películas; si una ya está se conserva la clave de orden mayor,
+        igual que en la copia local."""
+        with self._lock:
+            for movie, sort_key in entries:
+                doc = self._ids.get(movie.trakt_id) if movie.trakt_id is not None else None
+                if doc is not None:
+                    sort_key = max(sort_key, self._sort_keys[doc])
+                    self._remove(doc)
+                self._add(movie, sort_key)
+            if version is not None:
+                self.version = version
+
+    def _add(self, movie: Movie, sort_key: str):
+        doc = self._next_id
+        self._next_id += 1
+        title = normalize(movie.title or '')
+        self._movies[doc] = movie
+        self._sort_keys[doc] = sort_key
+        self._titles[doc] = title
+        if movie.trakt_id is not None:
+            self._ids[movie.trakt_id] = doc
+        for gram in self._grams(title):
+            self._trigrams.setdefault(gram, set()).add(doc)
+        for prefix in self._word_prefixes(title):
+            self._prefixes.setdefault(prefix, set()).add(doc)
+        self._years.setdefault(movie.year, set()).add(doc)
+        for order, docs in self._orders.items():
+            bisect.insort(docs, doc, key=self._order_key(order))
+
+    def _remove(self, doc: int):
+        movie = self._movies[doc]
+        title = self._titles[doc]
+        for order, docs in self._orders.items():
+            docs.pop(bisect.bisect_left(docs, self._order_key(order)(doc), key=self._order_key(order)))
+        for gram in self._grams(title):
+            self._trigrams[gram].discard(doc)
+        for prefix in self._word_prefixes(title):
+            self._prefixes[prefix].discard(doc)
+        self._years[movie.year].discard(doc)
+        if movie.trakt_id is not None:
+            del self._ids[movie.trakt_id]
+        del self._movies[doc], self._sort_keys[doc], self._titles[doc]
+
+    @staticmethod
+    def _grams(title: str) -> set[str]:
+        return set().union(*(trigrams(word) for word in title.split()))
+
+    @staticmethod
+    def _word_prefixes(title: str) -> set[str]:
+        return {word[:length] for word in title.split() for length in (1, 2) if len(word) >= length}
+
+    def _candidates(self, query: MovieQuery) -> set[int] | None:
+        """Películas que cumplen la búsqueda y el filtro, o None si no hay ninguno."""
+        sets = []
+        if query.year_from is not None:
+            sets.append(set().union(*(docs for year, docs in self._years.items()
+                                      if year is not None and query.year_from <= year <= query.year_to)))
+        for token in normalize(query.text).split():
+            if len(token) < 3:
+                sets.append(self._prefixes.get(token, set()))
+            else:
+                grams = [self._trigrams.get(gram, set()) for gram in trigrams(token)]
+                docs = set.intersection(*sorted(grams, key=len))
+                # Los trigramas solo preseleccionan: se verifica que el texto esté completo
+                sets.append({doc for doc in docs if token in self._titles[doc]})
+        if not sets:
+            return None
+        return set.intersection(*sorted(sets, key=len))
+
+    def search(self, query: MovieQuery, offset: int = 0, limit: int | None = None) -> tuple[list[Movie], int]:
+        """Devuelve una página de las películas que cumplen la consulta, en el orden pedido,
+        y el total de resultados. Las películas son copias: se les puede asignar poster."""
+        order = query.sort.lstrip('-')
+        reverse = query.sort.startswith('-') != (order == 'default' and self.descending)
+        end = None if limit is None else offset + limit
+        with self._lock:
+            candidates = self._candidates(query)
+            if candidates is None:
+                docs = self._order(order)
+                total = len(docs)
+                if reverse:
+                    start = 0 if end is None else max(0, total - end)
+                    page = docs[start:max(0, total - offset)][::-1]
+                else:
+                    page = docs[offset:end]
+            elif len(candidates) * 8 < len(self._movies):
+                # Pocos resultados: ordenarlos sale más barato que recorrer el orden completo
+                total = len(candidates)
+                page = sorted(candidates, key=self._order_key(order), reverse=reverse)[offset:end]
+            else:
+                docs = [doc for doc in self._order(order) if doc in candidates]
+                total = len(docs)
+                page = (docs[::-1] if reverse else docs)[offset:end]
+            return [replace(self._movies[doc]) for doc in page], total
+
+    def __len__(self) -> int:
+        return len(self._movies)
+
+
+class MovieIndexes:
+    """Índices de las listas sincronizadas de cada usuario, en una LRU del proceso."""
+    def __init__(self, max_size: int = 64):
+        self._cache = LRUCache(max_size)
+        self._builds = SingleFlight()
+
+    def get(self, store, user_id: str, list_name: str, descending: bool = False) -> MovieIndex:
+        """Índice de una lista de la copia local; se reconstruye si la lista cambió desde
+        otro proceso (su última actividad no coincide)."""
+        key = (user_id, list_name)
+        version = store.get_last_activity(user_id, list_name)
+        index = self._cache.get(key)
+        if index is None or index.version != version:
+            index = self._builds.do((key, version), lambda: self._build(store, key, descending, version))
+        return index
+
+    def _build(self, store, key: tuple[str, str], descending: bool, version: str | None) -> MovieIndex:
+        index = MovieIndex(store.get_entries(*key), descending, version)
+        self._cache.set(key, index)
+        return index
+
+    def update(self, user_id: str, list_name: str, entries: list[tuple[Movie, str]],
+               previous_version: str | None, version: str, replace: bool = False):
+        """Aplica al índice (si está en memoria) lo que se acaba de guardar en la copia
+        local. Si se reemplazó la lista o el índice no estaba al día, se descarta."""
+        key = (user_id, list_name)
+        index = self._cache.get(key)
+        if index is None:
+            return
+        if replace or index.version != previous_version:
+            self._cache.delete(key)
+            return
+        index.update(entries, version)
+
+
+_movie_indexes: MovieIndexes | None = None
+_movie_indexes_lock = threading.Lock()
+
+
+def get_movie_indexes() -> MovieIndexes:
+    """Índices de listas compartidos por el proceso."""
+    global _movie_indexes
+    if _movie_indexes is None:
+        with _movie_indexes_lock:
+            if _movie_indexes is None:
+                _movie_indexes = MovieIndexes(int(os.getenv('MOVIE_INDEX_SIZE', 64)))
+    return _movie_indexes
@@ -0,0 +1,72 @@
+from dataclasses import dataclass, replace
+from typing import Callable
+from errors.error import ListNotFoundError
+
+# Registro de las listas de películas: de qué endpoint de Trakt sale cada una, cómo se
+# extrae la película de cada elemento, cuántas se muestran y qué caché usa.
+# User.get_list() / get_list_page() procesan cualquier lista a partir de su ListSpec.
+
+CHART = 'chart'  # Lista global, igual para todos: caché compartida (ChartCache)
+SYNC = 'sync'  # Lista del usuario: copia local sincronizada (SyncStore)
+RELATED = 'related'  # Armada con las relacionadas de otras películas (caché de relacionadas)
+
+
+def movie_item(item: dict) -> dict:
+    """Elementos con la forma {'movie': {...}} (tendencia, vistas, seguimiento...)."""
+    return item['movie']
+
+
+def bare_item(item: dict) -> dict:
+    """Elementos que ya son la película (recomendadas, relacionadas)."""
+    return item
+
+
+@dataclass(frozen=True, slots=True)
+class ListSpec:
+    """Describe una lista de películas y cómo obtenerla."""
+    name: str
+    title: str  # Título que se muestra en la plantilla
+    endpoint: str  # Ruta en la API de Trakt; {user_id} se reemplaza por el slug del usuario
+    error_message: str
+    extractor: Callable[[dict], dict] = movie_item
+    limit: int | None = None  # Máximo de películas a mostrar (None = todas)
+    cache: str | None = None  # CHART, SYNC o None (sin caché de la lista)
+    descending: bool = False  # Orden de lectura de la copia local (solo SYNC)
+    movie_id: int | None = None  # Película de referencia (solo RELATED; None = las últimas vistas)
+
+
+LISTS: dict[str, ListSpec] = {spec.name: spec for spec in (
+    ListSpec('watchlist', "Películas por ver", "/users/{user_id}/watchlist/movies/rank",
+             "Error al obtener la lista de películas en seguimiento", cache=SYNC),
+    ListSpec('watched', "Películas Vistas", "/users/{user_id}/watched/movies",
+             "Error al obtener la lista de peliculas vistas", cache=SYNC, descending=True),
+    ListSpec('trend', "Películas en Tendencia", "/movies/trending",
+             "Error al obtener la lista de películas en tendencia", limit=10, cache=CHART),
+    ListSpec('favorited', "Películas Favoritas", "/movies/favorited/weekly",
+             "Error al obtener la lista de películas favoritas", cache=CHART),
+    ListSpec('cinema', "Películas en Cine", "/movies/boxoffice",
+             "Error al obtener la lista de películas en cartelera", limit=10, cache=CHART),
+    ListSpec('anticipated', "Películas próximas", "/movies/anticipated",
+             "Error al obtener la lista de películas próximas a estrenar", limit=10, cache=CHART),
+    ListSpec('recommended', "Películas Recomendadas",
+             "/recommendations/movies?ignore_collected=false&ignore_watchlisted=false",
+             "Error al obtener la lista de películas recomendadas", extractor=bare_item, limit=10),
+    ListSpec('related', "Relacionadas con lo que viste", "/movies/{trakt_id}/related",
+             "Error al obtener la lista de películas relacionadas", extractor=bare_item, cache=RELATED),
+)}
+
+
+def related_spec(trakt_id: int) -> ListSpec:
+    """Lista de las películas relacionadas con una película en particular."""
+    return replace(LISTS['related'], title="Películas relacionadas", movie_id=trakt_id)
+
+
+def get_list_spec(name: str | ListSpec) -> ListSpec:
+    """Busca una lista en el registro por su nombre (un ListSpec ya armado, como el de
+    related_spec, se devuelve tal cual)."""
+    if isinstance(name, ListSpec):
+        return name
+    try:
+        return LISTS[name]
+    except KeyError:
+        raise ListNotFoundError(f"La lista {name} no existe", "error")
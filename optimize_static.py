@@ -0,0 +1,40 @@
+"""Genera las variantes optimizadas de las imágenes de static/img en static/img/optimized.
+
+Uso (requiere Pillow):
+    python optimize_static.py
+
+Volver a ejecutarlo después de cambiar o agregar una imagen en STATIC_IMAGES.
+"""
+import os
+from image_proxy import save_variant, supports
+
+STATIC_IMG_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'img')
+OUTPUT_DIR = os.path.join(STATIC_IMG_DIR, 'optimized')
+QUALITY = int(os.getenv('IMAGE_QUALITY', 70))
+
+# Imagen: (ancho al que se muestra, formatos a generar). El último formato es el de respaldo.
+STATIC_IMAGES = {
+    'telon.jpg': (1920, ('avif', 'webp', 'jpeg')),
+    'fondo_gris.jpg': (400, ('avif', 'webp', 'jpeg')),
+    'CineTracker-removebg.png': (500, ('avif', 'webp', 'png')),
+}
+
+
+def main():
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    for file_name, (width, formats) in STATIC_IMAGES.items():
+        source = os.path.join(STATIC_IMG_DIR, file_name)
+        name = os.path.splitext(file_name)[0]
+        for fmt in formats:
+            if not supports(fmt):
+                print(f"Pillow no soporta {fmt}, se omite {file_name}")
+                continue
+            extension = 'jpg' if fmt == 'jpeg' else fmt
+            target = os.path.join(OUTPUT_DIR, f"{name}-{width}.{extension}")
+            save_variant(source, target, width, fmt, QUALITY)
+            print(f"{file_name} -> {os.path.relpath(target)}: "
+                  f"{os.path.getsize(source) / 1024:.0f} KiB -> {os.path.getsize(target) / 1024:.0f} KiB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,320 @@
+import contextvars
+import hashlib
+import heapq
+import itertools
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from email.utils import parsedate_to_datetime
+from datetime import datetime
+from cache import INSTANCE_DIR
+from errors.error import RateLimitError
+from metrics import registry
+from upstream import TMDB_HOST, TRAKT_HOST, url_host
+
+# Planificador de solicitudes a Trakt y TMDB: cada solicitud consume un token del bucket de su
+# token de acceso (Trakt autenticado) o de su host (Trakt sin usuario, TMDB). El estado vive en
+# SQLite para que todos los workers compartan el mismo presupuesto, y las cargas de páginas
+# tienen prioridad sobre las actualizaciones en segundo plano.
+
+INTERACTIVE = 0
+BACKGROUND = 10
+
+_priority: ContextVar[int] = ContextVar('request_priority', default=INTERACTIVE)
+
+
+@contextmanager
+def request_priority(priority: int):
+    """Marca las solicitudes hechas dentro del bloque con la prioridad dada."""
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def current_priority() -> int:
+    return _priority.get()
+
+
+def bind_context(fn):
+    """Envuelve `fn` para que al ejecutarse en otro hilo (p. ej. dentro de un
+    ThreadPoolExecutor) conserve el contexto de la solicitud actual: su prioridad y sus
+    tiempos para el Server-Timing."""
+    context = contextvars.copy_context()
+
+    def run(*args, **kwargs):
+        return context.copy().run(fn, *args, **kwargs)
+    return run
+
+
+def parse_rate(value: str) -> tuple[int, float]:
+    """Convierte 'solicitudes/segundos' (p. ej. '1000/300') en (capacidad, periodo)."""
+    count, period = value.split('/')
+    return int(count), float(period)
+
+
+def parse_retry_after(value: str | None) -> float | None:
+    """Segundos de espera del header Retry-After (número de segundos o fecha HTTP)."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_quota(headers) -> tuple[int | None, float | None]:
+    """Lee la cuota restante y el momento en que se renueva de los headers de respuesta:
+    X-Ratelimit (JSON de Trakt) o X-RateLimit-Remaining/Reset."""
+    trakt_limit = headers.get('X-Ratelimit')
+    if trakt_limit:
+        try:
+            data = json.loads(trakt_limit)
+            until = data.get('until')
+            reset_at = datetime.fromisoformat(until.replace('Z', '+00:00')).timestamp() if until else None
+            return data.get('remaining'), reset_at
+        except (ValueError, AttributeError):
+            return None, None
+    remaining = headers.get('X-RateLimit-Remaining')
+    reset = headers.get('X-RateLimit-Reset')
+    try:
+        return (int(remaining) if remaining is not None else None,
+                float(reset) if reset is not None else None)
+    except ValueError:
+        return None, None
+
+
+class RateLimiter:
+    """Token buckets guardados en SQLite y compartidos entre procesos."""
+    def __init__(self, path: str, reserve: float = 0.2):
+        self.path: str = path
+        # Fracción de cada bucket que las solicitudes en segundo plano no pueden usar
+        self.reserve: float = reserve
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with self._connection() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS buckets ("
+                "key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL, "
+                "blocked_until REAL NOT NULL DEFAULT 0, remaining INTEGER, reset_at REAL)"
+            )
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def reserve_token(self, buckets: list[tuple[str, int, float]], priority: int = INTERACTIVE) -> float:
+        """Intenta tomar un token de cada bucket `(clave, capacidad, periodo)`. Devuelve 0 si
+        lo consiguió, o los segundos que hay que esperar antes de volver a intentarlo."""
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")  # Lectura y escritura atómicas entre procesos
+        try:
+            now = time.time()
+            wait = 0.0
+            states = []
+            for key, capacity, period in buckets:
+                row = conn.execute("SELECT tokens, updated_at, blocked_until FROM buckets WHERE key = ?",
+                                   (key,)).fetchone()
+                tokens, updated_at, blocked_until = row or (capacity, now, 0)
+                rate = capacity / period
+                tokens = min(capacity, tokens + (now - updated_at) * rate)
+                needed = 1 + (capacity * self.reserve if priority >= BACKGROUND else 0)
+                wait = max(wait, blocked_until - now, (needed - tokens) / rate)
+                states.append((key, tokens - 1, now))
+            if wait <= 0:
+                conn.executemany(
+                    "INSERT INTO buckets (key, tokens, updated_at) VALUES (?, ?, ?) "
+                    "ON CONFLICT (key) DO UPDATE SET tokens = excluded.tokens, updated_at = excluded.updated_at",
+                    states,
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return max(0.0, wait)
+
+    def record_response(self, keys: list[str], status_code: int, headers):
+        """Actualiza los buckets con la respuesta: un 429 (o cuota agotada) bloquea el
+        bucket hasta que el servidor indique, y se guarda la cuota restante."""
+        now = time.time()
+        blocked_until = None
+        retry_after = parse_retry_after(headers.get('Retry-After'))
+        if status_code == 429:
+            blocked_until = now + (retry_after if retry_after is not None else 1.0)
+        remaining, reset_at = parse_quota(headers)
+        if remaining == 0 and reset_at is not None:
+            blocked_until = max(blocked_until or 0, reset_at)
+        if blocked_until is None and remaining is None:
+            return
+        with self._connection() as conn:
+            for key in keys:
+                conn.execute(
+                    "INSERT INTO buckets (key, tokens, updated_at, blocked_until, remaining, reset_at) "
+                    "VALUES (?, 0, ?, ?, ?, ?) ON CONFLICT (key) DO UPDATE SET "
+                    "blocked_until = MAX(blocked_until, excluded.blocked_until), "
+                    "remaining = COALESCE(excluded.remaining, remaining), "
+                    "reset_at = COALESCE(excluded.reset_at, reset_at)",
+                    (key, now, blocked_until or 0, remaining, reset_at),
+                )
+
+    def get_quota(self) -> dict[str, dict]:
+        """Estado de cada bucket: tokens, bloqueo y cuota restante informada por el servidor."""
+        rows = self._connection().execute(
+            "SELECT key, tokens, blocked_until, remaining, reset_at FROM buckets"
+        ).fetchall()
+        return {key: {"tokens": tokens, "blocked_until": blocked_until, "remaining": remaining,
+                      "reset_at": reset_at} for key, tokens, blocked_until, remaining, reset_at in rows}
+
+
+class RequestScheduler:
+    """Decide cuándo puede salir cada solicitud. Dentro del proceso, las que esperan al
+    mismo bucket forman una cola de prioridad: siempre intenta primero la de mayor prioridad.
+    Cada cola tiene su propio lock, y la reserva en SQLite se hace sin tenerlo tomado: una
+    espera por el lock de escritura de otro worker no frena a las solicitudes de otros buckets."""
+    def __init__(self, limiter: RateLimiter, host_limits: dict[str, tuple[int, float]],
+                 token_limit: tuple[int, float], max_wait: float = 10):
+        self.limiter: RateLimiter = limiter
+        self.host_limits: dict[str, tuple[int, float]] = host_limits
+        self.token_limit: tuple[int, float] = token_limit
+        self.max_wait: float = max_wait  # Más espera que esto se reporta como error
+        # Cola de cada bucket: su condición y el heap de tickets (prioridad, orden de llegada)
+        self._queues: dict[str, tuple[threading.Condition, list]] = {}
+        self._queues_lock = threading.Lock()
+        self._sequence = itertools.count()
+
+    def get_buckets(self, url: str, headers) -> list[tuple[str, int, float]]:
+        """Buckets que consume una solicitud: el de su token de Trakt o el de su host."""
+        authorization = (headers or {}).get('Authorization')
+        if authorization:
+            identity = hashlib.sha256(authorization.encode()).hexdigest()[:16]
+            return [(f"token:{identity}", *self.token_limit)]
+        host = url_host(url)
+        if host in self.host_limits:
+            return [(f"host:{host}", *self.host_limits[host])]
+        return []
+
+    def acquire(self, buckets: list[tuple[str, int, float]], priority: int | None = None):
+        """Bloquea el hilo hasta que la solicitud pueda salir."""
+        if not buckets:
+            return
+        priority = current_priority() if priority is None else priority
+        queue_key = buckets[0][0]
+        ticket = (priority, next(self._sequence))
+        deadline = time.monotonic() + self.max_wait
+        with self._queues_lock:
+            condition, queue = self._queues.setdefault(queue_key, (threading.Condition(), []))
+            with condition:
+                heapq.heappush(queue, ticket)
+        try:
+            while True:
+                with condition:
+                    while queue[0] != ticket:
+                        # Espera su turno detrás de una solicitud más prioritaria
+                        self._check_deadline(deadline, 0.05)
+                        condition.wait(0.05)
+                # La reserva (BEGIN IMMEDIATE en SQLite) va fuera del lock de la cola
+                wait = self.limiter.reserve_token(buckets, priority)
+                if wait <= 0:
+                    return
+                self._check_deadline(deadline, wait)
+                with condition:
+                    condition.wait(wait)
+        finally:
+            with self._queues_lock:
+                with condition:
+                    queue.remove(ticket)
+                    heapq.heapify(queue)
+                    condition.notify_all()
+                if not queue:
+                    del self._queues[queue_key]
+
+    @staticmethod
+    def _check_deadline(deadline: float, wait: float):
+        if time.monotonic() + wait > deadline:
+            raise RateLimitError("Se alcanzó el límite de solicitudes, inténtalo en unos segundos", "error")
+
+    async def acquire_async(self, buckets: list[tuple[str, int, float]], priority: int | None = None):
+        """Versión asíncrona de acquire para el cliente httpx (sin bloquear el event loop)."""
+        import asyncio  # Diferido: solo lo necesita el cliente httpx
+
+        if not buckets:
+            return
+        priority = current_priority() if priority is None else priority
+        deadline = time.monotonic() + self.max_wait
+        while True:
+            wait = await asyncio.to_thread(self.limiter.reserve_token, buckets, priority)
+            if wait <= 0:
+                return
+            if time.monotonic() + wait > deadline:
+                raise RateLimitError("Se alcanzó el límite de solicitudes, inténtalo en unos segundos", "error")
+            await asyncio.sleep(wait)
+
+    def record_response(self, buckets: list[tuple[str, int, float]], status_code: int, headers):
+        if buckets:
+            self.limiter.record_response([key for key, _, _ in buckets], status_code, headers)
+
+    async def record_response_async(self, buckets: list[tuple[str, int, float]], status_code: int, headers):
+        """Versión asíncrona de record_response: la escritura en SQLite va en un hilo aparte."""
+        import asyncio  # Diferido: solo lo necesita el cliente httpx
+
+        if buckets:
+            await asyncio.to_thread(self.record_response, buckets, status_code, headers)
+
+
+_scheduler: RequestScheduler | None = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> RequestScheduler | None:
+    """Planificador compartido por el proceso, o None si RATE_LIMIT=0."""
+    global _scheduler
+    if os.getenv('RATE_LIMIT', '1') == '0':
+        return None
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                # Trakt: 1000 GET cada 5 minutos por usuario o por IP; TMDB: unas 50 por segundo
+                _scheduler = RequestScheduler(
+                    RateLimiter(os.path.join(INSTANCE_DIR, 'rate_limits.sqlite3'),
+                                reserve=float(os.getenv('RATE_LIMIT_RESERVE', 0.2))),
+                    host_limits={
+                        TRAKT_HOST: parse_rate(os.getenv('TRAKT_RATE_LIMIT', '1000/300')),
+                        TMDB_HOST: parse_rate(os.getenv('TMDB_RATE_LIMIT', '40/1')),
+                    },
+                    token_limit=parse_rate(os.getenv('TRAKT_TOKEN_RATE_LIMIT', '1000/300')),
+                    max_wait=float(os.getenv('RATE_LIMIT_MAX_WAIT', 10)),
+                )
+    return _scheduler
+
+
+def collect_rate_limit_metrics():
+    """Exporta el estado de los buckets por host (los de cada token se omiten para no
+    crear una serie por usuario)."""
+    if _scheduler is None:
+        return
+    for key, state in _scheduler.limiter.get_quota().items():
+        if not key.startswith('host:'):
+            continue
+        host = key.removeprefix('host:')
+        yield ("cinetraker_rate_limit_tokens", "gauge", "Tokens disponibles en el bucket del host",
+               {"host": host}, state["tokens"])
+        if state["remaining"] is not None:
+            yield ("cinetraker_rate_limit_remaining", "gauge", "Cuota restante informada por el servidor",
+                   {"host": host}, state["remaining"])
+
+
+registry.add_collector(collect_rate_limit_metrics)
@@ -0,0 +1,211 @@
+import json
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable
+from cache import INSTANCE_DIR, AsyncSingleFlight, LRUCache, SingleFlight
+from errors.error import TokenRequestError
+
+# Sesiones del lado del servidor: la cookie de Flask solo lleva el id de la sesión y aquí se
+# guardan el token de acceso, el de renovación, su vencimiento y el perfil del usuario. Los
+# tokens se renuevan solos antes de vencer, y cada sesión conserva en memoria sus objetos
+# (p. ej. el cliente del usuario) entre solicitudes.
+
+
+@dataclass(slots=True)
+class UserSession:
+    """Sesión de un usuario autenticado en Trakt."""
+    session_id: str
+    access_token: str
+    refresh_token: str | None = None
+    expires_at: float | None = None  # Vencimiento del token de acceso (epoch)
+    profile: dict[str, str] | None = None
+    # Objetos asociados a la sesión en este proceso (clientes, cachés); no se guardan en disco
+    state: dict = field(default_factory=dict)
+
+    def needs_refresh(self, margin: float) -> bool:
+        """Indica si el token vence en menos de `margin` segundos y se puede renovar."""
+        return (self.refresh_token is not None and self.expires_at is not None
+                and self.expires_at - time.time() < margin)
+
+    def is_expired(self) -> bool:
+        return self.expires_at is not None and self.expires_at <= time.time()
+
+
+def token_expiry(token_data: dict) -> float | None:
+    """Vencimiento del token según la respuesta de /oauth/token (created_at + expires_in)."""
+    if 'expires_in' not in token_data:
+        return None
+    return token_data.get('created_at', time.time()) + token_data['expires_in']
+
+
+class SessionStore:
+    """Sesiones en SQLite (compartidas entre workers) con una LRU en memoria delante.
+
+    Las entradas en memoria duran `memory_ttl` segundos para ver a tiempo los tokens que
+    renovó otro proceso."""
+    def __init__(self, path: str, memory_size: int = 1024, memory_ttl: float = 300,
+                 refresh_margin: float = 24 * 3600, max_age: float = 90 * 24 * 3600):
+        self.path: str = path
+        self.memory: LRUCache = LRUCache(memory_size)
+        self.memory_ttl: float = memory_ttl
+        self.refresh_margin: float = refresh_margin  # Se renueva el token si vence antes de esto
+        self.max_age: float = max_age  # Sesiones sin renovar por más tiempo se borran
+        self._local = threading.local()
+        self._refreshes = SingleFlight()
+        self._async_refreshes = AsyncSingleFlight()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with self._connection() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "session_id TEXT PRIMARY KEY, access_token TEXT NOT NULL, refresh_token TEXT, "
+                "expires_at REAL, profile TEXT, updated_at REAL NOT NULL)"
+            )
+
+    def _connection(self) -> sqlite3.Connection:
+        """Cada hilo usa su propia conexión; WAL permite lectores y escritores concurrentes."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _save(self, user_session: UserSession):
+        with self._connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO sessions (session_id, access_token, refresh_token, expires_at, profile, "
+                "updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (user_session.session_id, user_session.access_token, user_session.refresh_token,
+                 user_session.expires_at, json.dumps(user_session.profile), time.time()),
+            )
+        self.memory.set(user_session.session_id, user_session, self.memory_ttl)
+
+    def create(self, token_data: dict, profile: dict[str, str] | None = None) -> UserSession:
+        """Crea una sesión con los tokens de /oauth/token y el perfil del usuario."""
+        self.purge()
+        user_session = UserSession(secrets.token_urlsafe(32), token_data['access_token'],
+                                   token_data.get('refresh_token'), token_expiry(token_data), profile)
+        self._save(user_session)
+        return user_session
+
+    def get(self, session_id: str | None, reload: bool = False) -> UserSession | None:
+        """Busca una sesión por su id; con `reload` se lee de disco aunque esté en memoria."""
+        if not session_id:
+            return None
+        if not reload:
+            user_session = self.memory.get(session_id)
+            if user_session is not None:
+                return user_session
+        row = self._connection().execute(
+            "SELECT access_token, refresh_token, expires_at, profile FROM sessions WHERE session_id = ?",
+            (session_id,),
+        ).fetchone()
+        if row is None:
+            self.memory.delete(session_id)
+            return None
+        access_token, refresh_token, expires_at, profile = row
+        cached = self.memory.get(session_id)
+        if cached is not None and cached.access_token == access_token:
+            return cached  # Sigue vigente: se conservan sus objetos en memoria
+        user_session = UserSession(session_id, access_token, refresh_token, expires_at, json.loads(profile))
+        self.memory.set(session_id, user_session, self.memory_ttl)
+        return user_session
+
+    async def get_async(self, session_id: str | None) -> UserSession | None:
+        """Versión de get para el modo asíncrono: solo se sale del event loop si la sesión
+        no está en memoria y hay que leerla de SQLite."""
+        user_session = self.memory.get(session_id) if session_id else None
+        if user_session is not None:
+            return user_session
+        import asyncio  # Solo el modo asíncrono lo usa; no se carga al arrancar la app Flask
+        return await asyncio.to_thread(self.get, session_id)
+
+    def update_tokens(self, user_session: UserSession, token_data: dict) -> UserSession:
+        """Guarda los tokens renovados; los objetos en memoria se descartan porque usan el anterior."""
+        updated = UserSession(user_session.session_id, token_data['access_token'],
+                              token_data.get('refresh_token', user_session.refresh_token),
+                              token_expiry(token_data), user_session.profile)
+        self._save(updated)
+        return updated
+
+    def refresh(self, user_session: UserSession, refresh: Callable[[str], dict]) -> UserSession:
+        """Renueva el token de la sesión con `refresh(refresh_token)`. Si otro hilo ya lo está
+        renovando se espera su resultado, y si otro proceso ya lo hizo se usa el suyo."""
+        return self._refreshes.do(user_session.session_id,
+                                  lambda: self._refresh(user_session.session_id, refresh))
+
+    def _refresh(self, session_id: str, refresh: Callable[[str], dict]) -> UserSession | None:
+        current = self.get(session_id, reload=True)
+        if current is None or not current.needs_refresh(self.refresh_margin):
+            return current
+        try:
+            return self.update_tokens(current, refresh(current.refresh_token))
+        except TokenRequestError:
+            return self._refreshed_elsewhere(current)
+
+    async def refresh_async(self, user_session: UserSession,
+                            refresh: Callable[[str], Awaitable[dict]]) -> UserSession:
+        """Versión asíncrona de refresh, para el modo ASGI; los accesos a SQLite van en un hilo aparte."""
+        import asyncio
+
+        async def load():
+            current = await asyncio.to_thread(self.get, user_session.session_id, True)
+            if current is None or not current.needs_refresh(self.refresh_margin):
+                return current
+            try:
+                token_data = await refresh(current.refresh_token)
+            except TokenRequestError:
+                return await asyncio.to_thread(self._refreshed_elsewhere, current)
+            return await asyncio.to_thread(self.update_tokens, current, token_data)
+
+        return await self._async_refreshes.do(user_session.session_id, load)
+
+    def _refreshed_elsewhere(self, current: UserSession) -> UserSession:
+        """Si la renovación falló porque otro proceso ya usó el token de renovación, se toma
+        la sesión que guardó; si no, el error sigue su curso."""
+        latest = self.get(current.session_id, reload=True)
+        if latest is not None and latest.access_token != current.access_token:
+            return latest
+        raise TokenRequestError("Error al renovar el token de acceso", "error")
+
+    def delete(self, session_id: str):
+        with self._connection() as conn:
+            conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+        self.memory.delete(session_id)
+
+    def purge(self):
+        """Borra las sesiones que no se renovaron en `max_age` y las vencidas sin token de renovación."""
+        now = time.time()
+        with self._connection() as conn:
+            conn.execute(
+                "DELETE FROM sessions WHERE updated_at < ? OR (refresh_token IS NULL AND expires_at < ?)",
+                (now - self.max_age, now),
+            )
+
+    def count(self) -> int:
+        return self._connection().execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+
+_session_store: SessionStore | None = None
+_session_store_lock = threading.Lock()
+
+
+def get_session_store() -> SessionStore:
+    """Devuelve el almacén de sesiones compartido por el proceso."""
+    global _session_store
+    if _session_store is None:
+        with _session_store_lock:
+            if _session_store is None:
+                _session_store = SessionStore(
+                    os.path.join(INSTANCE_DIR, 'sessions.sqlite3'),
+                    memory_size=int(os.getenv('SESSION_CACHE_SIZE', 1024)),
+                    memory_ttl=float(os.getenv('SESSION_CACHE_TTL', 300)),
+                    refresh_margin=float(os.getenv('TOKEN_REFRESH_MARGIN', 24 * 3600)),
+                    max_age=float(os.getenv('SESSION_MAX_AGE', 90 * 24 * 3600)),
+                )
+    return _session_store
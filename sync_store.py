@@ -0,0 +1,161 @@
+import os
+import sqlite3
+import threading
+from cache import INSTANCE_DIR
+from models import Movie
+from movie_index import get_movie_indexes
+
+# Campo de /sync/last_activities que cambia con cada lista sincronizada
+LIST_ACTIVITIES = {'watched': 'watched_at', 'watchlist': 'watchlisted_at'}
+
+
+class SyncStore:
+    """Copia local (SQLite) de las listas de películas de cada usuario de Trakt,
+    junto con la marca de tiempo de la última actividad sincronizada."""
+    def __init__(self, path: str):
+        self.path: str = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with self._connection() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS sync_state ("
+                "user_id TEXT NOT NULL, list_name TEXT NOT NULL, last_activity TEXT, "
+                "PRIMARY KEY (user_id, list_name))"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS movies ("
+                "user_id TEXT NOT NULL, list_name TEXT NOT NULL, trakt_id INTEGER NOT NULL, "
+                "tmdb_id INTEGER, title TEXT, year INTEGER, sort_key TEXT, "
+                "PRIMARY KEY (user_id, list_name, trakt_id))"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS movies_sort ON movies (user_id, list_name, sort_key)"
+            )
+
+    def _connection(self) -> sqlite3.Connection:
+        """Cada hilo usa su propia conexión; WAL permite lectores y escritores concurrentes."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get_last_activity(self, user_id: str, list_name: str) -> str | None:
+        row = self._connection().execute(
+            "SELECT last_activity FROM sync_state WHERE user_id = ? AND list_name = ?",
+            (user_id, list_name),
+        ).fetchone()
+        return row[0] if row else None
+
+    def pending_activity(self, user_id: str, list_name: str, activities: dict) -> tuple[str, str | None] | None:
+        """Compara la actividad de Trakt (/sync/last_activities) con la guardada. Devuelve
+        `(remota, local)` si la lista cambió desde la última sincronización, o None."""
+        remote_activity = activities['movies'][LIST_ACTIVITIES[list_name]]
+        local_activity = self.get_last_activity(user_id, list_name)
+        if remote_activity == local_activity:
+            return None
+        return remote_activity, local_activity
+
+    def save_movies(self, user_id: str, list_name: str, movies: list[tuple[Movie, str]],
+                    last_activity: str, replace: bool = False):
+        """Guarda las películas `(movie, sort_key)` de una lista y la marca de la última
+        actividad en una sola transacción. Con `replace` se descarta lo que había antes."""
+        rows = [
+            (user_id, list_name, movie.trakt_id, movie.tmdb_id, movie.title, movie.year, sort_key)
+            for movie, sort_key in movies
+        ]
+        previous_activity = self.get_last_activity(user_id, list_name)
+        with self._connection() as conn:
+            if replace:
+                conn.execute("DELETE FROM movies WHERE user_id = ? AND list_name = ?", (user_id, list_name))
+            # Si una película llega repetida (varias reproducciones) se conserva la clave más reciente
+            conn.executemany(
+                "INSERT INTO movies (user_id, list_name, trakt_id, tmdb_id, title, year, sort_key) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (user_id, list_name, trakt_id) DO UPDATE SET "
+                "tmdb_id = excluded.tmdb_id, title = excluded.title, year = excluded.year, "
+                "sort_key = MAX(sort_key, excluded.sort_key)",
+                rows,
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO sync_state (user_id, list_name, last_activity) VALUES (?, ?, ?)",
+                (user_id, list_name, last_activity),
+            )
+        # El índice de búsqueda en memoria se actualiza con solo lo que llegó
+        get_movie_indexes().update(user_id, list_name, movies, previous_activity, last_activity, replace)
+
+    def merge_history(self, user_id: str, movies: list[tuple[Movie, str]], last_activity: str,
+                      watched_count: int) -> bool:
+        """Agrega a las vistas las reproducciones nuevas del historial, solo si con ellas la
+        copia local queda con tantas películas como informa Trakt. Si no coinciden (p. ej. se
+        borró historial además de ver algo nuevo) no guarda nada y devuelve False, para que
+        se descargue la lista completa."""
+        trakt_ids = self.get_trakt_ids(user_id, 'watched') | {movie.trakt_id for movie, _ in movies}
+        if len(trakt_ids) != watched_count:
+            return False
+        self.save_movies(user_id, 'watched', movies, last_activity)
+        return True
+
+    def get_movies(self, user_id: str, list_name: str, offset: int = 0, limit: int | None = None,
+                   descending: bool = False) -> list[Movie]:
+        """Devuelve las películas guardadas de una lista, en su orden."""
+        order = "DESC" if descending else "ASC"
+        rows = self._connection().execute(
+            "SELECT trakt_id, tmdb_id, title, year FROM movies WHERE user_id = ? AND list_name = ? "
+            f"ORDER BY sort_key {order} LIMIT ? OFFSET ?",
+            (user_id, list_name, -1 if limit is None else limit, offset),
+        ).fetchall()
+        return [Movie(title, year, trakt_id, tmdb_id) for trakt_id, tmdb_id, title, year in rows]
+
+    def get_entries(self, user_id: str, list_name: str) -> list[tuple[Movie, str]]:
+        """Devuelve todas las películas de una lista con su clave de orden (para indexarlas)."""
+        rows = self._connection().execute(
+            "SELECT trakt_id, tmdb_id, title, year, sort_key FROM movies WHERE user_id = ? AND list_name = ? "
+            "ORDER BY sort_key",
+            (user_id, list_name),
+        ).fetchall()
+        return [(Movie(title, year, trakt_id, tmdb_id), sort_key) for trakt_id, tmdb_id, title, year, sort_key in rows]
+
+    def get_trakt_ids(self, user_id: str, list_name: str) -> set[int]:
+        """Ids de Trakt de las películas de una lista (para saber cuáles ya tiene el usuario)."""
+        rows = self._connection().execute(
+            "SELECT trakt_id FROM movies WHERE user_id = ? AND list_name = ?", (user_id, list_name)
+        ).fetchall()
+        return {trakt_id for trakt_id, in rows}
+
+    def count_movies(self, user_id: str, list_name: str) -> int:
+        return self._connection().execute(
+            "SELECT COUNT(*) FROM movies WHERE user_id = ? AND list_name = ?", (user_id, list_name)
+        ).fetchone()[0]
+
+
+def history_rows(items: list[dict]) -> list[tuple[Movie, str]]:
+    """Filas `(movie, sort_key)` de una página de /sync/history: una por reproducción."""
+    return [(Movie.from_trakt(item['movie']), item['watched_at']) for item in items]
+
+
+def watched_rows(items: list[dict]) -> list[tuple[Movie, str]]:
+    """Filas `(movie, sort_key)` de /sync/watched, ordenadas por la última reproducción."""
+    return [(Movie.from_trakt(item['movie']), item['last_watched_at']) for item in items]
+
+
+def watchlist_rows(items: list[dict]) -> list[tuple[Movie, str]]:
+    """Filas `(movie, sort_key)` de la lista de seguimiento, en el orden (`rank`) de Trakt."""
+    return [(Movie.from_trakt(item['movie']), f"{item.get('rank', position):08d}")
+            for position, item in enumerate(items)]
+
+
+_sync_store: SyncStore | None = None
+_sync_store_lock = threading.Lock()
+
+
+def get_sync_store() -> SyncStore:
+    """Devuelve el almacén de sincronización compartido por el proceso."""
+    global _sync_store
+    if _sync_store is None:
+        with _sync_store_lock:
+            if _sync_store is None:
+                _sync_store = SyncStore(os.path.join(INSTANCE_DIR, 'trakt_sync.sqlite3'))
+    return _sync_store
@@ -0,0 +1,19 @@
+import os
+from urllib.parse import urlsplit
+
+# URLs base de Trakt y TMDB. Se pueden cambiar por variables de entorno para apuntar la
+# aplicación a otro servidor, p. ej. el servidor falso de benchmarks/fake_upstream.py.
+
+TRAKT_API_URL = os.getenv('TRAKT_API_URL', 'https://api.trakt.tv').rstrip('/')
+TMDB_API_URL = os.getenv('TMDB_API_URL', 'https://api.themoviedb.org/3').rstrip('/')
+TMDB_IMAGE_URL = os.getenv('TMDB_IMAGE_URL', 'https://image.tmdb.org/t/p').rstrip('/')
+
+
+def url_host(url: str) -> str:
+    """Host (con puerto, si lo tiene) de una URL: es la clave de los límites y métricas."""
+    return urlsplit(url).netloc
+
+
+TRAKT_HOST = url_host(TRAKT_API_URL)
+TMDB_HOST = url_host(TMDB_API_URL)
+TMDB_IMAGE_HOST = url_host(TMDB_IMAGE_URL)
@@ -0,0 +1,36 @@
+from typing import Callable
+from models import DEFAULT_POSTER
+from movie_index import MovieQuery
+
+# Ayudantes compartidos por app.py (Flask) y asgi_app.py (Quart). No importan ningún
+# framework: reciben `request.args`, la configuración o `url_for` de cada aplicación.
+
+MAX_PER_PAGE = 200
+# Las imágenes de TMDB nunca cambian bajo el mismo nombre: el navegador puede guardarlas un año
+IMAGE_MAX_AGE = 365 * 24 * 3600
+# Segundos que se pide esperar (Retry-After) cuando no hubo cupo en los límites de Trakt/TMDB
+RATE_LIMIT_RETRY_AFTER = 5
+
+
+def get_page_args(args, default_per_page: int) -> tuple[int, int]:
+    """Lee los parámetros ?page= y ?per_page= de la solicitud, con límites razonables."""
+    page = max(1, args.get('page', 1, type=int))
+    per_page = args.get('per_page', default_per_page, type=int)
+    return page, min(max(1, per_page), MAX_PER_PAGE)
+
+
+def get_list_query(args) -> MovieQuery:
+    """Lee los parámetros ?q= (título), ?year= (año o rango) y ?sort= de la solicitud."""
+    return MovieQuery.parse(args.get('q'), args.get('year'), args.get('sort'))
+
+
+def card_image(url: str | None, url_for: Callable[..., str]) -> str | None:
+    """Convierte la URL de un poster en la de su variante optimizada para las tarjetas."""
+    from image_proxy import proxy_path
+
+    if url == DEFAULT_POSTER:
+        return url_for('static', filename='img/optimized/fondo_gris-400.webp')
+    tmdb_path = proxy_path(url)
+    if tmdb_path is None:
+        return url
+    return url_for('tmdb_image', tmdb_path=tmdb_path.lstrip('/'))
@@ -0,0 +1,35 @@
+"""Precarga las cachés compartidas (metadatos de TMDB en SQLite y variantes del proxy de
+imágenes en instance/) desde un proceso aparte de la aplicación.
+
+Uso:
+    python warm_cache.py            # Recarga las listas globales cada CHART_REFRESH_INTERVAL
+    python warm_cache.py --once     # Una sola pasada, útil después de un despliegue
+
+Los workers web siguen cargando la lista en su propia memoria, pero sus posters ya están en
+caché, así que ninguna página hace un enriquecimiento en frío.
+"""
+import argparse
+import os
+from dotenv import load_dotenv
+from cache_warmer import CacheWarmer
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--once', action='store_true', help='Hacer una sola pasada y terminar')
+    parser.add_argument('--interval', type=float, default=None, help='Segundos entre pasadas')
+    args = parser.parse_args()
+
+    load_dotenv()
+    interval = args.interval or float(os.getenv('CHART_REFRESH_INTERVAL', 600))
+    warmer = CacheWarmer(os.getenv('CLIENT_ID'), interval=interval,
+                         warm_images=os.getenv('WARM_IMAGES', '1') != '0')
+    if args.once:
+        warmer.warm_charts()
+        print(warmer.get_stats())
+    else:
+        warmer.run_forever()
+
+
+if __name__ == '__main__':
+    main()